@@ -0,0 +1,63 @@
+"""Compare row based (`pd.read_sql_query`) and Arrow based result fetching.
+
+Usage:
+    python benchmarks/bench_arrow_fetch.py                     # local DuckDB file
+    python benchmarks/bench_arrow_fetch.py --source default    # a source from config.yaml
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from querygpt.config.config import DuckDBDatabaseConfig, init_config
+from querygpt.core import init_database_from_config
+from querygpt.core._database import DuckDBDatabase
+
+QUERIES = {
+    "duckdb": """select range as id, range * 1.5 as amount, md5(range::varchar) as label,
+                 now() - to_seconds(range) as created_at from range({rows})""",
+    "postgres": """select g as id, g * 1.5 as amount, md5(g::text) as label,
+                   now() - make_interval(secs => g) as created_at from generate_series(1, {rows}) g""",
+    "oracle": """select level as id, level * 1.5 as amount, standard_hash(to_char(level), 'MD5') as label,
+                 systimestamp - numtodsinterval(level, 'SECOND') as created_at from dual connect by level <= {rows}""",
+}
+
+
+def _timeit(func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--source", help="name of a source in config.yaml, defaults to a temporary DuckDB file")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.source:
+        config = init_config()
+        source = next(source for source in config.sources if source.name == args.source)
+        database = init_database_from_config(source.database)
+    else:
+        path = Path(tempfile.mkdtemp()) / "bench.duckdb"
+        database = DuckDBDatabase(DuckDBDatabaseConfig(engine="duckdb", path=str(path), ddl_query_path=""))
+
+    query = QUERIES[database.engine].format(rows=args.rows)
+    results = {
+        "pd.read_sql_query": _timeit(lambda: database.execute_query(query, use_arrow=False), args.repeat),
+        "fetch_arrow": _timeit(lambda: database.fetch_arrow(query), args.repeat),
+        "fetch_arrow + to_pandas": _timeit(lambda: database.execute_query(query, use_arrow=True), args.repeat),
+    }
+    baseline = results["pd.read_sql_query"]
+    print(f"{database.engine}, {args.rows:,} rows, best of {args.repeat}")
+    for name, seconds in results.items():
+        print(f"  {name:<25} {seconds:8.3f}s  {baseline / seconds:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
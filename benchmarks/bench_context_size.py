@@ -0,0 +1,90 @@
+"""Compare the context `sql_generator` receives per question, with single stage and two-stage retrieval.
+
+Runs against the sources and index of the configuration, the table level collection must exist:
+set `index.two_stage: true` and run `querygpt generate` first. Tokens are counted with tiktoken
+when it is installed, otherwise estimated as 4 characters per token.
+
+Usage:
+    python benchmarks/bench_context_size.py
+    python benchmarks/bench_context_size.py --questions questions.txt --top-tables 3
+"""
+import argparse
+import json
+
+from querygpt.config.config import init_config
+from querygpt.core import init_database_from_config, init_internal_database_from_config
+from querygpt.core.index import get_index, get_table_index
+from querygpt.core.retreivers import get_context, get_context_many
+
+# pagila, the example database
+_QUESTIONS = [
+    "who is the most valuable customer",
+    "monthly revenue by store",
+    "which films were never rented",
+    "average rental duration per film category",
+    "top 5 actors by number of films",
+    "customers with overdue rentals",
+    "how many payments were made per staff member",
+    "which city has the most customers",
+]
+
+
+def _token_counter():
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding("cl100k_base")
+        return lambda text: len(encoding.encode(text)), "tiktoken cl100k_base"
+    except ImportError:
+        return lambda text: len(text) // 4, "4 characters per token"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--questions", help="a file with one question per line")
+    parser.add_argument("--top-tables", type=int, default=None, help="defaults to index.top_tables")
+    args = parser.parse_args()
+
+    config = init_config()
+    questions = _QUESTIONS
+    if args.questions:
+        with open(args.questions) as f:
+            questions = [line.strip() for line in f if line.strip()]
+    top_tables = args.top_tables or config.index.top_tables
+    source = init_database_from_config(config.sources[0].database)
+    internal_db = init_internal_database_from_config(config.internal_db)
+    index = get_index(config.index)
+    table_index = get_table_index(config.index, embedder=index.embedder)
+    if not table_index.points():
+        raise SystemExit("the table level collection is empty, run `querygpt generate` with index.two_stage: true")
+    count_tokens, counter = _token_counter()
+
+    print(f"{len(questions)} questions, top {top_tables} tables, tokens: {counter}")
+    print(f"{'':<45} {'single stage':>26}   {'two-stage':>26}")
+    print(f"{'question':<45} {'rows':>6} {'tables':>7} {'tokens':>11}   {'rows':>6} {'tables':>7} {'tokens':>11}")
+    totals = {"single": 0, "two": 0}
+    for question in questions:
+        row = []
+        for name, kwargs in (("single", {}), ("two", {"table_index": table_index, "top_tables": top_tables})):
+            context = get_context(question, index=index, internal_db=internal_db, source=source, **kwargs)
+            # serialized as context_retiver does, it fails on values json cannot encode
+            tokens = count_tokens(json.dumps(context))
+            totals[name] += tokens
+            row.append(f"{len(context):>6} {len({record['table_id'] for record in context}):>7} {tokens:>11,}")
+        print(f"{question[:45]:<45} {row[0]}   {row[1]}")
+    print(
+        f"tokens per question: {totals['single'] / len(questions):,.0f} single stage, "
+        f"{totals['two'] / len(questions):,.0f} two-stage ({1 - totals['two'] / max(totals['single'], 1):.0%} fewer)"
+    )
+    # every question at once, as batch_context_retiver retrieves and serializes them
+    batched = get_context_many(
+        questions, index=index, internal_db=internal_db, source=source, table_index=table_index, top_tables=top_tables
+    )
+    print(
+        f"all questions in one batch (two-stage): {len(batched)} rows, "
+        f"{len({record['table_id'] for record in batched})} tables, {count_tokens(json.dumps(batched)):,} tokens"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Measure documentation embedding throughput against the number of worker processes.
+
+Usage:
+    python benchmarks/bench_embedder_throughput.py --workers 1 2 4 8
+    python benchmarks/bench_embedder_throughput.py --model sentence-transformers/all-MiniLM-L6-v2 --texts 50000
+"""
+import argparse
+import os
+import time
+
+from querygpt.config.config import EmbeddingModelConfig
+from querygpt.core.embeders import Embedder
+
+
+def _texts(n: int):
+    # shaped like `_process_docs_for_embedding` output
+    return [
+        f"<column_name>column_{i}</column_name>"
+        f"<column_details_summary>stores the {i % 97}th attribute of an entity, nullable</column_details_summary>"
+        f"<column_bussines_summary>used by finance to reconcile record {i} with invoices</column_bussines_summary>"
+        f"<column_possible_usages>filtering, grouping and joining on entity {i % 13}</column_possible_usages>"
+        f"<tags>identifier,numeric,</tags>"
+        for i in range(n)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="sentence-transformers/all-MiniLM-L6-v2")
+    parser.add_argument("--texts", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    args = parser.parse_args()
+
+    texts = _texts(args.texts)
+    print(f"{args.model}, {args.texts:,} texts, batch size {args.batch_size}, {os.cpu_count()} cpus")
+    print(f"{'workers':>8} {'seconds':>10} {'texts/s':>10} {'speedup':>8}")
+    baseline = None
+    for workers in sorted(set(args.workers)):
+        embedder = Embedder(
+            EmbeddingModelConfig(
+                name=args.model,
+                dimensions=0,
+                provider="sf",
+                batch_size=args.batch_size,
+                num_workers=workers,
+            )
+        )
+        if workers > 1:
+            embedder._get_pool()  # pool start up is a one-off cost, keep it out of the measurement
+        start = time.perf_counter()
+        embeddings = embedder.embed(texts)
+        elapsed = time.perf_counter() - start
+        embedder.close()
+        assert len(embeddings) == len(texts)
+        baseline = baseline or elapsed
+        print(f"{workers:>8} {elapsed:>10.2f} {len(texts) / elapsed:>10.0f} {baseline / elapsed:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Check the onnx embedding provider against sentence-transformers, and compare load time, latency and throughput.
+
+Parity: the cosine similarity between the sentence-transformers and the ONNX embedding of every
+text must be at least `--min-cosine` (the int8 model is held to `--min-cosine-quantized`), and the
+top 10 neighbours of each query must mostly agree. The script exits with status 1 otherwise.
+
+`--export` writes the ONNX model (and its int8 quantization) to `--model-path` first, which needs
+`pip install sentence-transformers[onnx]`.
+
+Usage:
+    python benchmarks/bench_onnx_embedder.py --export --model paraphrase-multilingual-mpnet-base-v2 --model-path ./.data/models/mpnet-onnx
+    python benchmarks/bench_onnx_embedder.py --model paraphrase-multilingual-mpnet-base-v2 --model-path ./.data/models/mpnet-onnx
+"""
+import argparse
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from querygpt.config.config import EmbeddingModelConfig
+
+
+def _texts(n: int):
+    # shaped like `_process_docs_for_embedding` output
+    return [
+        f"<column_name>column_{i}</column_name>"
+        f"<column_details_summary>stores the {i % 97}th attribute of an entity, nullable</column_details_summary>"
+        f"<column_bussines_summary>used by finance to reconcile record {i} with invoices</column_bussines_summary>"
+        f"<column_possible_usages>filtering, grouping and joining on entity {i % 13}</column_possible_usages>"
+        f"<tags>identifier,numeric,</tags>"
+        for i in range(n)
+    ]
+
+
+_QUERIES = [
+    "who is the most valuable customer",
+    "monthly revenue by store",
+    "which films were never rented",
+    "average payment amount per country",
+    "top 5 actors by number of films",
+]
+
+
+def export(model: str, model_path: str):
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    onnx_model = SentenceTransformer(model, backend="onnx")
+    onnx_model.save(model_path)
+    export_dynamic_quantized_onnx_model(onnx_model, "avx512_vnni", model_path)
+    print(f"exported {model} to {model_path}")
+
+
+def _load(config: EmbeddingModelConfig):
+    # imports are part of the cost of a cold start
+    start = time.perf_counter()
+    from querygpt.core.embeders import get_embedder
+
+    embedder = get_embedder(config)
+    return embedder, time.perf_counter() - start
+
+
+def _normalized(embeddings) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--model", default="paraphrase-multilingual-mpnet-base-v2")
+    parser.add_argument("--model-path", required=True)
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--texts", type=int, default=2_000)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--latency-runs", type=int, default=50)
+    parser.add_argument("--min-cosine", type=float, default=0.999)
+    parser.add_argument("--min-cosine-quantized", type=float, default=0.95)
+    parser.add_argument("--export", action="store_true")
+    args = parser.parse_args()
+
+    if args.export:
+        export(args.model, args.model_path)
+
+    texts = _texts(args.texts)
+    providers = {
+        "sf": EmbeddingModelConfig(name=args.model, dimensions=args.dimensions, provider="sf", batch_size=args.batch_size),
+        "onnx": EmbeddingModelConfig(
+            name=args.model, dimensions=args.dimensions, provider="onnx", model_path=args.model_path, batch_size=args.batch_size
+        ),
+        "onnx int8": EmbeddingModelConfig(
+            name=args.model,
+            dimensions=args.dimensions,
+            provider="onnx",
+            model_path=args.model_path,
+            quantized=True,
+            batch_size=args.batch_size,
+        ),
+    }
+
+    embeddings, ok = {}, True
+    print(f"{args.model}, {args.texts:,} texts, batch size {args.batch_size}")
+    print(f"{'provider':>10} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} {'texts/s':>9} {'min cos':>8} {'mean cos':>9} {'top10':>6}")
+    for name, config in providers.items():
+        embedder, load = _load(config)
+        latencies = []
+        for i in range(args.latency_runs):
+            start = time.perf_counter()
+            embedder.embed([_QUERIES[i % len(_QUERIES)]])
+            latencies.append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        embeddings[name] = _normalized(embedder.embed(texts))
+        throughput = len(texts) / (time.perf_counter() - start)
+
+        parity = ""
+        if name != "sf":
+            cosine = (embeddings[name] * embeddings["sf"]).sum(axis=1)
+            queries = {provider: _normalized(get.embed(_QUERIES)) for provider, get in (("sf", sf), (name, embedder))}
+            overlap = np.mean(
+                [
+                    len(
+                        set(np.argsort(-(embeddings["sf"] @ q_sf))[:10]) & set(np.argsort(-(embeddings[name] @ q))[:10])
+                    )
+                    / 10
+                    for q_sf, q in zip(queries["sf"], queries[name])
+                ]
+            )
+            minimum = args.min_cosine_quantized if config.quantized else args.min_cosine
+            ok &= cosine.min() >= minimum
+            parity = f"{cosine.min():>8.4f} {cosine.mean():>9.4f} {overlap:>6.2f}"
+        else:
+            sf = embedder
+        print(
+            f"{name:>10} {load:>8.2f} {statistics.median(latencies):>8.2f} "
+            f"{np.percentile(latencies, 95):>8.2f} {throughput:>9.1f} {parity}"
+        )
+
+    if not ok:
+        print("parity check failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
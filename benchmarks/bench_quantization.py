@@ -0,0 +1,94 @@
+"""Compare recall@10, memory and latency of quantized flat index storage against float32.
+
+Embeddings are synthetic: points around clusters in a low dimensional subspace projected to
+`--dimensions`, which is closer to sentence embeddings than uniform noise. The exact float32
+search is the ground truth.
+
+Usage:
+    python benchmarks/bench_quantization.py --vectors 100000 --dimensions 768
+    python benchmarks/bench_quantization.py --rescore-factors 1 4 10
+"""
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from querygpt.config.config import EmbeddingModelConfig, IndexConfig
+from querygpt.core.embeders import EmbedderBase
+from querygpt.core.index import FlatIndex
+
+
+def _embeddings(n: int, dimensions: int, rng: np.random.Generator, latent: int = 64, clusters: int = 200):
+    projection = rng.standard_normal((latent, dimensions))
+    centers = rng.standard_normal((clusters, latent)) * 2
+    points = centers[rng.integers(clusters, size=n)] + rng.standard_normal((n, latent))
+    return (points @ projection + 0.5 * rng.standard_normal((n, dimensions))).astype(np.float32)
+
+
+def _index(path: str, dimensions: int, dtype: str, quantization: str | None, rescore_factor: int) -> FlatIndex:
+    config = IndexConfig(
+        name=f"{dtype}_{quantization}_{rescore_factor}",
+        url=path,
+        local=True,
+        backend="flat",
+        dtype=dtype,
+        quantization=quantization,
+        rescore_factor=rescore_factor,
+        embedding_model=EmbeddingModelConfig(name="synthetic", dimensions=dimensions, provider="sf"),
+    )
+    # queries are passed as vectors, no model is loaded
+    return FlatIndex(config, embedder=EmbedderBase(config.embedding_model))
+
+
+def _scanned_bytes(index: FlatIndex) -> int:
+    # what every query reads, the full precision vectors are only touched for the rescored candidates
+    arrays = index._current()
+    if index.config.quantization is None:
+        return arrays["vectors"].nbytes
+    return sum(arrays[name].nbytes for name in FlatIndex._QUANTIZED_ARRAYS[index.config.quantization])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rescore-factors", type=int, nargs="+", default=[1, 4, 10])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    embeddings = _embeddings(args.vectors, args.dimensions, rng)
+    queries = embeddings[rng.choice(args.vectors, args.queries, replace=False)] + rng.standard_normal(
+        (args.queries, args.dimensions)
+    ).astype(np.float32)
+    payloads = [{"source": "bench", "table_id": i // 25, "column_id": i} for i in range(args.vectors)]
+    path = tempfile.mkdtemp()
+
+    settings = [("float32", None, 1), ("float16", None, 1)]
+    settings += [("float32", quantization, factor) for quantization in ("int8", "binary") for factor in args.rescore_factors]
+
+    truth = None
+    print(f"{args.vectors:,} vectors x {args.dimensions} dimensions, {args.queries} queries, top {args.top_k}")
+    print(f"{'storage':>16} {'rescore':>8} {'scanned MB':>11} {'vs float32':>11} {f'recall@{args.top_k}':>10} {'ms/query':>9}")
+    baseline = None
+    for dtype, quantization, factor in settings:
+        index = _index(path, args.dimensions, dtype, quantization, factor)
+        index.upsert(embeddings, payloads)
+        start = time.perf_counter()
+        hits = index.search(queries, top_k=args.top_k)
+        elapsed = (time.perf_counter() - start) * 1000 / args.queries
+        found = [{row for row, _ in query_hits} for query_hits in hits]
+        if truth is None:
+            truth = found
+        recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+        scanned = _scanned_bytes(index)
+        baseline = baseline or scanned
+        name = quantization or dtype
+        rescore = f"x{factor}" if quantization else "-"
+        print(f"{name:>16} {rescore:>8} {scanned / 1e6:>11.1f} {scanned / baseline:>10.1%} {recall:>10.3f} {elapsed:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Compare row by row and bulk persistence of generated documentation.
+
+The row by row path is the former `InternalDatabase.save_documentation`, a SELECT then an
+UPDATE or INSERT for the table and for every one of its columns.
+
+Usage:
+    python benchmarks/bench_save_documentation.py --columns 1000 10000 50000
+"""
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from querygpt.config.config import DuckDBDatabaseConfig
+from querygpt.core import _ColumnDocumentation, _TableDocumentation
+from querygpt.core._database import InternalDatabase
+
+
+def _documentations(columns: int, columns_per_table: int):
+    tables = []
+    for t in range(max(1, columns // columns_per_table)):
+        tables.append(
+            _TableDocumentation(
+                table_name=f"table_{t}",
+                bussines_summary=f"business summary of table {t} " * 5,
+                possible_usages=f"possible usages of table {t} " * 5,
+                columns_summary=[
+                    _ColumnDocumentation(
+                        column_name=f"column_{c}",
+                        column_details_summary=f"details of column {c} of table {t} " * 5,
+                        bussines_summary=f"business summary of column {c} " * 5,
+                        possible_usages=f"possible usages of column {c} " * 5,
+                        tags=["identifier", "text"],
+                    )
+                    for c in range(columns_per_table)
+                ],
+            )
+        )
+    return tables
+
+
+def save_row_by_row(internal_db: InternalDatabase, documentation):
+    documentation = documentation.model_dump()
+    with internal_db.connect() as conn:
+        table_id = conn.execute(
+            "SELECT id FROM table_metadata WHERE table_name = ?", (documentation["table_name"],)
+        ).fetchone()
+        if table_id:
+            conn.execute(
+                "UPDATE table_metadata SET bussines_summary = ?, possible_usages = ? WHERE id = ?",
+                (documentation["bussines_summary"], documentation["possible_usages"], table_id[0]),
+            )
+        else:
+            table_id = conn.execute(
+                "INSERT INTO table_metadata (table_name, bussines_summary, possible_usages) VALUES (?, ?, ?) RETURNING id",
+                (documentation["table_name"], documentation["bussines_summary"], documentation["possible_usages"]),
+            ).fetchone()
+        table_id = table_id[0]
+        for column in documentation["columns_summary"]:
+            column_id = conn.execute(
+                "SELECT id FROM column_metadata WHERE table_id = ? AND column_name = ?",
+                (table_id, column["column_name"]),
+            ).fetchone()
+            values = (
+                column["column_details_summary"],
+                column["bussines_summary"],
+                column["possible_usages"],
+                json.dumps(column["tags"]),
+            )
+            if column_id:
+                conn.execute(
+                    "UPDATE column_metadata SET column_details_summary = ?, bussines_summary = ?, possible_usages = ?, tags = ? WHERE id = ?",
+                    values + (column_id[0],),
+                )
+            else:
+                conn.execute(
+                    "INSERT INTO column_metadata (table_id, column_name, column_details_summary, bussines_summary, possible_usages, tags) VALUES (?, ?, ?, ?, ?, ?)",
+                    (table_id, column["column_name"]) + values,
+                )
+
+
+def _run(name: str, save, documentations) -> float:
+    internal_db = InternalDatabase(
+        DuckDBDatabaseConfig(
+            engine="duckdb",
+            path=str(Path(tempfile.mkdtemp()) / f"{name}.duckdb"),
+            ddl_query_path="/core/sql/_internal_schema.sql",
+        )
+    )
+    start = time.perf_counter()
+    save(internal_db, documentations)
+    elapsed = time.perf_counter() - start
+    internal_db.close()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--columns", type=int, nargs="+", default=[1_000, 10_000, 50_000])
+    parser.add_argument("--columns-per-table", type=int, default=25)
+    parser.add_argument("--skip-row-by-row-above", type=int, default=20_000, help="the row by row path is slow")
+    args = parser.parse_args()
+
+    print(f"{'columns':>8} {'row by row':>12} {'per table':>12} {'one batch':>12}")
+    for columns in args.columns:
+        documentations = _documentations(columns, args.columns_per_table)
+        row_by_row = (
+            _run("row_by_row", lambda db, docs: [save_row_by_row(db, doc) for doc in docs], documentations)
+            if columns <= args.skip_row_by_row_above
+            else None
+        )
+        # what `querygpt generate` does, one transaction per documented table
+        per_table = _run("per_table", lambda db, docs: [db.save_documentation(doc) for doc in docs], documentations)
+        one_batch = _run("one_batch", lambda db, docs: db.save_documentations(docs), documentations)
+        row_by_row = f"{row_by_row:11.2f}s" if row_by_row is not None else f"{'skipped':>12}"
+        print(f"{columns:>8,} {row_by_row} {per_table:11.2f}s {one_batch:11.2f}s")
+
+
+if __name__ == "__main__":
+    main()
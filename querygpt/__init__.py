@@ -1,6 +1,6 @@
 from querygpt.core.agent import Agent, create_agent
 from querygpt.config.config import init_config
-from querygpt.core import chat_completion_from_config
+from querygpt.core import chat_completion_from_config, achat_completion_from_config
 from querygpt.core.orchestrator import Orchestrator
 
-__all__ = ["Agent", "init_config", "create_agent", "chat_completion_from_config", "Orchestrator"]
\ No newline at end of file
+__all__ = ["Agent", "init_config", "create_agent", "chat_completion_from_config", "achat_completion_from_config", "Orchestrator"]
\ No newline at end of file
@@ -1,10 +1,10 @@
 import click
 from rich.console import Console
 from rich.markdown import Markdown
-from querygpt.core.agent import create_agent
 from querygpt.core.workflow import generate_insight
 from querygpt.config.config import init_config
-from querygpt.core import init_sources_documentation_from_config
+from querygpt.core import init_sources_documentation_from_config, init_internal_database_from_config
+from querygpt.core.result_cache import ResultCache
 from querygpt.core.logging import get_logger
 from rich.syntax import Syntax
 import json
@@ -15,6 +15,10 @@ logger = get_logger(__name__)
 console = Console()
 config = init_config()
 
+# the agent and the tools open the internal database and load the index and the embedding model
+# when imported, they are imported by the commands that need them so that the processes spawned
+# by the embedding pool, which re-import this module, do not load them again
+
 #TODO: ADD OPTION to select source names or all ( config has name for each source)
 @click.group()
 def main():
@@ -27,17 +31,35 @@ def generate():
     logger.info("Starting documentation generation from database sources")
     console.print("Generating documentation from database sources...", style="bold green")
     try:
-        init_sources_documentation_from_config(config=config)
+        summary = init_sources_documentation_from_config(config=config)
         logger.info("Documentation generation completed successfully")
+        for source in summary:
+            console.print(
+                f"{source['source']}: {source['tables']} tables ({source['tables_failed']} failed), {source['columns']} columns indexed "
+                f"({source['vectors_upserted']} upserted, {source['vectors_deleted']} deleted), "
+                f"table vectors {source['table_vectors_upserted']} upserted / {source['table_vectors_deleted']} deleted, "
+                f"embedding cache {source['embedding_cache_hits']} hits / {source['embedding_cache_misses']} misses",
+                style="green",
+            )
         console.print("Generating complete. You can now use `query` to interact with the agent.", style="bold green")
     except Exception as e:
         logger.error(f"Documentation generation failed: {e}")
         console.print(f"Generating failed. encountered the following error {str(e)}.", style="bold red")
 
+@main.command()
+@click.option('--source', default=None, help="only drop the cached results of this source")
+def invalidate_cache(source):
+    """drop cached SQL results, e.g. after the source data changed."""
+    internal_db = init_internal_database_from_config(config.internal_db)
+    removed = ResultCache(internal_db, config.result_cache).invalidate(source)
+    console.print(f"Removed {removed} cached results.", style="bold green")
+
 @main.command()
 @click.argument('finder')
 def finder(finder):
     """Ask the agent to answer the query."""
+    from querygpt.core.agent import create_agent
+
     logger.info(f"Starting finder query: {finder[:100]}...")
     try:
         agent = create_agent(task="finder")
@@ -70,15 +92,39 @@ def finder(finder):
         logger.error(f"Finder query failed: {e}")
         console.print(f"Error processing query: {str(e)}", style="bold red")
 
+@main.command()
+def backfill_semantic_cache():
+    """add the SQL of completed traces to the semantic cache."""
+    from querygpt.tools.tools import semantic_cache
+
+    if semantic_cache is None:
+        console.print("The semantic cache is disabled, enable `semantic_cache` in the config first.", style="bold red")
+        return
+    added = semantic_cache.backfill()
+    console.print(f"Added {added} questions to the semantic cache.", style="bold green")
+
+def _print_cached(final_answer):
+    response = json.loads(final_answer)
+    console.print(Markdown(f"Answered from a similar question: {response['cached_question']}"), justify="left")
+    syntax = Syntax(json.dumps(response, indent=5, default=str), "json", theme="monokai", line_numbers=True)
+    console.print(syntax, justify="left")
+
 @main.command()
 @click.argument('query')
-def query(query):
+@click.option('--no-cache', is_flag=True, help="always run the agent, even for a question answered before")
+def query(query, no_cache):
     """Ask the agent to answer the query."""
+    from querygpt.core.agent import SEMANTIC_CACHE_STEP, create_agent
+
     logger.info(f"Starting query: {query[:100]}...")
     try:
         agent = create_agent(task="query")
         logger.debug("Query agent created successfully")
-        final_answer = agent.run(query)
+        # the agent looks the question up in the semantic cache and caches the SQL that answered it
+        final_answer, trace_id = agent.run(query, use_semantic_cache=not no_cache)
+        if any(step.step_type == SEMANTIC_CACHE_STEP for step in agent.get_trace(trace_id).steps):
+            _print_cached(final_answer)
+            return
         sql_result = None
         sql_gen = None
         insight = None
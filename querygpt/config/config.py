@@ -1,11 +1,29 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Literal
 
 
 class EmbeddingModelConfig(BaseModel):
     name: str
     dimensions: int
-    provider: str
+    provider: str = Field(description="sf (sentence-transformers) or onnx (onnxruntime, from `model_path`)")
+    model_path: str | None = Field(
+        default=None,
+        description="Local directory of the model exported to ONNX, with its tokenizer.json, used by the onnx provider",
+    )
+    quantized: bool = Field(default=False, description="Use the int8 quantized ONNX file of `model_path`")
+    onnx_file: str | None = Field(
+        default=None, description="ONNX file to load, relative to `model_path`, overrides the lookup by `quantized`"
+    )
+    max_length: int = Field(default=512, description="Tokens kept per text by the onnx provider")
+    query_cache_size: int = Field(default=1024, description="Query embeddings kept in memory, 0 disables the cache")
+    batch_size: int = Field(default=32, description="Texts encoded per forward pass")
+    num_workers: int = Field(
+        default=1, description="Processes encoding documentation in parallel, more than 1 starts a multi-process pool"
+    )
+    shard_size: int = Field(
+        default=10000, description="Texts handed to the model at once, bounds memory on very large catalogs"
+    )
+    show_progress_bar: bool = Field(default=False, description="Show a progress bar while encoding documentation")
 
 
 class IndexConfig(BaseModel):
@@ -15,10 +33,79 @@ class IndexConfig(BaseModel):
     )
     url: str = Field(description="The URL of the Qdrant instance")
     local: bool = Field(description="use local file for stroing index")
+    backend: Literal["chroma", "qdrant", "flat"] | None = Field(
+        default=None, description="The index backend, defaults to chroma when local and qdrant otherwise"
+    )
+    dtype: Literal["float32", "float16"] = Field(
+        default="float32", description="Precision of the vectors stored by the flat backend"
+    )
+    quantization: Literal["int8", "binary"] | None = Field(
+        default=None,
+        description="Search quantized vectors (flat and qdrant backends), the top candidates are rescored with the full precision ones",
+    )
+    rescore_factor: int = Field(
+        default=4, description="Candidates rescored per requested result when quantization is enabled"
+    )
+    two_stage: bool = Field(
+        default=False,
+        description="Search the table level collection first, then only the columns of the `top_tables` best tables",
+    )
+    top_tables: int = Field(default=5, description="Tables kept by the first stage of two-stage retrieval")
+
+
+class PoolConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Whether to reuse connections across queries")
+    min_size: int = Field(default=0, description="Connections opened eagerly and kept open when idle")
+    max_size: int = Field(default=5, description="Maximum number of open connections per source")
+    idle_timeout: float = Field(default=300, description="Seconds after which an idle connection above min_size is closed")
+    acquire_timeout: float = Field(default=30, description="Seconds to wait for a free connection before failing")
+    health_check: bool = Field(default=True, description="Check a pooled connection is alive before handing it out")
+
+
+class CostGuardConfig(BaseModel):
+    enabled: bool = Field(default=False, description="Whether to EXPLAIN agent generated SQL before running it")
+    max_estimated_rows: float | None = Field(
+        default=1_000_000, description="Most rows the query may be estimated to return, None for no limit"
+    )
+    max_estimated_scan_rows: float | None = Field(
+        default=None,
+        description="Largest row estimate allowed for any plan node (rows read on ClickHouse), None for no limit. "
+        "Queries above it are always rejected, a LIMIT does not make them read less",
+    )
+    max_estimated_cost: float | None = Field(
+        default=None, description="Largest total plan cost allowed (in the engine's own units), None for no limit"
+    )
+    action: Literal["reject", "limit"] = Field(
+        default="limit",
+        description="What to do with a query above max_estimated_rows or max_estimated_cost: reject it, or run it wrapped in a LIMIT",
+    )
+    limit_rows: int = Field(default=1000, description="LIMIT applied to queries above the thresholds when action is limit")
+    statement_timeout_seconds: float | None = Field(
+        default=30, description="Per statement timeout for agent generated SQL, None for no timeout"
+    )
 
 
 class DatabaseConfig(BaseModel):
     engine: str = Field(description="The engine of the database")
+    name: str | None = Field(default=None, description="The name of the source using this database")
+    schema_cache_ttl: float | None = Field(
+        default=3600,
+        description="Seconds before the cached schema catalog is reloaded, None keeps it until invalidated",
+    )
+    max_result_rows: int | None = Field(
+        default=10000, description="Maximum rows fetched for agent generated SQL, None for no cap"
+    )
+    max_result_bytes: int | None = Field(
+        default=64 * 1024 * 1024,
+        description="Maximum in-memory size in bytes fetched for agent generated SQL, None for no cap",
+    )
+    fetch_chunk_size: int = Field(default=1000, description="Rows fetched per round trip when streaming results")
+    arrow_fetch: bool = Field(
+        default=False, description="Build query results from Arrow columns instead of row by row (needs pyarrow)"
+    )
+    cost_guard: CostGuardConfig = Field(
+        default_factory=CostGuardConfig, description="The EXPLAIN based checks run before agent generated SQL"
+    )
 
 
 class PostgresDatabaseConfig(DatabaseConfig):
@@ -28,6 +115,7 @@ class PostgresDatabaseConfig(DatabaseConfig):
     port: int = Field(description="The port of the database")
     dbname: str = Field(description="The name of the database")
     schema_query_path: str = Field(description="The path to the schema query file")
+    pool: PoolConfig = Field(default_factory=PoolConfig, description="The connection pool settings")
 
 class ClickhouseDatabaseConfig(DatabaseConfig):
     user: str = Field(description="The user of the database")
@@ -35,13 +123,16 @@ class ClickhouseDatabaseConfig(DatabaseConfig):
     host: str = Field(description="The host of the database")
     port: int = Field(description="The port of the database")
     dbname: str = Field(description="The name of the database")
+    native_port: int = Field(default=9000, description="The native protocol port, used by the async client")
     schema_query_path: str = Field(description="The path to the schema query file")
+    pool: PoolConfig = Field(default_factory=PoolConfig, description="The connection pool settings")
 
 class OracleDatabaseConfig(DatabaseConfig):
     user: str = Field(description="The user of the database")
     password: str = Field(description="The password of the database")
     dsn: str = Field(description="DSN of the database, host,port")
     schema_query_path: str = Field(description="The path to the schema query file")
+    pool: PoolConfig = Field(default_factory=PoolConfig, description="The connection pool settings")
 
 class DuckDBDatabaseConfig(DatabaseConfig):
     path: str = Field(description="The path to the DuckDB database file")
@@ -51,12 +142,80 @@ class SourceConfig(BaseModel):
     name: str = Field(description="The name of the source")
     database: DatabaseConfig = Field(description="The configuration of the database of the source")
 
+class LLMClientConfig(BaseModel):
+    max_connections: int = Field(default=20, description="Maximum open connections per endpoint")
+    max_keepalive_connections: int = Field(default=10, description="Idle connections kept alive per endpoint")
+    keepalive_expiry: float = Field(default=30, description="Seconds an idle connection is kept alive")
+    connect_timeout: float = Field(default=10, description="Seconds to wait for a connection to the endpoint")
+    timeout: float = Field(default=120, description="Seconds to wait for a response (read, write and pool acquisition)")
+
+
+class RateLimitConfig(BaseModel):
+    requests_per_minute: int | None = Field(default=None, description="Requests per minute allowed by the provider, learned from its first 429 when not set")
+    tokens_per_minute: int | None = Field(default=None, description="Tokens per minute allowed by the provider, unlimited when not set")
+    max_retries: int = Field(default=5, description="Retries of a rate limited (429) request")
+    backoff_seconds: float = Field(default=1.0, description="First retry delay when the provider gives no retry-after, doubled on every retry")
+    max_backoff_seconds: float = Field(default=60.0, description="Longest delay between retries")
+    decrease_factor: float = Field(default=0.5, description="Factor the allowed rate is multiplied by on a 429")
+    increase_step: float = Field(default=0.05, description="Share of the limits given back by every successful request after a 429")
+    min_scale: float = Field(default=0.05, description="Lowest share of the limits a model is slowed down to")
+
+
 class ChatCompletionConfig(BaseModel):
     model: str = Field(description="The model of the chat completion")
     provider: str = Field(description="The provider of the chat completion")
     remote: bool = Field(description="Whether the chat completion is remote")
     temperature: float = Field(description="The temperature of the chat completion")
     base_url : str | None = Field(description="the base url of LLM model")
+    client: LLMClientConfig = Field(
+        default_factory=LLMClientConfig, description="Connection pool of the OpenAI compatible client used with `base_url`"
+    )
+    rate_limit: RateLimitConfig = Field(
+        default_factory=RateLimitConfig, description="Request and token quota of the model, shared by every call in the process"
+    )
+
+
+class ResultCacheConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Whether to cache results of agent generated SQL")
+    path: str = Field(default="./.data/result_cache", description="Directory holding the cached results")
+    ttl_seconds: float = Field(default=900, description="Seconds a cached result stays valid")
+    max_bytes: int = Field(default=512 * 1024 * 1024, description="Size of the cache before least recently used results are evicted")
+
+
+class EmbeddingCacheConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Whether to reuse embeddings of unchanged documentation across runs")
+    dtype: Literal["float16", "float32"] = Field(default="float16", description="Precision the cached embeddings are stored with")
+
+
+class LLMCacheConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Whether to reuse LLM responses to identical requests")
+    ttl_seconds: float = Field(default=7 * 24 * 3600, description="Seconds a cached response stays valid")
+    max_bytes: int = Field(default=256 * 1024 * 1024, description="Size of the cached responses before least recently used ones are evicted")
+
+
+class SemanticCacheConfig(BaseModel):
+    enabled: bool = Field(default=False, description="Whether to answer questions similar to an already answered one with its SQL, skipping the agent")
+    similarity_threshold: float = Field(default=0.92, description="Cosine similarity from which a cached question counts as the same question")
+    max_entries: int = Field(default=5000, description="Cached questions per source before the least recently hit ones are evicted")
+
+
+class DocumentationConfig(BaseModel):
+    max_workers: int = Field(default=8, description="Tables documented concurrently, within the rate limit of `llm.rate_limit`")
+    adopt_unsourced: bool = Field(
+        default=False,
+        description="Let a source take over the documentation of its tables saved before tables had a source, instead of documenting them anew",
+    )
+
+
+class ServingConfig(BaseModel):
+    agent_workers: int = Field(default=4, description="Agent runs served concurrently by the API, further /chat requests wait for a free worker")
+
+
+class TraceWriterConfig(BaseModel):
+    enabled: bool = Field(default=True, description="Whether agent traces are written in the background instead of before answering")
+    max_queue_size: int = Field(default=1000, description="Traces waiting to be written before new ones are dropped")
+    batch_size: int = Field(default=50, description="Maximum traces written in one transaction")
+    flush_interval_seconds: float = Field(default=1.0, description="Seconds the writer waits to fill a batch")
 
 
 class Config(BaseModel):
@@ -64,6 +223,13 @@ class Config(BaseModel):
     sources: List[SourceConfig] = Field(description="The list of sources")
     internal_db: DuckDBDatabaseConfig = Field(description="The configuration of the internal database")
     llm: ChatCompletionConfig = Field(description="The configuration of the chat completion")
+    result_cache: ResultCacheConfig = Field(default_factory=ResultCacheConfig, description="The configuration of the SQL result cache")
+    embedding_cache: EmbeddingCacheConfig = Field(default_factory=EmbeddingCacheConfig, description="The configuration of the documentation embedding cache")
+    trace_writer: TraceWriterConfig = Field(default_factory=TraceWriterConfig, description="The configuration of the background trace writer")
+    llm_cache: LLMCacheConfig = Field(default_factory=LLMCacheConfig, description="The configuration of the LLM response cache")
+    semantic_cache: SemanticCacheConfig = Field(default_factory=SemanticCacheConfig, description="The configuration of the question to SQL cache")
+    documentation: DocumentationConfig = Field(default_factory=DocumentationConfig, description="The configuration of the documentation generation")
+    serving: ServingConfig = Field(default_factory=ServingConfig, description="The configuration of the API")
 
 
 def init_config():
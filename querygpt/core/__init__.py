@@ -2,12 +2,21 @@ from querygpt.core._database import DATABASE_REGISTRY, DatabaseConfig, InternalD
 from querygpt.config.config import ChatCompletionConfig, Config
 from pydantic import BaseModel
 from typing import List
-from querygpt.core.index import get_index
+from querygpt.core.index import get_index, get_table_index, point_ids
 import json
+import hashlib
 import pandas as pd
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from querygpt.core.memory import Memory
+from querygpt.core.embedding_cache import EmbeddingCache
+from querygpt.core.embeders import embedder_identity
+from querygpt.core.llm_clients import get_client, get_async_client
+from querygpt.core.rate_limit import get_limiter, estimate_tokens
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
 
 def init_internal_database_from_config(config: DatabaseConfig):
     return InternalDatabase(config)
@@ -19,36 +28,76 @@ def init_database_from_config(config: DatabaseConfig):
     ), f"Invalid database engine: {config.engine}, available engines: {DATABASE_REGISTRY.keys()}"
     return DATABASE_REGISTRY[config.engine](config)
 
-@Memory()
+# responses of identical requests are served from the internal database, see `Memory`
+llm_cache = Memory()
+
+
+def _openai_request(messages: List[str], config: ChatCompletionConfig, response_format: BaseModel = None) -> dict:
+    from openai.lib._parsing._completions import type_to_response_format_param
+
+    # url = f'{config.base_url}/chat/completions'
+    data = {
+            "model": config.model,
+            "messages": messages,
+            "temperature": config.temperature,
+            }
+    if response_format:
+        data["response_format"] = type_to_response_format_param(response_format)
+    return data
+
+
+@llm_cache
 def chat_completion_from_config(
     messages: List[str], config: ChatCompletionConfig, response_format: BaseModel = None
 ):
     if config.remote:
+        # every call of the process shares the quota of the model, see `rate_limit`
+        limiter = get_limiter(config)
         if config.base_url:
-            import httpx
-            from openai import OpenAI
-            from openai.lib._parsing._completions import type_to_response_format_param
-            http_client = httpx.Client(trust_env=False)
-            client = OpenAI(base_url=config.base_url, api_key="", http_client=http_client)
-            # url = f'{config.base_url}/chat/completions'
-            data = {
-                    "model": config.model,
-                    "messages": messages,
-                    "temperature": config.temperature,
-                    }
-            if response_format:
-                data["response_format"] = type_to_response_format_param(response_format)
-            return client.chat.completions.create(**data)
-
+            # pooled client shared across calls and threads, see `llm_clients`
+            client = get_client(config)
+            return limiter.call(
+                client.chat.completions.create,
+                **_openai_request(messages, config, response_format),
+                tokens=estimate_tokens(messages),
+            )
+        else:
+            from litellm import completion
+            return limiter.call(
+                completion,
+                messages=messages,
+                model=config.model,
+                temperature=config.temperature,
+                response_format=response_format,
+                tokens=estimate_tokens(messages),
+            )
+    else:
+        raise NotImplementedError("Local LLM is not supported yet")
 
 
+@llm_cache
+async def achat_completion_from_config(
+    messages: List[str], config: ChatCompletionConfig, response_format: BaseModel = None
+):
+    """Async twin of `chat_completion_from_config`"""
+    if config.remote:
+        limiter = get_limiter(config)
+        if config.base_url:
+            client = get_async_client(config)
+            return await limiter.acall(
+                client.chat.completions.create,
+                **_openai_request(messages, config, response_format),
+                tokens=estimate_tokens(messages),
+            )
         else:
-            from litellm import completion
-            return completion(
+            from litellm import acompletion
+            return await limiter.acall(
+                acompletion,
                 messages=messages,
                 model=config.model,
                 temperature=config.temperature,
                 response_format=response_format,
+                tokens=estimate_tokens(messages),
             )
     else:
         raise NotImplementedError("Local LLM is not supported yet")
@@ -187,36 +236,184 @@ def _process_docs_for_embedding(
     return docs
 
 
-def init_sources_documentation_from_config(config: Config):
+def _process_tables_for_embedding(documenation: pd.DataFrame) -> List[dict]:
+    """one text per table of `documenation` (as returned by `get_all_documenations`), for the table level collection"""
+    docs = []
+    for table_id, columns in documenation.groupby("table_id", sort=False):
+        table = columns.iloc[0]
+        docs.append(
+            {
+                "table_id": int(table_id),
+                "_text": "<table_name>"
+                + table["table_name"]
+                + "</table_name>"
+                + "<table_summary>"
+                + table["table_bussines_summary"]
+                + "</table_summary>"
+                + "<table_possible_usages>"
+                + table["table_possible_usages"]
+                + "</table_possible_usages>"
+                + "<columns>"
+                + ",".join(columns["column_name"])
+                + "</columns>",
+            }
+        )
+    return docs
+
+
+def _content_hash(text: str, embedder) -> str:
+    # the embedder is part of the hash so that changing the embedding model re-embeds every point
+    return hashlib.sha256(f"{embedder_identity(embedder.config)}\n{text}".encode()).hexdigest()
+
+
+def _with_payloads(shards, payloads: List[dict]):
+    # pair each shard of embeddings with the payloads of its texts
+    start = 0
+    for embeddings in shards:
+        yield embeddings, payloads[start : start + len(embeddings)]
+        start += len(embeddings)
+
+
+def _sync_index(index, docs: List[dict], payloads: List[dict], source: str, embedding_cache: EmbeddingCache | None) -> dict:
+    """Embed and upsert the points of `source` whose content changed, and delete its points that are gone."""
+    # only (re-)embed and upsert documents whose text changed, and drop the vectors of documents
+    # that no longer exist, or that were indexed before points had a source
+    indexed = index.points()
+    ids = point_ids(payloads)
+    changed = [
+        i
+        for i, (id, payload) in enumerate(zip(ids, payloads))
+        if (indexed.get(id) or {}).get("content_hash") != payload["content_hash"]
+    ]
+    ids = set(ids)
+    stale = [
+        id
+        for id, payload in indexed.items()
+        if id not in ids and (payload or {}).get("source") in (source, None)
+    ]
+    texts = [docs[i]["_text"] for i in changed]
+    payloads = [payloads[i] for i in changed]
+    hits, misses = 0, len(texts)
+    if texts:
+        # shards are handed to the index as they are embedded, chroma and qdrant upsert each one right away
+        # and the flat index writes them all as one version
+        if embedding_cache is not None:
+            before = embedding_cache.stats()
+            shards = embedding_cache.embed_iter(index.embedder, texts)
+        else:
+            shards = index.embedder.embed_iter(texts)
+        index.upsert_many(_with_payloads(shards, payloads))
+        if embedding_cache is not None:
+            after = embedding_cache.stats()
+            hits, misses = after["hits"] - before["hits"], after["misses"] - before["misses"]
+    if stale:
+        index.delete(stale)
+    return {"upserted": len(texts), "deleted": len(stale), "hits": hits, "misses": misses}
+
+
+def _generate_documentations(
+    tables_schema: dict, source: str, internal_db: InternalDatabase, config: Config
+) -> List[str]:
+    """Document up to `config.documentation.max_workers` tables concurrently, saving each one as it completes.
+
+    The requests wait for the quota of the model, see `rate_limit.get_limiter`.
+
+    A table that fails is logged and skipped, it keeps its previous documentation.
+
+    Returns:
+        the names of the tables that failed.
+    """
+    failed = []
+    with ThreadPoolExecutor(
+        max_workers=config.documentation.max_workers, thread_name_prefix="querygpt-documentation"
+    ) as executor:
+        futures = {
+            executor.submit(_generate_documentation, table_name, columns_data, config.llm): table_name
+            for table_name, columns_data in tables_schema.items()
+        }
+        for future in tqdm(
+            as_completed(futures),
+            total=len(futures),
+            desc="generating and saving documentations...",
+        ):
+            table_name = futures[future]
+            try:
+                documentation = future.result()
+            except Exception as e:
+                logger.error(f"Failed to document table {table_name} of {source}: {e}")
+                failed.append(table_name)
+                continue
+            internal_db.save_documentation(
+                documentation, source=source, adopt_unsourced=config.documentation.adopt_unsourced
+            )
+    if failed:
+        logger.warning(f"{len(failed)} of {len(tables_schema)} tables of {source} could not be documented: {failed}")
+    logger.info(f"Rate limiter of {config.llm.model}: {get_limiter(config.llm).stats()}")
+    return failed
+
+
+def init_sources_documentation_from_config(config: Config) -> List[dict]:
+    """Generate, save and index the documentation of every source.
+
+    Returns:
+        a summary per source: tables documented and failed, columns indexed, column (and, with two-stage
+        retrieval, table) vectors upserted and deleted and embedding cache hits/misses.
+    """
     # create index
     index = get_index(config.index)
+    # the table level collection of two-stage retrieval shares the embedding model
+    table_index = get_table_index(config.index, embedder=index.embedder) if config.index.two_stage else None
     internal_db = init_internal_database_from_config(config.internal_db)
+    embedding_cache = (
+        EmbeddingCache(internal_db, config.embedding_cache) if config.embedding_cache.enabled else None
+    )
+    summary = []
     # i need to get all schema: Prepare for llm documentation generation
     source_dbs = [
         init_database_from_config(source.database) for source in config.sources
     ]
     for source_db in source_dbs:
         tables_schema = source_db.get_all_tables_schema()
+        source_db.catalog.refresh(tables_schema)
         tables_schema = _process_tables_schema(tables_schema, source_db.engine)
-        for table_name, columns_data in tqdm(
-            tables_schema.items(),
-            desc="generating and saving documentations...",
-        ):
-            documentation = _generate_documentation(
-                table_name, columns_data, config.llm
-            )
-            internal_db.save_documentation(documentation)
-        # temporary
-        docs = internal_db.get_all_documenations()
+        failed = _generate_documentations(tables_schema, source_db.name, internal_db, config)
+        internal_db.prune_documentations(source_db.name, list(tables_schema.keys()))
+        docs = internal_db.get_all_documenations(source=source_db.name)
         processed_docs = _process_docs_for_embedding(docs)
-        # generate embedding
         payloads = [
             {
+                "source": source_db.name,
                 "column_id": doc["column_id"],
                 "table_id": doc["table_id"],
+                "content_hash": _content_hash(doc["_text"], index.embedder),
             }
             for doc in processed_docs
         ]
-        texts = [doc["_text"] for doc in processed_docs]
-        embeddings = index.embedder.embed(texts)  # Also temp :(
-        index.upsert(embeddings=embeddings, payloads=payloads)
+        columns = _sync_index(index, processed_docs, payloads, source_db.name, embedding_cache)
+        tables = {"upserted": 0, "deleted": 0, "hits": 0, "misses": 0}
+        if table_index is not None:
+            table_docs = _process_tables_for_embedding(docs)
+            table_payloads = [
+                {
+                    "source": source_db.name,
+                    "table_id": doc["table_id"],
+                    "content_hash": _content_hash(doc["_text"], table_index.embedder),
+                }
+                for doc in table_docs
+            ]
+            tables = _sync_index(table_index, table_docs, table_payloads, source_db.name, embedding_cache)
+        summary.append(
+            {
+                "source": source_db.name,
+                "tables": len(tables_schema),
+                "tables_failed": len(failed),
+                "columns": len(processed_docs),
+                "vectors_upserted": columns["upserted"],
+                "vectors_deleted": columns["deleted"],
+                "table_vectors_upserted": tables["upserted"],
+                "table_vectors_deleted": tables["deleted"],
+                "embedding_cache_hits": columns["hits"] + tables["hits"],
+                "embedding_cache_misses": columns["misses"] + tables["misses"],
+            }
+        )
+    return summary
@@ -1,17 +1,107 @@
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 from enum import Enum
 from querygpt.config.config import DatabaseConfig
 from pathlib import Path
 import os
+import numpy as np
 import pandas as pd
-from typing import List, Union
+from typing import Iterator, List, Tuple, Union
 import json
 from pathlib import Path
 from querygpt.core.trace import Trace
 from querygpt.core.logging import get_logger
+from querygpt.core.pool import ConnectionPool
+from querygpt.core.catalog import SchemaCatalog
+import threading
+import uuid
+import hashlib
+from datetime import datetime
+import io
+import asyncio
+from urllib.parse import quote
 
 logger = get_logger(__name__)
 
+# config fields that are not passed to the driver's `connect`
+_NON_CONNECTION_FIELDS = {
+    "engine",
+    "name",
+    "schema_query_path",
+    "pool",
+    "schema_cache_ttl",
+    "max_result_rows",
+    "max_result_bytes",
+    "fetch_chunk_size",
+    "arrow_fetch",
+    "native_port",
+    "cost_guard",
+}
+
+
+def _cap_chunk(chunk: pd.DataFrame, fetched_rows: int, fetched_bytes: int, max_rows: int, max_bytes: int):
+    """Cut `chunk` so that the rows and bytes fetched so far stay within the caps.
+
+    Returns:
+        (chunk, chunk_bytes, truncated)
+    """
+    truncated = False
+    chunk_bytes = 0
+    if max_rows is not None and fetched_rows + len(chunk) > max_rows:
+        chunk = chunk.iloc[: max_rows - fetched_rows]
+        truncated = True
+    if max_bytes is not None and len(chunk):
+        chunk_bytes = int(chunk.memory_usage(deep=True, index=False).sum())
+        if fetched_bytes + chunk_bytes > max_bytes:
+            keep = int(len(chunk) * (max_bytes - fetched_bytes) / chunk_bytes)
+            chunk = chunk.iloc[:keep]
+            chunk_bytes = int(chunk.memory_usage(deep=True, index=False).sum())
+            truncated = True
+    return chunk, chunk_bytes, truncated
+
+
+def _fetch_size(chunk_size: int, fetched_rows: int, max_rows: int) -> int:
+    # fetch one row past the cap so we know whether the result was truncated
+    return chunk_size if max_rows is None else min(chunk_size, max_rows - fetched_rows + 1)
+
+
+def _max_plan_value(node, children_key: str, value) -> float | None:
+    """Largest `value(node)` over an EXPLAIN plan tree (a node or a list of nodes)."""
+    nodes = node if isinstance(node, list) else [node]
+    best = None
+    for node in nodes:
+        candidates = [value(node), _max_plan_value(node.get(children_key, []), children_key, value)]
+        for candidate in candidates:
+            if candidate is not None and (best is None or candidate > best):
+                best = candidate
+    return best
+
+
+def _postgres_arrow_type(pyarrow, type_code: int):
+    """Arrow type a Postgres column of type oid `type_code` is read as from CSV, text for the types without an exact match."""
+    return {
+        16: pyarrow.bool_(),
+        20: pyarrow.int64(),
+        21: pyarrow.int16(),
+        23: pyarrow.int32(),
+        26: pyarrow.int64(),
+        700: pyarrow.float32(),
+        701: pyarrow.float64(),
+        1082: pyarrow.date32(),
+        1083: pyarrow.time64("us"),
+        1114: pyarrow.timestamp("us"),
+        1184: pyarrow.timestamp("us", tz="UTC"),
+    }.get(type_code, pyarrow.string())
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ModuleNotFoundError(
+            "To fetch results as Arrow, please install pyarrow by using 'pip install querygpt[arrow]'"
+        )
+    return pyarrow
+
 
 def resolve_path_from_project(relative_path: str) -> Path:
     logger.debug(f"Resolving path: {relative_path}")
@@ -43,14 +133,89 @@ class DatabaseEngine(Enum):
 
 
 class DatabaseBase:
+    # column of the schema query result holding the table name, used to index the catalog
+    _schema_table_column = "table_name"
+    _schema_schema_column = "table_schema"
+
     def __init__(self, config: DatabaseConfig):
         self.config = config
         self.engine = config.engine
+        self.name = config.name or config.engine
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._catalog = None
+        self._schema_query_text = None
 
     @contextmanager
     def connect(self):
         raise NotImplementedError()
 
+    def _connection_params(self) -> dict:
+        return {
+            k: v
+            for k, v in vars(self.config).items()
+            if k not in _NON_CONNECTION_FIELDS and v is not None
+        }
+
+    def _new_connection(self):
+        """Open a new driver connection, used by the pool as its factory."""
+        raise NotImplementedError()
+
+    def _check_connection(self, conn):
+        """Health check run on pool checkout, must raise if `conn` is unusable."""
+        pass
+
+    def _reset_connection(self, conn):
+        """Run on pool checkin to leave `conn` clean for the next user."""
+        pass
+
+    @property
+    def pool(self) -> ConnectionPool:
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    pool_config = self.config.pool
+                    self._pool = ConnectionPool(
+                        factory=self._new_connection,
+                        min_size=pool_config.min_size,
+                        max_size=pool_config.max_size,
+                        idle_timeout=pool_config.idle_timeout,
+                        acquire_timeout=pool_config.acquire_timeout,
+                        health_check=(
+                            self._check_connection if pool_config.health_check else None
+                        ),
+                        reset=self._reset_connection,
+                        name=f"{self.engine}-pool",
+                    )
+                    logger.info(
+                        f"Created {self.engine} connection pool (min_size={pool_config.min_size}, max_size={pool_config.max_size})"
+                    )
+        return self._pool
+
+    @contextmanager
+    def _pooled_connection(self):
+        pool_config = getattr(self.config, "pool", None)
+        if pool_config is None or not pool_config.enabled:
+            conn = self._new_connection()
+            try:
+                yield conn
+            finally:
+                conn.close()
+        else:
+            with self.pool.connection() as conn:
+                yield conn
+
+    def pool_stats(self) -> dict | None:
+        """Return the connection pool counters, or None if no pool has been opened yet."""
+        if self._pool is None:
+            return None
+        return self._pool.stats()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
     def list_all_schemas(self, *args, **kwargs):
         raise NotImplementedError()
 
@@ -64,12 +229,42 @@ class DatabaseBase:
         self,
         query: str,
         as_dataframe: bool = True,
+        max_rows: int = None,
+        max_bytes: int = None,
+        use_arrow: bool = None,
+        timeout_seconds: float = None,
     ):
+        """Run `query` and return its result.
+
+        When `max_rows` or `max_bytes` is given the result is fetched through `stream_query` and
+        stops at the cap, `result.attrs["truncated"]` tells whether rows were left unread.
+        Otherwise, with `use_arrow` (defaults to the source's `arrow_fetch`), the dataframe is
+        built from `fetch_arrow` instead of row by row. `timeout_seconds` cancels the statement
+        on the server once it runs longer, it is not applied to Arrow fetches.
+        """
+        if use_arrow is None:
+            use_arrow = self.config.arrow_fetch
         logger.debug(f"Executing query: {query[:100]}...")
         try:
-            with self.connect() as conn:
+            if as_dataframe and (max_rows is not None or max_bytes is not None):
+                chunks = list(
+                    self.stream_query(
+                        query, max_rows=max_rows, max_bytes=max_bytes, timeout_seconds=timeout_seconds
+                    )
+                )
+                result = pd.concat(chunks, ignore_index=True)
+                result.attrs["truncated"] = chunks[-1].attrs.get("truncated", False)
+                logger.debug(
+                    f"Query executed successfully, returned {len(result)} rows (truncated={result.attrs['truncated']})"
+                )
+                return result
+            if as_dataframe and use_arrow and not timeout_seconds:
+                result = self.fetch_arrow(query).to_pandas()
+                logger.debug(f"Query executed successfully, returned {len(result)} rows")
+                return result
+            with self.connect() as conn, self._statement_timeout(conn, query, timeout_seconds) as query:
                 if as_dataframe:
-                    result = pd.read_sql_query(query, conn)
+                    result = self._read_dataframe(conn, query)
                     logger.debug(f"Query executed successfully, returned {len(result)} rows")
                     return result
                 else:
@@ -80,11 +275,171 @@ class DatabaseBase:
             logger.error(f"Query execution failed: {e}")
             raise
 
-    def get_all_tables_schema(self, *args, **kwargs):
-        raise NotImplementedError()
+    def _read_dataframe(self, conn, query: str) -> pd.DataFrame:
+        """Run `query` on `conn` and return its whole result as a dataframe."""
+        return pd.read_sql_query(query, conn)
+
+    @contextmanager
+    def _statement_timeout(self, conn, query: str, seconds: float = None):
+        """Apply a per statement timeout of `seconds` on `conn` and yield the query to run.
+
+        Engines set it on the session or rewrite `query`, the base class has no timeout.
+        """
+        if seconds:
+            logger.debug(f"Statement timeouts are not supported for {self.engine}, ignoring")
+        yield query
 
-    def get_table_schema(self, *args, **kwargs):
+    def explain(self, query: str) -> dict:
+        """Return the planner estimates of `query` without running it.
+
+        Returns:
+            {
+                "estimated_rows": rows the query returns (the root plan node),
+                "estimated_scan_rows": largest row estimate of any plan node (rows read on ClickHouse),
+                "estimated_cost": total plan cost,
+            }
+            any may be None when the engine does not report it.
+        """
+        raise NotImplementedError(f"EXPLAIN is not supported for {self.engine}")
+
+    def limit_query(self, query: str, limit: int) -> str:
+        """Wrap `query` so that it returns at most `limit` rows."""
+        # the newline keeps a trailing line comment from swallowing the closing parenthesis
+        return f"SELECT * FROM (\n{query.strip().rstrip(';')}\n) AS limited_query LIMIT {int(limit)}"
+
+    def fetch_arrow(self, query: str):
+        """Run `query` and return its result as a `pyarrow.Table`, without per-row python objects."""
+        raise NotImplementedError(f"Arrow fetching is not supported for {self.engine}")
+
+    @contextmanager
+    def _stream_cursor(self, conn, chunk_size: int):
+        """Cursor used by `stream_query`, engines with server-side cursors override it."""
+        cursor = conn.cursor()
+        if hasattr(cursor, "arraysize"):
+            cursor.arraysize = chunk_size
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def stream_query(
+        self,
+        query: str,
+        chunk_size: int = None,
+        max_rows: int = None,
+        max_bytes: int = None,
+        timeout_seconds: float = None,
+    ) -> Iterator[pd.DataFrame]:
+        """Yield the result of `query` as dataframes of at most `chunk_size` rows.
+
+        Fetching stops early once `max_rows` rows or `max_bytes` bytes (as measured in memory)
+        have been read, the last chunk then has `attrs["truncated"] = True`.
+        """
+        chunk_size = chunk_size or self.config.fetch_chunk_size
+        fetched_rows, fetched_bytes = 0, 0
+        with self.connect() as conn, self._statement_timeout(
+            conn, query, timeout_seconds
+        ) as query, self._stream_cursor(conn, chunk_size) as cursor:
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(_fetch_size(chunk_size, fetched_rows, max_rows))
+                if not rows and fetched_rows:
+                    return
+                columns = [column[0] for column in cursor.description]
+                chunk = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+                chunk, chunk_bytes, truncated = _cap_chunk(
+                    chunk, fetched_rows, fetched_bytes, max_rows, max_bytes
+                )
+                fetched_rows += len(chunk)
+                fetched_bytes += chunk_bytes
+                chunk.attrs["truncated"] = truncated
+                yield chunk
+                if truncated or not rows:
+                    return
+
+    @asynccontextmanager
+    async def aconnect(self):
         raise NotImplementedError()
+        yield
+
+    async def _afetch_capped(
+        self, fetchmany, columns: List[str], chunk_size: int = None, max_rows: int = None, max_bytes: int = None
+    ) -> pd.DataFrame:
+        """Drain an awaitable `fetchmany(size)` into a dataframe, stopping at the row/byte caps."""
+        chunk_size = chunk_size or self.config.fetch_chunk_size
+        chunks, fetched_rows, fetched_bytes, truncated = [], 0, 0, False
+        while True:
+            rows = await fetchmany(_fetch_size(chunk_size, fetched_rows, max_rows))
+            if not rows and chunks:
+                break
+            chunk = pd.DataFrame.from_records(
+                [tuple(row) for row in rows], columns=columns, coerce_float=True
+            )
+            chunk, chunk_bytes, truncated = _cap_chunk(
+                chunk, fetched_rows, fetched_bytes, max_rows, max_bytes
+            )
+            fetched_rows += len(chunk)
+            fetched_bytes += chunk_bytes
+            chunks.append(chunk)
+            if truncated or not rows:
+                break
+        result = pd.concat(chunks, ignore_index=True)
+        result.attrs["truncated"] = truncated
+        return result
+
+    async def aexecute_query(
+        self, query: str, max_rows: int = None, max_bytes: int = None, timeout_seconds: float = None
+    ) -> pd.DataFrame:
+        """Async twin of `execute_query`, engines without an async driver run the sync one in a worker thread."""
+        return await asyncio.to_thread(
+            self.execute_query,
+            query,
+            max_rows=max_rows,
+            max_bytes=max_bytes,
+            timeout_seconds=timeout_seconds,
+        )
+
+    async def aget_table_schema(self, table_name: Union[str, List[str]], table_schema: str = None):
+        if not self.catalog.is_fresh():
+            self.catalog.refresh(await self.aexecute_query(self._schema_query()))
+        return self.get_table_schema(table_name, table_schema=table_schema)
+
+    async def aget_table_sample_data(self, table_schema: str, table_name: str):
+        return await asyncio.to_thread(self.get_table_sample_data, table_schema, table_name)
+
+    async def aclose(self):
+        self.close()
+
+    def _schema_query(self) -> str:
+        if self._schema_query_text is None:
+            if not getattr(self.config, "schema_query_path", None):
+                raise NotImplementedError()
+            path = resolve_path_from_project(self.config.schema_query_path)
+            self._schema_query_text = load_query_from_file(path)
+        return self._schema_query_text
+
+    def get_all_tables_schema(self):
+        """Run the source's schema query, always hitting the database. Lookups should go through `catalog`."""
+        return self.execute_query(self._schema_query())
+
+    @property
+    def catalog(self) -> SchemaCatalog:
+        if self._catalog is None:
+            self._catalog = SchemaCatalog(
+                loader=self.get_all_tables_schema,
+                table_column=self._schema_table_column,
+                schema_column=self._schema_schema_column,
+                ttl=self.config.schema_cache_ttl,
+                name=f"{self.engine}-catalog",
+            )
+        return self._catalog
+
+    def invalidate_schema_cache(self):
+        if self._catalog is not None:
+            self._catalog.invalidate()
+
+    def get_table_schema(self, table_name: Union[str, List[str]], table_schema: str = None):
+        return self.catalog.get(table_name, table_schema=table_schema)
 
     def get_table_sample_data(self, *args, **kwargs):
         raise NotImplementedError()
@@ -93,25 +448,110 @@ class DatabaseBase:
 class PostgresDatabase(DatabaseBase):
     def __init__(self, config: DatabaseConfig):
         super().__init__(config)
+        self._async_pool = None
+        self._async_pool_loop = None
 
     @contextmanager
     def connect(self):
-        conn_params = {
-            k: v
-            for k, v in vars(self.config).items()
-            if k != "engine" and v is not None and k != "schema_query_path"
-        }
+        with self._pooled_connection() as conn:
+            yield conn
+
+    def _new_connection(self):
         try:
             from psycopg2 import connect
         except ImportError as e:
             raise ModuleNotFoundError(
                 "To use Postgres, please install psycopg2 by using 'pip install querygpt[postgres]'"
             )
-        conn = connect(**conn_params)
+        return connect(**self._connection_params())
+
+    def _check_connection(self, conn):
+        if conn.closed:
+            raise ConnectionError("connection is closed")
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+
+    def _reset_connection(self, conn):
+        if conn.closed:
+            raise ConnectionError("connection is closed")
+        # read_sql leaves an open (possibly aborted) transaction behind
+        conn.rollback()
+
+    def fetch_arrow(self, query: str):
+        pyarrow = _import_pyarrow()
         try:
-            yield conn
+            from adbc_driver_postgresql import dbapi as adbc
+        except ImportError:
+            adbc = None
+        if adbc is not None:
+            # the ADBC driver reads `COPY ... TO STDOUT (FORMAT binary)` straight into Arrow buffers
+            uri = "postgresql://{}:{}@{}:{}/{}".format(
+                quote(self.config.user, safe=""),
+                quote(self.config.password, safe=""),
+                self.config.host,
+                self.config.port,
+                self.config.dbname,
+            )
+            with adbc.connect(uri) as conn, conn.cursor() as cursor:
+                cursor.execute(query)
+                return cursor.fetch_arrow_table()
+        # without ADBC, decoding binary COPY would happen row by row in python, so we copy as CSV
+        # and let Arrow's (C++) CSV reader build the columns. The column types come from the query
+        # itself, never from CSV inference, which would e.g. turn '007' varchars into integers.
+        from pyarrow import csv
+
+        query = query.strip().rstrip(";")
+        buffer = io.BytesIO()
+        with self.connect() as conn, conn.cursor() as cursor:
+            # timestamptz values are written in UTC, SET LOCAL ends with the transaction
+            cursor.execute("SET LOCAL TimeZone TO 'UTC'; SET LOCAL DateStyle TO 'ISO'")
+            cursor.execute(f"SELECT * FROM (\n{query}\n) AS described_query LIMIT 0")
+            column_types = {column.name: _postgres_arrow_type(pyarrow, column.type_code) for column in cursor.description}
+            cursor.copy_expert(f"COPY (\n{query}\n) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+        buffer.seek(0)
+        return csv.read_csv(
+            buffer,
+            convert_options=csv.ConvertOptions(
+                column_types=column_types,
+                # NULL is written unquoted and the empty string quoted
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=False,
+                true_values=["t"],
+                false_values=["f"],
+            ),
+        )
+
+    @contextmanager
+    def _statement_timeout(self, conn, query: str, seconds: float = None):
+        if seconds:
+            # SET LOCAL only lasts for the current transaction, which the pool rolls back on checkin
+            with conn.cursor() as cursor:
+                cursor.execute(f"SET LOCAL statement_timeout = {int(seconds * 1000)}")
+        yield query
+
+    def explain(self, query: str) -> dict:
+        with self.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {query.strip().rstrip(';')}")
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        plan = plan[0]["Plan"]
+        return {
+            "estimated_rows": plan.get("Plan Rows"),
+            "estimated_scan_rows": _max_plan_value(plan, "Plans", lambda node: node.get("Plan Rows")),
+            "estimated_cost": plan.get("Total Cost"),
+        }
+
+    @contextmanager
+    def _stream_cursor(self, conn, chunk_size: int):
+        # a named cursor is a server-side cursor: rows stay on the server until fetched
+        cursor = conn.cursor(name=f"querygpt_{uuid.uuid4().hex}")
+        cursor.itersize = chunk_size
+        try:
+            yield cursor
         finally:
-            conn.close()
+            cursor.close()
 
     def list_all_schemas(
         self, exclude_system_schemas: List[str] = ["information_schema", "pg_catalog"]
@@ -137,30 +577,9 @@ class PostgresDatabase(DatabaseBase):
         table_name: str = None,
         exclude_system_schemas: List[str] = ["information_schema", "pg_catalog"],
     ):
-        if table_name:
-            # table = f'{table_schema}.{table_name}'
-            table = table_name
-            return self.execute_query(
-                "SELECT column_name FROM information_schema.columns WHERE table_name = '{}' AND table_schema NOT IN ({})".format(
-                    table,
-                    ", ".join(f"'{schema}'" for schema in exclude_system_schemas),
-                )
-            )
-        return self.execute_query(
-            "SELECT column_name FROM information_schema.columns WHERE table_schema NOT IN ({})".format(
-                ", ".join(f"'{schema}'" for schema in exclude_system_schemas),
-            )
-        )
-
-    def get_all_tables_schema(self):
-        path = resolve_path_from_project(self.config.schema_query_path)
-        query = load_query_from_file(path)
-        return self.execute_query(query)
-
-    def get_table_schema(self, table_name: Union[str, List[str]]):
-        table_names = [table_name] if isinstance(table_name, str) else table_name
-        all_tables_schema = self.get_all_tables_schema()
-        return all_tables_schema[all_tables_schema["table_name"].isin(table_names)]
+        columns = self.catalog.get(table_name, table_schema=table_schema if table_name else None)
+        columns = columns[~columns["table_schema"].isin(exclude_system_schemas)]
+        return columns[["column_name"]].reset_index(drop=True)
 
     def get_table_sample_data(self, table_schema: str, table_name: str):
         if table_name and table_schema:
@@ -170,6 +589,79 @@ class PostgresDatabase(DatabaseBase):
             f"both table_schema: {table_schema}, and table_name {table_name} cannot be null"
         )
 
+    async def _get_async_pool(self):
+        loop = asyncio.get_running_loop()
+        # asyncpg pools are bound to the loop that created them
+        if self._async_pool is None or self._async_pool_loop is not loop:
+            try:
+                import asyncpg
+            except ImportError as e:
+                raise ModuleNotFoundError(
+                    "To use Postgres asynchronously, please install asyncpg by using 'pip install querygpt[postgres]'"
+                )
+            pool_config = self.config.pool
+            self._async_pool = await asyncpg.create_pool(
+                user=self.config.user,
+                password=self.config.password,
+                host=self.config.host,
+                port=self.config.port,
+                database=self.config.dbname,
+                min_size=pool_config.min_size,
+                max_size=pool_config.max_size,
+                max_inactive_connection_lifetime=pool_config.idle_timeout,
+            )
+            self._async_pool_loop = loop
+            logger.info(
+                f"Created async postgres connection pool (min_size={pool_config.min_size}, max_size={pool_config.max_size})"
+            )
+        return self._async_pool
+
+    @asynccontextmanager
+    async def aconnect(self):
+        pool = await self._get_async_pool()
+        async with pool.acquire(timeout=self.config.pool.acquire_timeout) as conn:
+            yield conn
+
+    async def aexecute_query(
+        self, query: str, max_rows: int = None, max_bytes: int = None, timeout_seconds: float = None
+    ) -> pd.DataFrame:
+        logger.debug(f"Executing async query: {query[:100]}...")
+        try:
+            # asyncpg cursors are server-side and, like SET LOCAL, need a transaction
+            async with self.aconnect() as conn, conn.transaction():
+                if timeout_seconds:
+                    await conn.execute(f"SET LOCAL statement_timeout = {int(timeout_seconds * 1000)}")
+                statement = await conn.prepare(query)
+                columns = [attribute.name for attribute in statement.get_attributes()]
+                if max_rows is None and max_bytes is None:
+                    rows = await statement.fetch()
+                    result = pd.DataFrame.from_records(
+                        [tuple(row) for row in rows], columns=columns, coerce_float=True
+                    )
+                else:
+                    cursor = await statement.cursor()
+                    result = await self._afetch_capped(
+                        cursor.fetch, columns, max_rows=max_rows, max_bytes=max_bytes
+                    )
+            logger.debug(f"Async query executed successfully, returned {len(result)} rows")
+            return result
+        except Exception as e:
+            logger.error(f"Async query execution failed: {e}")
+            raise
+
+    async def aget_table_sample_data(self, table_schema: str, table_name: str):
+        if not (table_name and table_schema):
+            raise ValueError(
+                f"both table_schema: {table_schema}, and table_name {table_name} cannot be null"
+            )
+        return await self.aexecute_query(f"select * from {table_schema}.{table_name} limit 10")
+
+    async def aclose(self):
+        self.close()
+        if self._async_pool is not None:
+            await self._async_pool.close()
+            self._async_pool = None
+
     def get_table_references(self, table_name: str):
         query = f"""WITH
             fk_from AS (
@@ -231,28 +723,79 @@ class PostgresDatabase(DatabaseBase):
 
 
 class OracleDatabase(DatabaseBase):
+    # oracle returns unquoted aliases upper cased
+    _schema_table_column = "TABLE_NAME"
+    _schema_schema_column = "TABLE_SCHEMA"
+
     def __init__(self, config: DatabaseConfig):
         super().__init__(config)
 
     @contextmanager
     def connect(self):
+        with self._pooled_connection() as conn:
+            yield conn
+
+    def _new_connection(self):
         try:
             from oracledb import connect
         except ImportError as e:
             raise ModuleNotFoundError(
                 "To use Oracle, please install oracledb by using 'pip install querygpt[oracle]'"
             )
+        return connect(**self._connection_params())
 
-        conn_params = {
-            k: v
-            for k, v in vars(self.config).items()
-            if k != "engine" and v is not None and k != "schema_query_path"
-        }
-        conn = connect(**conn_params)
+    def _check_connection(self, conn):
+        conn.ping()
+
+    def _reset_connection(self, conn):
+        conn.rollback()
+
+    @contextmanager
+    def _statement_timeout(self, conn, query: str, seconds: float = None):
+        if not seconds:
+            yield query
+            return
+        # call_timeout bounds each round trip, oracle cancels the running call once it expires
+        previous = conn.call_timeout
+        conn.call_timeout = int(seconds * 1000)
         try:
-            yield conn
+            yield query
         finally:
-            conn.close()
+            conn.call_timeout = previous
+
+    def explain(self, query: str) -> dict:
+        statement_id = f"querygpt_{uuid.uuid4().hex[:20]}"
+        with self.connect() as conn, conn.cursor() as cursor:
+            cursor.execute(
+                f"EXPLAIN PLAN SET STATEMENT_ID = '{statement_id}' FOR {query.strip().rstrip(';')}"
+            )
+            try:
+                cursor.execute(
+                    "SELECT MAX(CASE WHEN id = 0 THEN cardinality END), MAX(cardinality), MAX(CASE WHEN id = 0 THEN cost END) "
+                    "FROM plan_table WHERE statement_id = :1",
+                    [statement_id],
+                )
+                estimated_rows, estimated_scan_rows, estimated_cost = cursor.fetchone()
+            finally:
+                cursor.execute("DELETE FROM plan_table WHERE statement_id = :1", [statement_id])
+                conn.commit()
+        return {
+            "estimated_rows": estimated_rows,
+            "estimated_scan_rows": estimated_scan_rows,
+            "estimated_cost": estimated_cost,
+        }
+
+    def limit_query(self, query: str, limit: int) -> str:
+        return f"SELECT * FROM (\n{query.strip().rstrip(';')}\n) FETCH FIRST {int(limit)} ROWS ONLY"
+
+    def fetch_arrow(self, query: str):
+        pyarrow = _import_pyarrow()
+        with self.connect() as conn:
+            # python-oracledb fetches straight into Arrow arrays (thin mode, oracledb>=2.5)
+            frame = conn.fetch_df_all(statement=query, arraysize=self.config.fetch_chunk_size)
+        if hasattr(frame, "__arrow_c_stream__"):
+            return pyarrow.table(frame)
+        return pyarrow.Table.from_arrays(frame.column_arrays(), names=frame.column_names())
 
     def list_all_schemas(
         self,
@@ -313,47 +856,20 @@ ORDER  BY owner, table_name
         table_name: str = None,
         exclude_system_schemas: List[str] = ["information_schema", "pg_catalog"],
     ):
-        if table_name:
-            # table = f'{table_schema}.{table_name}'
-            table = table_name
-            return self.execute_query(
-                """SELECT owner schema_name,
-                        table_name,
-                        column_name,
-                        data_type,
-                        data_length,
-                        data_precision,
-                        data_scale,
-                        nullable
-                    FROM   all_tab_columns
-                    where table table_name = '{}'        
-                    ORDER  BY owner, table_name, column_id
-                """.format(
-                    table
-                )
-            )
-        return self.execute_query(
-            """SELECT owner schema_name,
-                        table_name,
-                        column_name,
-                        data_type,
-                        data_length,
-                        data_precision,
-                        data_scale,
-                        nullable
-                    FROM   all_tab_columns
-                    ORDER  BY owner, table_name, column_id"""
-        )
-
-    def get_all_tables_schema(self):
-        path = resolve_path_from_project(self.config.schema_query_path)
-        query = load_query_from_file(path)
-        return self.execute_query(query)
-
-    def get_table_schema(self, table_name: Union[str, List[str]]):
-        table_names = [table_name] if isinstance(table_name, str) else table_name
-        all_tables_schema = self.get_all_tables_schema()
-        return all_tables_schema[all_tables_schema["TABLE_NAME"].isin(table_names)]
+        columns = self.catalog.get(table_name, table_schema=table_schema if table_name else None)
+        columns = columns[~columns["TABLE_SCHEMA"].isin(exclude_system_schemas)]
+        return columns[
+            [
+                "TABLE_SCHEMA",
+                "TABLE_NAME",
+                "COLUMN_NAME",
+                "DATA_TYPE",
+                "DATA_LENGTH",
+                "DATA_PRECISION",
+                "DATA_SCALE",
+                "NULLABLE",
+            ]
+        ].rename(columns={"TABLE_SCHEMA": "SCHEMA_NAME"}).reset_index(drop=True)
 
     def get_table_sample_data(self, table_schema: str, table_name: str):
         if table_name and table_schema:
@@ -369,25 +885,92 @@ ORDER  BY owner, table_name
 class ClickhouseDatabase(DatabaseBase):
     def __init__(self, config: DatabaseConfig):
         super().__init__(config)
+        self._sqlalchemy_engine = None
+        self._async_engine = None
+
+    def _get_sqlalchemy_engine(self):
+        # sqlalchemy already pools connections per engine, so we build the engine once
+        # and size its pool from the same settings the other sources use.
+        if self._sqlalchemy_engine is None:
+            with self._pool_lock:
+                if self._sqlalchemy_engine is None:
+                    try:
+                        from sqlalchemy import create_engine
+                        from sqlalchemy.pool import NullPool
+                        import clickhouse_sqlalchemy  # noqa: F401 registers the dialect
+                    except ImportError as e:
+                        raise ModuleNotFoundError(
+                            "To use Clickhouse, please install clickhouse-sqlalchemy and sqlalchemy by using 'pip install querygpt[clickhouse]'"
+                        )
+                    url = f"clickhouse://{self.config.user}:{self.config.password}@{self.config.host}/{self.config.dbname}"
+                    pool_config = self.config.pool
+                    if pool_config.enabled:
+                        pool_kwargs = {
+                            "pool_size": pool_config.max_size,
+                            "max_overflow": 0,
+                            "pool_timeout": pool_config.acquire_timeout,
+                            "pool_recycle": pool_config.idle_timeout or -1,
+                            "pool_pre_ping": pool_config.health_check,
+                        }
+                    else:
+                        pool_kwargs = {"poolclass": NullPool}
+                    self._sqlalchemy_engine = create_engine(url, **pool_kwargs)
+        return self._sqlalchemy_engine
 
     @contextmanager
     def connect(self):
-        try:
-            from sqlalchemy import create_engine
-            from clickhouse_sqlalchemy import make_session
-        except ImportError as e:
-            raise ModuleNotFoundError(
-                "To use Clickhouse, please install clickhouse-sqlalchemy and sqlalchemy by using 'pip install querygpt[clickhouse]'"
-            )
+        yield self._get_sqlalchemy_engine()
 
-        engine = create_engine(
-            f"clickhouse://{self.config.user}:{self.config.password}@{self.config.host}/{self.config.dbname}"
-        )
-        session = make_session(engine)
+    @staticmethod
+    def _with_max_execution_time(query: str, seconds: float = None) -> str:
+        if not seconds:
+            return query
+        # connections are shared through the engine, so the limit travels with the query instead
+        return f"SELECT * FROM (\n{query.strip().rstrip(';')}\n) SETTINGS max_execution_time = {max(1, int(seconds))}"
+
+    @contextmanager
+    def _statement_timeout(self, conn, query: str, seconds: float = None):
+        yield self._with_max_execution_time(query, seconds)
+
+    def explain(self, query: str) -> dict:
+        # EXPLAIN ESTIMATE returns the rows read from each table, clickhouse estimates neither the
+        # rows returned nor a cost
+        estimate = self.execute_query(f"EXPLAIN ESTIMATE {query.strip().rstrip(';')}")
+        return {
+            "estimated_rows": None,
+            "estimated_scan_rows": float(estimate["rows"].sum()) if len(estimate) else 0.0,
+            "estimated_cost": None,
+        }
+
+    @contextmanager
+    def _stream_cursor(self, conn, chunk_size: int):
+        raw_connection = conn.raw_connection()
+        cursor = raw_connection.cursor()
+        cursor.arraysize = chunk_size
         try:
-            yield session.bind
+            yield cursor
         finally:
-            session.close()
+            cursor.close()
+            raw_connection.close()
+
+    def pool_stats(self) -> dict | None:
+        if self._sqlalchemy_engine is None or not self.config.pool.enabled:
+            return None
+        pool = self._sqlalchemy_engine.pool
+        return {
+            "name": f"{self.engine}-pool",
+            "min_size": 0,
+            "max_size": pool.size(),
+            "size": pool.checkedin() + pool.checkedout(),
+            "idle": pool.checkedin(),
+            "in_use": pool.checkedout(),
+            "overflow": pool.overflow(),
+        }
+
+    def close(self):
+        if self._sqlalchemy_engine is not None:
+            self._sqlalchemy_engine.dispose()
+            self._sqlalchemy_engine = None
 
     def list_all_schemas(
         self,
@@ -427,33 +1010,77 @@ class ClickhouseDatabase(DatabaseBase):
             "INFORMATION_SCHEMA",
         ],
     ):
+        if table_name and table_schema:
+            columns = self.catalog.get(table_name, table_schema=table_schema)
+            columns = columns[~columns["table_schema"].isin(exclude_system_schemas)]
+            return columns[["table_name", "column_name"]].drop_duplicates().reset_index(drop=True)
+        columns = self.catalog.all()
+        columns = columns[~columns["table_schema"].isin(exclude_system_schemas)]
+        return columns[["column_name"]].drop_duplicates().reset_index(drop=True)
+
+    def get_table_sample_data(self, table_schema: str, table_name: str):
         if table_name and table_schema:
             table = f"{table_schema}.{table_name}"
-            return self.execute_query(
-                "select distinct table AS table_name, name AS column_name from system.columns where table = {} database not in ({})".format(
-                    table, ", ".join(f"'{schema}'" for schema in exclude_system_schemas)
+        return self.execute_query("select * from {} limit 10".format(table))
+
+    def _get_async_engine(self):
+        if self._async_engine is None:
+            try:
+                from sqlalchemy.ext.asyncio import create_async_engine
+                import asynch  # noqa: F401
+            except ImportError as e:
+                raise ModuleNotFoundError(
+                    "To use Clickhouse asynchronously, please install asynch by using 'pip install querygpt[clickhouse]'"
                 )
+            pool_config = self.config.pool
+            # asynch speaks the native protocol, hence the native port instead of the http one
+            self._async_engine = create_async_engine(
+                f"clickhouse+asynch://{self.config.user}:{self.config.password}@{self.config.host}:{self.config.native_port}/{self.config.dbname}",
+                pool_size=pool_config.max_size,
+                max_overflow=0,
+                pool_timeout=pool_config.acquire_timeout,
+                pool_recycle=pool_config.idle_timeout or -1,
+                pool_pre_ping=pool_config.health_check,
             )
-        return self.execute_query(
-            "select distinct name AS column_name from system.columns where database not in ({})".format(
-                ", ".join(f"'{schema}'" for schema in exclude_system_schemas)
-            )
-        )
+        return self._async_engine
 
-    def get_all_tables_schema(self):
-        path = resolve_path_from_project(self.config.schema_query_path)
-        query = load_query_from_file(path)
-        return self.execute_query(query)
+    @asynccontextmanager
+    async def aconnect(self):
+        async with self._get_async_engine().connect() as conn:
+            yield conn
 
-    def get_table_schema(self, table_name: Union[str, List[str]]):
-        table_names = [table_name] if isinstance(table_name, str) else table_name
-        all_tables_schema = self.get_all_tables_schema()
-        return all_tables_schema[all_tables_schema["table_name"].isin(table_names)]
+    async def aexecute_query(
+        self, query: str, max_rows: int = None, max_bytes: int = None, timeout_seconds: float = None
+    ) -> pd.DataFrame:
+        from sqlalchemy import text
 
-    def get_table_sample_data(self, table_schema: str, table_name: str):
-        if table_name and table_schema:
-            table = f"{table_schema}.{table_name}"
-        return self.execute_query("select * from {} limit 10".format(table))
+        logger.debug(f"Executing async query: {query[:100]}...")
+        query = self._with_max_execution_time(query, timeout_seconds)
+        try:
+            async with self.aconnect() as conn:
+                # escape colons so sqlalchemy does not read them as bind parameters
+                result = await conn.stream(text(query.replace(":", "\\:")))
+                frame = await self._afetch_capped(
+                    result.fetchmany, list(result.keys()), max_rows=max_rows, max_bytes=max_bytes
+                )
+            logger.debug(f"Async query executed successfully, returned {len(frame)} rows")
+            return frame
+        except Exception as e:
+            logger.error(f"Async query execution failed: {e}")
+            raise
+
+    async def aget_table_sample_data(self, table_schema: str, table_name: str):
+        if not (table_name and table_schema):
+            raise ValueError(
+                f"both table_schema: {table_schema}, and table_name {table_name} cannot be null"
+            )
+        return await self.aexecute_query(f"select * from {table_schema}.{table_name} limit 10")
+
+    async def aclose(self):
+        self.close()
+        if self._async_engine is not None:
+            await self._async_engine.dispose()
+            self._async_engine = None
 
 
 class DuckDBDatabase(DatabaseBase):
@@ -477,25 +1104,196 @@ class DuckDBDatabase(DatabaseBase):
         finally:
             conn.close()
 
+    def fetch_arrow(self, query: str):
+        _import_pyarrow()
+        with self.connect() as conn:
+            return conn.execute(query).fetch_arrow_table()
+
+    @contextmanager
+    def _statement_timeout(self, conn, query: str, seconds: float = None):
+        if not seconds:
+            yield query
+            return
+        # duckdb has no statement timeout setting, interrupt the connection from a timer instead.
+        # cursors are separate connections that do not see the interrupt, see `_stream_cursor`
+        timer = threading.Timer(seconds, conn.interrupt)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield query
+        finally:
+            timer.cancel()
+
+    @contextmanager
+    def _stream_cursor(self, conn, chunk_size: int):
+        # every `connect` opens its own connection, so it can serve as the cursor
+        yield conn
+
+    def _read_dataframe(self, conn, query: str) -> pd.DataFrame:
+        # pandas would run the query on a new cursor, a separate connection the timeout does not interrupt
+        return conn.execute(query).df()
+
+    def explain(self, query: str) -> dict:
+        def estimate(node) -> Tuple[float, float]:
+            """(estimated rows of `node`, largest estimate in its subtree)"""
+            children = [estimate(child) for child in node.get("children", [])]
+            try:
+                rows = float(node.get("extra_info", {})["Estimated Cardinality"])
+            except (KeyError, TypeError, ValueError):
+                # cross products carry no estimate, derive one from their inputs
+                if node.get("name") == "CROSS_PRODUCT" and children:
+                    rows = float(np.prod([child[0] for child in children]))
+                else:
+                    rows = max((child[0] for child in children), default=0.0)
+            return rows, max([rows] + [child[1] for child in children])
+
+        with self.connect() as conn:
+            rows = conn.execute(f"EXPLAIN (FORMAT JSON) {query.strip().rstrip(';')}").fetchall()
+        plan = [estimate(node) for node in json.loads(rows[0][1])]
+        return {
+            "estimated_rows": plan[0][0],
+            "estimated_scan_rows": max(node[1] for node in plan),
+            "estimated_cost": None,
+        }
+
+
+_TRACE_COLUMNS = [
+    "id",
+    "task",
+    "enhanced_task",
+    "start_time",
+    "end_time",
+    "duration_seconds",
+    "final_answer",
+    "system_prompt",
+    "total_steps",
+    "sql",
+    "sql_explanation",
+]
+_TRACESTEP_COLUMNS = [
+    "id",
+    "trace_id",
+    "step_number",
+    "step_type",
+    "start_time",
+    "end_time",
+    "duration_seconds",
+    "model_input",
+    "model_output",
+    "tool_calls",
+    "observations",
+    "error",
+    "action_output",
+    "plan",
+]
+
+
+_DOCUMENTATION_COLUMNS = [
+    "table_id",
+    "table_name",
+    "table_bussines_summary",
+    "table_possible_usages",
+    "source",
+    "id",
+    "column_name",
+    "column_details_summary",
+    "bussines_summary",
+    "possible_usages",
+    "tags",
+]
+_DOCUMENTATION_QUERY = """select t.id table_id, t.table_name, t.bussines_summary table_bussines_summary, t.possible_usages table_possible_usages, t.source,
+                c.id, c.column_name, c.column_details_summary, c.bussines_summary, c.possible_usages, c.tags
+                from column_metadata c, table_metadata t
+                where t.id = c.table_id"""
+
 
 class InternalDatabase(DuckDBDatabase):
+    """DuckDB database holding querygpt's own state (documentation, traces, caches).
+
+    Unlike `DuckDBDatabase` it keeps a single connection open for its lifetime and hands out a
+    cursor per thread, and it only runs the DDL script when the schema it records is out of date.
+    """
+
     def __init__(self, config: DatabaseConfig):
         super().__init__(config)
+        self._conn = None
+        self._cursors = []
+        self._local = threading.local()
+        self._documentations = None
+        self._documentations_lock = threading.Lock()
         self.__post_init__()
 
     def __post_init__(self):
         # post init is to do checks on interal ddl scheam
-        logger.info("Initializing internal database schema")
         try:
             path = resolve_path_from_project(self.config.ddl_query_path)
             ddl_script = load_query_from_file(path)
+            version = hashlib.sha256(ddl_script.encode()).hexdigest()
             with self.connect() as conn:
+                if self._schema_version(conn) == version:
+                    logger.debug(f"Internal database schema is up to date ({version[:12]})")
+                    return
+                logger.info("Initializing internal database schema")
                 conn.execute(ddl_script)
+                conn.execute(
+                    "INSERT INTO schema_version (version, applied_at) VALUES (?, ?)",
+                    (version, datetime.now()),
+                )
             logger.info("Internal database schema initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize internal database schema: {e}")
             raise e
 
+    def _schema_version(self, conn) -> str | None:
+        exists = conn.execute(
+            "SELECT count(*) FROM duckdb_tables() WHERE table_name = 'schema_version'"
+        ).fetchone()[0]
+        if not exists:
+            return None
+        row = conn.execute(
+            "SELECT version FROM schema_version ORDER BY applied_at DESC LIMIT 1"
+        ).fetchone()
+        return row[0] if row else None
+
+    def _connection(self):
+        if self._conn is None:
+            with self._pool_lock:
+                if self._conn is None:
+                    try:
+                        from duckdb import connect
+                    except ImportError as e:
+                        raise ModuleNotFoundError(
+                            "To use DuckDB, please install duckdb by using 'pip install querygpt[duckdb]'"
+                        )
+                    path = Path(self.config.path)
+                    os.makedirs(path.parent, exist_ok=True)
+                    self._conn = connect(path)
+                    logger.debug(f"Opened internal database {path}")
+        return self._conn
+
+    @contextmanager
+    def connect(self):
+        # a duckdb connection must not be used from several threads at once, each thread
+        # gets its own cursor on the shared database instead
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._connection().cursor()
+            self._local.cursor = cursor
+            with self._pool_lock:
+                self._cursors.append(cursor)
+        yield cursor
+
+    def close(self):
+        with self._pool_lock:
+            cursors, self._cursors = self._cursors, []
+            conn, self._conn = self._conn, None
+            # cursors left in other threads' locals are closed below, a new local is handed out next time
+            self._local = threading.local()
+        for cursor in cursors:
+            cursor.close()
+        if conn is not None:
+            conn.close()
+
     def save_trace(self, trace: Trace):
         """Save the trace into the database.
 
@@ -505,153 +1303,314 @@ class InternalDatabase(DuckDBDatabase):
         Returns:
             trace_id (int): The id of the trace.
         """
-        logger.info(f"Saving trace {trace.id} to database")
-        trace = trace.to_dict()
-        try:
-            with self.connect() as conn:
-                logger.debug("Inserting trace record")
-                trace_id = conn.execute(
-                    "INSERT INTO trace (id, task, enhanced_task, start_time, end_time, duration_seconds, final_answer, system_prompt, total_steps) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id",
-                    (
-                        trace.get("id"),
-                        trace.get("task"),
-                        trace.get("enhanced_task"),
-                        trace.get("start_time"),
-                        trace.get("end_time"),
-                        trace.get("duration_seconds"),
-                        trace.get("final_answer"),
-                        trace.get("system_prompt"),
-                        trace.get("total_steps"),
-                    ),
-                ).fetchone()
-                trace_id = trace_id[0]
-                logger.debug(f"Trace record inserted with ID: {trace_id}")
-                
-                logger.debug(f"Inserting {len(trace['steps'])} trace steps")
-                for step in trace["steps"]:
+        return self.save_traces([trace])[0]
+
+    def save_traces(self, traces: List[Trace]) -> List[str]:
+        """Save a batch of traces and their steps with one bulk insert per table, in a single transaction.
+
+        Returns:
+            trace_ids (List[str]): The ids of the traces.
+        """
+        trace_rows, step_rows = [], []
+        for trace in traces:
+            trace = trace.to_dict()
+            trace_rows.append({column: trace.get(column) for column in _TRACE_COLUMNS})
+            for step in trace["steps"]:
+                step = {column: step.get(column) for column in _TRACESTEP_COLUMNS}
+                if isinstance(step["tool_calls"], str):
+                    # one element per tool call, as duckdb splits the json list when casting it to TEXT[]
+                    step["tool_calls"] = [json.dumps(call) for call in json.loads(step["tool_calls"])]
+                step_rows.append(step)
+        if not trace_rows:
+            return []
+        # object columns keep None as NULL, float columns would turn it into NaN
+        staged_traces = pd.DataFrame(trace_rows, columns=_TRACE_COLUMNS, dtype=object)
+        staged_steps = pd.DataFrame(step_rows, columns=_TRACESTEP_COLUMNS, dtype=object)
+        logger.info(f"Saving {len(trace_rows)} traces with {len(step_rows)} steps to database")
+        with self.connect() as conn:
+            conn.register("staged_traces", staged_traces)
+            conn.register("staged_tracesteps", staged_steps)
+            try:
+                conn.execute("BEGIN TRANSACTION")
+                conn.execute(
+                    f"INSERT INTO trace ({', '.join(_TRACE_COLUMNS)}) SELECT {', '.join(_TRACE_COLUMNS)} FROM staged_traces"
+                )
+                if step_rows:
                     conn.execute(
-                        "INSERT INTO tracestep (id, trace_id, step_number, step_type, start_time, end_time, duration_seconds, model_input, model_output, tool_calls, observations, error, action_output, plan) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                        (
-                            step.get("id"),
-                            step.get("trace_id"),
-                            step.get("step_number"),
-                            step.get("step_type"),
-                            step.get("start_time"),
-                            step.get("end_time"),
-                            step.get("duration_seconds"),
-                            step.get("model_input"),
-                            step.get("model_output"),
-                            step.get("tool_calls"),
-                            step.get("observations"),
-                            step.get("error"),
-                            step.get("action_output"),
-                            step.get("plan"),
-                        ),
+                        f"INSERT INTO tracestep ({', '.join(_TRACESTEP_COLUMNS)}) SELECT {', '.join(_TRACESTEP_COLUMNS)} FROM staged_tracesteps"
                     )
-            logger.info(f"Trace {trace_id} saved successfully with {len(trace['steps'])} steps")
-            return trace_id
-        except Exception as e:
-            logger.error(f"Failed to save trace: {e}")
-            raise e
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                logger.error(f"Failed to save traces: {e}")
+                raise e
+            finally:
+                conn.unregister("staged_traces")
+                conn.unregister("staged_tracesteps")
+        logger.debug(f"Saved traces {[row['id'] for row in trace_rows]}")
+        return [row["id"] for row in trace_rows]
+
+    def save_documentation(self, documentation, source: str = None, adopt_unsourced: bool = False):
+        """Save the documentation of one table, see `save_documentations`.
 
-    def save_documentation(self, documentation):
-        documentation = documentation.model_dump()
-        with self.connect() as conn:
-            # should be a standalone function that can be used for all tables to check if documentation exists, if not then run init_documentation. but we can ignore for now..
-            table_id = conn.execute(
-                "SELECT id FROM table_metadata WHERE table_name = ?",
-                (documentation["table_name"],),
-            ).fetchone()
+        Returns:
+            table_id (int): The id of the table.
+        """
+        return self.save_documentations([documentation], source=source, adopt_unsourced=adopt_unsourced)[
+            documentation.table_name
+        ]
+
+    def save_documentations(self, documentations: list, source: str = None, adopt_unsourced: bool = False) -> dict:
+        """Insert or update the documentation of a batch of tables of `source` and their columns.
+
+        Tables are matched by (source, name) and columns by (table, column name). With
+        `adopt_unsourced`, a table saved before tables had a source becomes the table of `source`
+        of the same name, unless `source` already has one. Columns of a saved table missing from its new
+        documentation are removed. The whole batch is staged as dataframes and applied with a few
+        set based statements in a single transaction.
 
-            if table_id:
+        Returns:
+            {table_name: table_id}
+        """
+        tables, columns = [], []
+        for documentation in documentations:
+            documentation = documentation.model_dump()
+            tables.append(
+                {
+                    "table_name": documentation["table_name"],
+                    "source": source,
+                    "bussines_summary": documentation["bussines_summary"],
+                    "possible_usages": documentation["possible_usages"],
+                }
+            )
+            for column in documentation["columns_summary"]:
+                columns.append(
+                    {
+                        "table_name": documentation["table_name"],
+                        "column_name": column["column_name"],
+                        "column_details_summary": column["column_details_summary"],
+                        "bussines_summary": column["bussines_summary"],
+                        "possible_usages": column["possible_usages"],
+                        "tags": list(column["tags"]),
+                    }
+                )
+        if not tables:
+            return {}
+        # the last documentation of a table (or column) wins, as it would when saved one by one
+        staged_tables = pd.DataFrame(tables, dtype=object).drop_duplicates("table_name", keep="last")
+        staged_columns = pd.DataFrame(
+            columns,
+            columns=[
+                "table_name",
+                "column_name",
+                "column_details_summary",
+                "bussines_summary",
+                "possible_usages",
+                "tags",
+            ],
+        ).drop_duplicates(["table_name", "column_name"], keep="last")
+        same_table = "t.table_name = s.table_name AND t.source IS NOT DISTINCT FROM s.source"
+        logger.debug(f"Saving documentation of {len(staged_tables)} tables and {len(staged_columns)} columns")
+        with self.connect() as conn:
+            conn.register("staged_tables", staged_tables)
+            conn.register("staged_columns", staged_columns)
+            # table_metadata has no unique key on table_name (nor column_metadata on table_id, column_name),
+            # so ON CONFLICT cannot be used, an UPDATE ... FROM followed by an anti-join INSERT does the same.
+            try:
+                conn.execute("BEGIN TRANSACTION")
+                if adopt_unsourced and source is not None:
+                    conn.execute(
+                        """
+                        UPDATE table_metadata AS t
+                        SET source = s.source
+                        FROM staged_tables s
+                        WHERE t.table_name = s.table_name AND t.source IS NULL
+                        AND NOT EXISTS (
+                            SELECT 1 FROM table_metadata o WHERE o.table_name = s.table_name AND o.source = s.source
+                        )
+                        """
+                    )
                 conn.execute(
+                    f"""
+                    UPDATE table_metadata AS t
+                    SET bussines_summary = s.bussines_summary, possible_usages = s.possible_usages
+                    FROM staged_tables s
+                    WHERE {same_table}
                     """
-                    UPDATE table_metadata 
-                    SET bussines_summary = ?, possible_usages = ?
-                    WHERE id = ?
-                    """,
-                    (
-                        documentation["bussines_summary"],
-                        documentation["possible_usages"],
-                        table_id[0],
-                    ),
                 )
-            else:
-                table_id = conn.execute(
+                conn.execute(
+                    f"""
+                    INSERT INTO table_metadata (table_name, source, bussines_summary, possible_usages)
+                    SELECT s.table_name, s.source, s.bussines_summary, s.possible_usages
+                    FROM staged_tables s
+                    WHERE NOT EXISTS (SELECT 1 FROM table_metadata t WHERE {same_table})
                     """
-                    INSERT INTO table_metadata (table_name, bussines_summary, possible_usages)
-                    VALUES (?, ?, ?)
-                    RETURNING id
-                    """,
-                    (
-                        documentation["table_name"],
-                        documentation["bussines_summary"],
-                        documentation["possible_usages"],
-                    ),
-                ).fetchone()
-
-            table_id = table_id[0]
-
-            for column in documentation["columns_summary"]:
-                column_id = conn.execute(
+                )
+                # resolve every staged table to its id once, the table may have duplicates, take the first
+                conn.execute(
+                    f"""
+                    CREATE OR REPLACE TEMP TABLE staged_table_ids AS
+                    SELECT s.table_name, min(t.id) AS table_id
+                    FROM staged_tables s JOIN table_metadata t ON {same_table}
+                    GROUP BY s.table_name
                     """
-                SELECT id FROM column_metadata 
-                WHERE table_id = ? AND column_name = ?
-                """,
-                    (table_id, column["column_name"]),
-                ).fetchone()
-
-                if column_id:
-                    conn.execute(
-                        """
-                        UPDATE column_metadata 
-                        SET column_details_summary = ?, 
-                            bussines_summary = ?, 
-                            possible_usages = ?, 
-                            tags = ?
-                        WHERE id = ?
-                        """,
-                        (
-                            column["column_details_summary"],
-                            column["bussines_summary"],
-                            column["possible_usages"],
-                            json.dumps(column["tags"]),
-                            column_id[0],
-                        ),
+                )
+                conn.execute(
+                    """
+                    CREATE OR REPLACE TEMP TABLE staged_column_ids AS
+                    SELECT t.table_id, s.column_name, s.column_details_summary, s.bussines_summary,
+                           s.possible_usages, CAST(s.tags AS VARCHAR[]) AS tags
+                    FROM staged_columns s JOIN staged_table_ids t ON t.table_name = s.table_name
+                    """
+                )
+                conn.execute(
+                    """
+                    DELETE FROM column_metadata
+                    WHERE table_id IN (SELECT table_id FROM staged_table_ids)
+                    AND NOT EXISTS (
+                        SELECT 1 FROM staged_column_ids s
+                        WHERE s.table_id = column_metadata.table_id AND s.column_name = column_metadata.column_name
                     )
-                else:
-                    column_id = conn.execute(
-                        """
-                        INSERT INTO column_metadata 
-                        (table_id, column_name, column_details_summary, bussines_summary, possible_usages, tags)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                        RETURNING id
-                        """,
-                        (
-                            table_id,
-                            column["column_name"],
-                            column["column_details_summary"],
-                            column["bussines_summary"],
-                            column["possible_usages"],
-                            json.dumps(column["tags"]),
-                        ),
-                    ).fetchone()
-        return table_id
+                    """
+                )
+                conn.execute(
+                    """
+                    UPDATE column_metadata
+                    SET column_details_summary = s.column_details_summary,
+                        bussines_summary = s.bussines_summary,
+                        possible_usages = s.possible_usages,
+                        tags = s.tags
+                    FROM staged_column_ids s
+                    WHERE column_metadata.table_id = s.table_id AND column_metadata.column_name = s.column_name
+                    """
+                )
+                conn.execute(
+                    """
+                    INSERT INTO column_metadata
+                    (table_id, column_name, column_details_summary, bussines_summary, possible_usages, tags)
+                    SELECT s.table_id, s.column_name, s.column_details_summary, s.bussines_summary, s.possible_usages, s.tags
+                    FROM staged_column_ids s
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM column_metadata c
+                        WHERE c.table_id = s.table_id AND c.column_name = s.column_name
+                    )
+                    """
+                )
+                table_ids = conn.execute("SELECT table_name, table_id FROM staged_table_ids").fetchall()
+                conn.execute("DROP TABLE staged_column_ids")
+                conn.execute("DROP TABLE staged_table_ids")
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                logger.error(f"Failed to save documentation: {e}")
+                raise e
+            finally:
+                conn.unregister("staged_tables")
+                conn.unregister("staged_columns")
+        logger.info(f"Saved documentation of {len(staged_tables)} tables and {len(staged_columns)} columns")
+        self._refresh_documentations([table_id for _, table_id in table_ids])
+        return dict(table_ids)
+
+    def prune_documentations(self, source: str, table_names: List[str]) -> int:
+        """Delete the documentation of the tables of `source` that are not in `table_names`, e.g. dropped tables.
 
-    def get_all_documenations(self, as_dataframe: bool = True):
-        query = """select t.id table_id, t.table_name, t.bussines_summary table_bussines_summary, t.possible_usages table_possible_usages, c.*
-                from column_metadata c, table_metadata t, 
-                where t.id = c.table_id"""
-        return self.execute_query(query, as_dataframe)
+        Returns:
+            the number of tables removed.
+        """
+        with self.connect() as conn:
+            try:
+                conn.execute("BEGIN TRANSACTION")
+                removed = [
+                    row[0]
+                    for row in conn.execute(
+                        "SELECT id FROM table_metadata WHERE source = ? AND table_name NOT IN (SELECT UNNEST(?))",
+                        (source, list(table_names)),
+                    ).fetchall()
+                ]
+                if removed:
+                    conn.execute("DELETE FROM column_metadata WHERE table_id IN (SELECT UNNEST(?))", (removed,))
+                    conn.execute("DELETE FROM table_metadata WHERE id IN (SELECT UNNEST(?))", (removed,))
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                logger.error(f"Failed to prune documentation of {source}: {e}")
+                raise e
+        if removed:
+            logger.info(f"Removed documentation of {len(removed)} tables no longer in {source}")
+            self._refresh_documentations(removed)
+        return len(removed)
+
+    def get_all_documenations(self, as_dataframe: bool = True, source: str = None):
+        if source is None:
+            return self.execute_query(_DOCUMENTATION_QUERY, as_dataframe)
+        with self.connect() as conn:
+            result = conn.execute(f"{_DOCUMENTATION_QUERY} AND t.source = ?", (source,))
+            return result.df() if as_dataframe else result
+
+    def _documentation_records(self, conn, query: str, parameters=()) -> List[dict]:
+        # built from the rows rather than a dataframe, which turns `tags` into numpy arrays json cannot encode
+        cursor = conn.execute(query, parameters)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def _documentation_map(self) -> dict:
+        # column id -> documentation record of the column and its table, loaded once per process
+        if self._documentations is None:
+            with self._documentations_lock:
+                if self._documentations is None:
+                    with self.connect() as conn:
+                        records = self._documentation_records(conn, _DOCUMENTATION_QUERY)
+                    self._documentations = {record["id"]: record for record in records}
+                    logger.info(f"Loaded documentation of {len(records)} columns")
+        return self._documentations
+
+    def _refresh_documentations(self, table_ids: List[int]):
+        """Reload the cached documentation of `table_ids` after they were saved."""
+        if self._documentations is None or not table_ids:
+            return
+        with self.connect() as conn:
+            records = self._documentation_records(
+                conn, f"{_DOCUMENTATION_QUERY} AND t.id IN (SELECT UNNEST(?))", (list(table_ids),)
+            )
+        with self._documentations_lock:
+            table_ids = set(table_ids)
+            documentations = {
+                column_id: record
+                for column_id, record in self._documentations.items()
+                if record["table_id"] not in table_ids
+            }
+            documentations.update({record["id"]: record for record in records})
+            self._documentations = documentations
 
     def get_documenation(
         self, table_ids: List[int], column_ids: List[int], as_dataframe: bool = True
     ):
-        query = f"""select t.id table_id, t.table_name, t.bussines_summary table_bussines_summary, t.possible_usages table_possible_usages, c.*
-                from column_metadata c, table_metadata t, 
-                where c.id in {tuple(column_ids)} and c.table_id in {tuple(table_ids)}
-                and t.id = c.table_id"""
-        return self.execute_query(query, as_dataframe)
+        """Return the documentation of `column_ids` (belonging to `table_ids`), in the order of `column_ids`.
+
+        Served from the in-memory documentation map, columns missing from it are looked up in the
+        database and added to it.
+        """
+        documentations = self._documentation_map()
+        column_ids = list(dict.fromkeys(int(column_id) for column_id in column_ids))
+        missing = [column_id for column_id in column_ids if column_id not in documentations]
+        if missing:
+            with self.connect() as conn:
+                records = self._documentation_records(
+                    conn, f"{_DOCUMENTATION_QUERY} AND c.id IN (SELECT UNNEST(?))", (missing,)
+                )
+            logger.debug(f"Loaded documentation of {len(records)} columns missing from the cache")
+            with self._documentations_lock:
+                self._documentations.update({record["id"]: record for record in records})
+            documentations = {**documentations, **{record["id"]: record for record in records}}
+        table_ids = {int(table_id) for table_id in table_ids}
+        records = [
+            documentations[column_id]
+            for column_id in column_ids
+            if column_id in documentations and documentations[column_id]["table_id"] in table_ids
+        ]
+        if not as_dataframe:
+            return records
+        return pd.DataFrame.from_records(records, columns=_DOCUMENTATION_COLUMNS)
 
 
 DATABASE_REGISTRY = {
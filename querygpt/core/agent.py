@@ -8,14 +8,18 @@ from querygpt.tools.tools import (
     GenerateSqlTool,
     SqlExecutorTool,
     ContextRetrieverTool,
+    BatchContextRetrieverTool,
     TableSchemaTool,
     TableSampleTool,
     InisghtGeneratorTool,
-    TableReferencesTool
+    TableReferencesTool,
+    semantic_cache,
 )
 from querygpt.core.trace import Trace, TraceStep, ToolCall
 from querygpt.core.query_enhacner import enhance_user_question
 from querygpt.core._database import InternalDatabase
+from querygpt.core.trace_writer import TraceWriter
+from querygpt.core.rate_limit import get_limiter, estimate_tokens
 from querygpt.core.logging import get_logger
 import json
 import time
@@ -24,13 +28,25 @@ logger = get_logger(__name__)
 
 config = init_config()
 
+# step type of the trace of a question answered from the semantic cache
+SEMANTIC_CACHE_STEP = "SemanticCacheStep"
+
 internal_db = InternalDatabase(config.internal_db)
+trace_writer = TraceWriter(internal_db, config.trace_writer) if config.trace_writer.enabled else None
 
 
-ENGINE = LiteLLMModel(
-    model_id=config.llm.model, 
-    temperature=config.llm.temperature,
-)
+class RateLimitedLiteLLMModel(LiteLLMModel):
+    """`LiteLLMModel` whose calls share the quota of the model with every other LLM call of the process, see `rate_limit`."""
+
+    def __init__(self, config, **kwargs):
+        super().__init__(model_id=config.model, temperature=config.temperature, **kwargs)
+        self.limiter = get_limiter(config)
+
+    def generate(self, messages, *args, **kwargs):
+        return self.limiter.call(super().generate, messages, *args, tokens=estimate_tokens(messages), **kwargs)
+
+
+ENGINE = RateLimitedLiteLLMModel(config.llm)
 
 DEFULAT_AUTH_IMPORTS = [
     "unicodedata",
@@ -53,6 +69,7 @@ DEFAULT_TOOLS = [
     GenerateSqlTool(),
     SqlExecutorTool(),
     ContextRetrieverTool(),
+    BatchContextRetrieverTool(),
     TableSchemaTool(),
     TableSampleTool(),
     TableReferencesTool()
@@ -64,7 +81,8 @@ PLANNER_TOOLS = [
     TableSchemaTool(),
     TableSampleTool(),
     TableReferencesTool(),
-    ContextRetrieverTool()
+    ContextRetrieverTool(),
+    BatchContextRetrieverTool()
 ]
 
 def create_agent(
@@ -75,7 +93,7 @@ def create_agent(
     tools: list = DEFAULT_TOOLS,
 ):
     if task == "query":
-        tools = DEFAULT_TOOLS + [InisghtGeneratorTool()]
+        tools = list(tools) + [InisghtGeneratorTool()]
         custom_prompt_templates = yaml.safe_load(
             importlib.resources.files("querygpt.core.prompts").joinpath("query_agent.yaml").read_text()
         )
@@ -86,9 +104,12 @@ def create_agent(
     else:
         raise ValueError(f"Invalid task: {task}, available tasks: query, planner")
 
+    # tools keep the state of the run (the SQL that ran, the last generated one), every agent gets its own
+    # instances so that concurrent runs do not overwrite each other's and cache SQL of another question
+    tools = [type(tool)() for tool in (tools if task == "query" else PLANNER_TOOLS)]
     agent = CodeAgent(
         model=engine,
-        tools=tools if task == "query" else PLANNER_TOOLS,
+        tools=tools,
         additional_authorized_imports=additional_authorized_imports,
         planning_interval=planning_interval,
         prompt_templates=custom_prompt_templates,
@@ -101,7 +122,7 @@ class Agent:
 
     Args:
         task (str): Type of agent, can be "query" or "planner". Defaults to "query".
-        engine: LLM model to use. Defaults to LiteLLMModel(openai).
+        engine: LLM model to use. Defaults to the rate limited LiteLLMModel of `config.llm`.
         planning_interval (int): Interval to plan. Defaults to 5.
         additional_authorized_imports (list): Additional authorized imports. Defaults to:
             - unicodedata
@@ -121,6 +142,7 @@ class Agent:
             - tools.GenerateSqlTool
             - tools.SqlExecutorTool
             - tools.ContextRetrieverTool
+            - tools.BatchContextRetrieverTool
             - tools.TableSchemaTool
             - tools.TableSampleTool
             -  ++ tools.InisghtGeneratorTool if the task if query
@@ -131,13 +153,15 @@ class Agent:
         self.traces = {}
         logger.debug(f"Agent initialized successfully with {len(tools)} tools")
     
-    def run(self, query: str, max_steps: int = 50, use_enhanced_task: bool = True) -> tuple[str, str]:
+    def run(self, query: str, max_steps: int = 50, use_enhanced_task: bool = True, use_semantic_cache: bool = True) -> tuple[str, str]:
         """Run the agent with tracing enabled to record the execution steps.
 
         Args:s
             query (str): The user's query or task to execute
             max_steps (int, optional): Maximum number of steps to execute. Defaults to 50.
             use_enhanced_task (bool, optional): Whether to enhance the user's query before execution. Defaults to True.
+            use_semantic_cache (bool, optional): Whether a question similar to an already answered one is answered by
+                re-running its SQL instead of the agent, see `SemanticCache`. Defaults to True.
 
         Returns:
             Trace: A trace object containing the complete execution history including:
@@ -149,7 +173,21 @@ class Agent:
         """
         logger.info(f"Starting agent run with query: {query[:100]}...")
         logger.debug(f"Run parameters: max_steps={max_steps}, use_enhanced_task={use_enhanced_task}")
-        
+
+        use_semantic_cache = use_semantic_cache and semantic_cache is not None and self.task == "query"
+        if use_semantic_cache:
+            cached = semantic_cache.answer(query)
+            if cached is not None:
+                return self._run_cached(query, cached)
+
+        sql_executor = self.agent.tools.get("validate_sql_and_exceute_it")
+        sql_generator = self.agent.tools.get("sql_generator")
+        # the tools remember the last SQL that ran and the last generated one, of this run only
+        if sql_executor is not None:
+            sql_executor._final_sql = None
+        if sql_generator is not None:
+            sql_generator._final = None
+
         trace = Trace(task=query)
         if use_enhanced_task:
             logger.debug("Enhancing user question")
@@ -223,17 +261,61 @@ class Agent:
                 tracestep.model_input = json.dumps(messages)
                 trace.add_step(tracestep)
         
-        logger.info(f"Saving trace to database with ID: {trace.id}")
-        try:
-            _ = internal_db.save_trace(trace)
-            logger.debug("Trace saved successfully")
-        except Exception as e:
-            logger.error(f"Failed to save trace: {e}")
-            raise
-        
-        self.traces[trace.id] = trace
+        if sql_executor is not None and sql_executor._final_sql:
+            trace.sql = sql_executor._final_sql
+            trace.sql_explanation = (sql_generator._final or {}).get("explanation") if sql_generator is not None else None
+        if use_semantic_cache:
+            try:
+                semantic_cache.store_trace(trace)
+            except Exception as e:
+                logger.warning(f"Could not add trace {trace.id} to the semantic cache: {e}")
+
+        self._save_trace(trace)
         logger.info(f"Agent run completed. Total steps: {len(trace.steps)}, Duration: {trace.duration_seconds:.2f}s")
         return trace.final_answer, trace.id
+
+    def _run_cached(self, query: str, cached: dict) -> tuple[str, str]:
+        """Answer with the result of the cached SQL of a similar question, recorded as a one step trace."""
+        result = cached["result"]
+        for col in result.select_dtypes(include=["datetime"]).columns:
+            result[col] = result[col].dt.strftime("%Y-%m-%dT%H:%M:%S")
+        records = result.to_dict(orient="records")
+        final_answer = json.dumps(
+            {
+                "summary": cached["explanation"],
+                "sqls": [{"sql": cached["sql"], "sql_result": records[:10] if len(records) >= 10 else records}],
+                "cached_question": cached["question"],
+                "similarity": cached["similarity"],
+            },
+            default=str,
+        )
+        trace = Trace(task=query, sql=cached["sql"], sql_explanation=cached["explanation"])
+        trace.add_step(
+            TraceStep(
+                step_type=SEMANTIC_CACHE_STEP,
+                model_output=json.dumps({"cached_question": cached["question"], "similarity": cached["similarity"]}),
+            )
+        )
+        trace.finish(final_answer)
+        self._save_trace(trace)
+        logger.info(f"Answered from the semantic cache in {trace.duration_seconds:.2f}s")
+        return trace.final_answer, trace.id
+
+    def _save_trace(self, trace: Trace):
+        if trace_writer is not None:
+            # written in the background, the caller gets its answer without waiting on the database
+            logger.info(f"Queueing trace {trace.id} for writing")
+            trace_writer.submit(trace)
+        else:
+            logger.info(f"Saving trace to database with ID: {trace.id}")
+            try:
+                _ = internal_db.save_trace(trace)
+                logger.debug("Trace saved successfully")
+            except Exception as e:
+                logger.error(f"Failed to save trace: {e}")
+                raise
+        self.traces[trace.id] = trace
+
     def get_trace(self, trace_id: str) -> Trace:
         return self.traces[trace_id]
     
\ No newline at end of file
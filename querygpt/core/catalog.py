@@ -0,0 +1,153 @@
+import hashlib
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class SchemaCatalog:
+    """In-memory copy of a source's schema query result, indexed by table name and by (schema, table).
+
+    The full schema query runs once and is then served from memory until `ttl` seconds have
+    passed or `invalidate` is called.
+
+    Args:
+        loader (Callable): returns the schema of all tables as a dataframe, e.g. `DatabaseBase.get_all_tables_schema`.
+        table_column (str): name of the table name column in the loader result.
+        schema_column (str): name of the table schema column in the loader result.
+        ttl (float): seconds before the catalog is reloaded, None keeps it until invalidated.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], pd.DataFrame],
+        table_column: str = "table_name",
+        schema_column: str = "table_schema",
+        ttl: Optional[float] = 3600,
+        name: str = "catalog",
+    ):
+        self.loader = loader
+        self.table_column = table_column
+        self.schema_column = schema_column
+        self.ttl = ttl
+        self.name = name
+        self._lock = threading.Lock()
+        # (loaded_at, frame, {table: positions}, {(schema, table): positions})
+        self._snapshot: Optional[Tuple[float, pd.DataFrame, Dict, Dict]] = None
+        # (snapshot, sha256) of the last fingerprinted snapshot
+        self._fingerprint: Optional[Tuple[Tuple, str]] = None
+        self._stats = {"loads": 0, "lookups": 0}
+
+    def _build(self, frame: pd.DataFrame):
+        frame = frame.reset_index(drop=True)
+        by_table = frame.groupby(self.table_column, sort=False).indices
+        if self.schema_column in frame.columns:
+            by_schema_table = frame.groupby(
+                [self.schema_column, self.table_column], sort=False
+            ).indices
+        else:
+            by_schema_table = {}
+        return time.monotonic(), frame, by_table, by_schema_table
+
+    def _is_stale(self, snapshot) -> bool:
+        return self.ttl is not None and time.monotonic() - snapshot[0] > self.ttl
+
+    def _current(self):
+        snapshot = self._snapshot
+        if snapshot is not None and not self._is_stale(snapshot):
+            return snapshot
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or self._is_stale(snapshot):
+                logger.info(f"Loading schema catalog {self.name}")
+                start = time.perf_counter()
+                snapshot = self._build(self.loader())
+                self._snapshot = snapshot
+                self._stats["loads"] += 1
+                logger.info(
+                    f"Schema catalog {self.name} loaded {len(snapshot[1])} columns of {len(snapshot[2])} tables in {time.perf_counter() - start:.2f}s"
+                )
+        return snapshot
+
+    def is_fresh(self) -> bool:
+        snapshot = self._snapshot
+        return snapshot is not None and not self._is_stale(snapshot)
+
+    def refresh(self, frame: Optional[pd.DataFrame] = None):
+        """Reload the catalog now, or seed it with an already loaded schema `frame`."""
+        with self._lock:
+            self._snapshot = self._build(frame if frame is not None else self.loader())
+            self._stats["loads"] += 1
+
+    def invalidate(self):
+        """Drop the cached schema, the next lookup reloads it."""
+        with self._lock:
+            self._snapshot = None
+        logger.debug(f"Schema catalog {self.name} invalidated")
+
+    def all(self) -> pd.DataFrame:
+        return self._current()[1]
+
+    def fingerprint(self) -> str:
+        """sha256 of the tables, columns and data types of the catalog, computed once per snapshot."""
+        snapshot = self._current()
+        cached = self._fingerprint
+        if cached is not None and cached[0] is snapshot:
+            return cached[1]
+        frame = snapshot[1]
+        columns = [
+            column
+            for column in (self.schema_column, self.table_column, "column_name", "data_type")
+            if column in frame.columns
+        ]
+        rows = sorted(map(tuple, frame[columns].astype(str).drop_duplicates().itertuples(index=False)))
+        fingerprint = hashlib.sha256(repr(rows).encode()).hexdigest()
+        self._fingerprint = (snapshot, fingerprint)
+        return fingerprint
+
+    def get(
+        self,
+        table_names: Union[str, List[str], None] = None,
+        table_schema: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Return the schema rows of `table_names` (all tables if None), optionally limited to `table_schema`.
+
+        Table names can also be given schema qualified, as in `public.actor`.
+        """
+        _, frame, by_table, by_schema_table = self._current()
+        self._stats["lookups"] += 1
+        if table_names is None:
+            if table_schema is None:
+                return frame
+            return frame[frame[self.schema_column] == table_schema]
+        if isinstance(table_names, str):
+            table_names = [table_names]
+        positions = []
+        for table_name in table_names:
+            if table_schema is not None:
+                found = by_schema_table.get((table_schema, table_name))
+            else:
+                found = by_table.get(table_name)
+            if found is None and "." in table_name:
+                schema, _, table = table_name.rpartition(".")
+                found = by_schema_table.get((schema, table))
+            if found is not None:
+                positions.append(found)
+        if not positions:
+            return frame.iloc[0:0]
+        return frame.iloc[np.unique(np.concatenate(positions))]
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "name": self.name,
+            "loaded": snapshot is not None,
+            "tables": len(snapshot[2]) if snapshot else 0,
+            "columns": len(snapshot[1]) if snapshot else 0,
+            "age_seconds": time.monotonic() - snapshot[0] if snapshot else None,
+            **self._stats,
+        }
@@ -0,0 +1,88 @@
+from typing import Tuple
+from querygpt.core._database import DatabaseBase
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class QueryCostExceededError(ValueError):
+    """Raised when the estimated rows, scanned rows or cost of a query are above the source's cost guard thresholds."""
+
+    def __init__(
+        self,
+        estimate: dict,
+        max_estimated_rows: float = None,
+        max_estimated_cost: float = None,
+        max_estimated_scan_rows: float = None,
+    ):
+        self.estimate = estimate
+        self.max_estimated_rows = max_estimated_rows
+        self.max_estimated_cost = max_estimated_cost
+        self.max_estimated_scan_rows = max_estimated_scan_rows
+        super().__init__(
+            f"Query rejected by cost guard: estimated {estimate.get('estimated_rows')} rows returned / "
+            f"{estimate.get('estimated_scan_rows')} rows scanned / cost {estimate.get('estimated_cost')}, "
+            f"allowed at most {max_estimated_rows} rows returned / {max_estimated_scan_rows} rows scanned / cost {max_estimated_cost}"
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "error": "query_too_expensive",
+            "estimated_rows": self.estimate.get("estimated_rows"),
+            "estimated_scan_rows": self.estimate.get("estimated_scan_rows"),
+            "estimated_cost": self.estimate.get("estimated_cost"),
+            "max_estimated_rows": self.max_estimated_rows,
+            "max_estimated_scan_rows": self.max_estimated_scan_rows,
+            "max_estimated_cost": self.max_estimated_cost,
+            "hint": "the query would scan or return too many rows. check the join conditions for accidental cross joins, "
+            "filter earlier, aggregate, or add a LIMIT and try again",
+        }
+
+
+def _exceeds(value: float | None, threshold: float | None) -> bool:
+    return value is not None and threshold is not None and value > threshold
+
+
+def guard_query(sql: str, database: DatabaseBase) -> Tuple[str, float | None, int | None]:
+    """Run EXPLAIN for `sql` and check its estimates against `database.config.cost_guard`.
+
+    Does nothing (and applies no timeout) when the guard is disabled for the source.
+
+    Returns:
+        (sql to run, statement timeout in seconds, row limit applied by a rewrite or None)
+
+    The rows the query returns and its cost are checked against `max_estimated_rows` and
+    `max_estimated_cost`, and handled by `action`. The largest row estimate of any plan node is
+    checked against `max_estimated_scan_rows`, a query above it is always rejected.
+
+    Raises:
+        QueryCostExceededError: if the scan estimate is above its threshold, or the other estimates
+            are above theirs and the action is `reject`.
+    """
+    config = database.config.cost_guard
+    if not config.enabled:
+        return sql, None, None
+    try:
+        estimate = database.explain(sql)
+    except NotImplementedError as e:
+        logger.warning(f"Cost guard skipped for {database.name}: {e}")
+        return sql, config.statement_timeout_seconds, None
+    logger.debug(f"Cost guard estimate for {database.name}: {estimate}")
+    rejection = QueryCostExceededError(
+        estimate, config.max_estimated_rows, config.max_estimated_cost, config.max_estimated_scan_rows
+    )
+    if _exceeds(estimate.get("estimated_scan_rows"), config.max_estimated_scan_rows):
+        logger.warning(f"Cost guard rejected query scanning too many rows on {database.name}, estimate: {estimate}")
+        raise rejection
+    if not (
+        _exceeds(estimate.get("estimated_rows"), config.max_estimated_rows)
+        or _exceeds(estimate.get("estimated_cost"), config.max_estimated_cost)
+    ):
+        return sql, config.statement_timeout_seconds, None
+    if config.action == "limit":
+        logger.warning(
+            f"Cost guard limiting query to {config.limit_rows} rows on {database.name}, estimate: {estimate}"
+        )
+        return database.limit_query(sql, config.limit_rows), config.statement_timeout_seconds, config.limit_rows
+    logger.warning(f"Cost guard rejected query on {database.name}, estimate: {estimate}")
+    raise rejection
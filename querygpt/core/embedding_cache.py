@@ -0,0 +1,86 @@
+import hashlib
+from datetime import datetime
+from typing import Iterator, List
+import numpy as np
+import pandas as pd
+from querygpt.config.config import EmbeddingCacheConfig
+from querygpt.core._database import InternalDatabase
+from querygpt.core.embeders import EmbedderBase, embedder_identity
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class EmbeddingCache:
+    """Persistent cache of text embeddings, keyed by the embedder identity (see `embedder_identity`) and the sha256 of the text.
+
+    Embeddings are stored as raw `config.dtype` bytes in the internal database, so only texts that
+    are new or changed since the last run are sent to the model.
+    """
+
+    def __init__(self, internal_db: InternalDatabase, config: EmbeddingCacheConfig):
+        self.internal_db = internal_db
+        self.config = config
+        self._stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def embed(self, embedder: EmbedderBase, texts: List[str]) -> np.ndarray:
+        """Return the embeddings of `texts`, computing and caching only the ones not seen before."""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        # the same model name served by another provider or ONNX export gives different vectors
+        model = embedder_identity(embedder.config)
+        hashes = [self.text_hash(text) for text in texts]
+        cached = self._load(model, list(set(hashes)))
+        # a text repeated within the batch is embedded once
+        missing = {text_hash: text for text_hash, text in zip(hashes, texts) if text_hash not in cached}
+        hits = sum(text_hash in cached for text_hash in hashes)
+        self._stats["hits"] += hits
+        self._stats["misses"] += len(texts) - hits
+        logger.info(f"Embedding cache: {hits} hits, {len(texts) - hits} misses ({len(missing)} texts to embed)")
+        if missing:
+            embeddings = np.asarray(embedder.embed(list(missing.values())), dtype=np.float32)
+            computed = dict(zip(missing.keys(), embeddings))
+            self._store(model, computed)
+            cached.update(computed)
+        return np.stack([np.asarray(cached[text_hash], dtype=np.float32) for text_hash in hashes])
+
+    def embed_iter(self, embedder: EmbedderBase, texts: List[str]) -> Iterator[np.ndarray]:
+        """Yield the embeddings of `texts` shard by shard (`shard_size` texts each), in order, see `embed`."""
+        for start in range(0, len(texts), embedder.config.shard_size):
+            yield self.embed(embedder, texts[start : start + embedder.config.shard_size])
+
+    def _load(self, model: str, hashes: List[str]) -> dict:
+        with self.internal_db.connect() as conn:
+            rows = conn.execute(
+                "SELECT text_hash, dtype, embedding FROM embedding_cache WHERE model = ? AND text_hash IN (SELECT UNNEST(?))",
+                (model, hashes),
+            ).fetchall()
+        return {text_hash: np.frombuffer(embedding, dtype=dtype) for text_hash, dtype, embedding in rows}
+
+    def _store(self, model: str, embeddings: dict):
+        dtype = np.dtype(self.config.dtype)
+        staged = pd.DataFrame(
+            {
+                "text_hash": list(embeddings.keys()),
+                "embedding": [embedding.astype(dtype).tobytes() for embedding in embeddings.values()],
+            }
+        )
+        with self.internal_db.connect() as conn:
+            conn.register("staged_embeddings", staged)
+            try:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO embedding_cache (model, text_hash, dtype, embedding, created_at)
+                    SELECT ?, text_hash, ?, embedding, ? FROM staged_embeddings
+                    """,
+                    (model, dtype.name, datetime.now()),
+                )
+            finally:
+                conn.unregister("staged_embeddings")
+
+    def stats(self) -> dict:
+        return dict(self._stats)
@@ -1,21 +1,85 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Iterator, List
+from collections import OrderedDict
+from pathlib import Path
+import atexit
+import json
+import threading
+import numpy as np
 from querygpt.config.config import EmbeddingModelConfig
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def embedder_identity(config: EmbeddingModelConfig) -> str:
+    """Name of the vectors `config` produces: two configs with the same identity embed a text the same way.
+
+    The onnx provider's vectors also depend on the exported file (fp32 or int8) and the truncation length.
+    """
+    if config.provider == "onnx":
+        onnx_file = config.onnx_file or ("quantized" if config.quantized else "fp32")
+        return f"onnx:{config.name}:{onnx_file}:{config.max_length}"
+    return f"{config.provider}:{config.name}"
+
 
 class EmbedderBase:
     def __init__(self, config: EmbeddingModelConfig):
         self.config = config
         self.provider = config.provider
+        # LRU of query text -> embedding, the agent often retrieves context for the same question
+        self._query_cache = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self._query_cache_stats = {"hits": 0, "misses": 0}
     def load_model_from_provider(self):
         raise NotImplementedError
     def embed(self, text: List[str]):
         raise NotImplementedError
+    def embed_iter(self, text: List[str]) -> Iterator[np.ndarray]:
+        """Yield the embeddings of `text` shard by shard (`shard_size` texts each), in order."""
+        for start in range(0, len(text), self.config.shard_size):
+            yield self.embed(text[start : start + self.config.shard_size])
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed a single query, encoding it only if it is not in the LRU cache."""
+        return self.embed_queries([query])[0]
+    def embed_queries(self, queries: List[str]) -> List[np.ndarray]:
+        """Embed `queries`, the ones not in the LRU cache are encoded together in one batch."""
+        keys = [" ".join(query.split()) for query in queries]
+        embeddings = {}
+        with self._query_cache_lock:
+            for key in keys:
+                embedding = self._query_cache.get(key)
+                if embedding is not None:
+                    self._query_cache.move_to_end(key)
+                    embeddings[key] = embedding
+            hits = sum(key in embeddings for key in keys)
+            self._query_cache_stats["hits"] += hits
+            self._query_cache_stats["misses"] += len(keys) - hits
+        # a query repeated within the batch is encoded once
+        missing = {key: query for key, query in zip(keys, queries) if key not in embeddings}
+        if missing:
+            encoded = np.asarray(self.embed(list(missing.values())), dtype=np.float32)
+            for key, embedding in zip(missing, encoded):
+                embedding.flags.writeable = False  # shared by every caller of the cached query
+                embeddings[key] = embedding
+            if self.config.query_cache_size > 0:
+                with self._query_cache_lock:
+                    for key in missing:
+                        self._query_cache[key] = embeddings[key]
+                        self._query_cache.move_to_end(key)
+                    while len(self._query_cache) > self.config.query_cache_size:
+                        self._query_cache.popitem(last=False)
+        return [embeddings[key] for key in keys]
+    def query_cache_stats(self) -> dict:
+        with self._query_cache_lock:
+            return {**self._query_cache_stats, "size": len(self._query_cache), "max_size": self.config.query_cache_size}
     def get_embedding_dimensions(self):
         raise NotImplementedError
 
 class Embedder(EmbedderBase):
     def __init__(self, config: EmbeddingModelConfig):
         super().__init__(config)
+        self._pool = None
         self.load_model_from_provider()
     def load_model_from_provider(self):
         # so far we only support sentence transformers
@@ -26,10 +90,161 @@ class Embedder(EmbedderBase):
         else:
             raise ValueError(f"Provider {self.provider} not supported")
 
+    def _get_pool(self):
+        # one process per worker, each holding its own copy of the model
+        if self._pool is None:
+            logger.info(f"Starting embedding pool with {self.config.num_workers} workers")
+            self._pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.config.num_workers)
+            atexit.register(self.close)
+        return self._pool
+
+    def embed_iter(self, text: List[str]) -> Iterator[np.ndarray]:
+        """Yield the embeddings of `text` shard by shard (`shard_size` texts each), in order."""
+        for start in range(0, len(text), self.config.shard_size):
+            shard = text[start : start + self.config.shard_size]
+            if self.config.num_workers > 1 and len(shard) > self.config.batch_size:
+                yield self.model.encode_multi_process(
+                    shard,
+                    self._get_pool(),
+                    batch_size=self.config.batch_size,
+                    show_progress_bar=self.config.show_progress_bar,
+                )
+            else:
+                yield self.model.encode(
+                    shard,
+                    batch_size=self.config.batch_size,
+                    show_progress_bar=self.config.show_progress_bar,
+                )
+
     def embed(self, text: List[str]):
         # if we support other providers, 
         # we need to add the logic here, most likely we need to add a provider specific class similar to how it is done for the database
         # but we can ignore for now
-        return self.model.encode(text)
+        if isinstance(text, str) or (len(text) <= self.config.shard_size and self.config.num_workers <= 1):
+            return self.model.encode(
+                text, batch_size=self.config.batch_size, show_progress_bar=self.config.show_progress_bar
+            )
+        return np.concatenate(list(self.embed_iter(text)))
+
+    def close(self):
+        if self._pool is not None:
+            self.model.stop_multi_process_pool(self._pool)
+            self._pool = None
+            atexit.unregister(self.close)
+
+    def get_embedding_dimensions(self):
+        return self.embedding_dimensions
+
+
+class OnnxEmbedder(EmbedderBase):
+    """Run a sentence-transformers model exported to ONNX with onnxruntime, without importing torch.
+
+    `config.model_path` is the directory written by `SentenceTransformer(name, backend="onnx").save(path)`:
+    `tokenizer.json`, `onnx/model.onnx` (or `model.onnx`), and `1_Pooling/config.json` / `modules.json`,
+    which tell how to pool token embeddings and whether to normalize them, as the original model does.
+    With `config.quantized` the int8 file written by `export_dynamic_quantized_onnx_model` is loaded.
+    """
+
+    _ONNX_FILES = ("onnx/model.onnx", "model.onnx")
+    _QUANTIZED_ONNX_FILES = ("onnx/model_qint8_*.onnx", "onnx/model_quantized.onnx", "model_quantized.onnx")
+
+    def __init__(self, config: EmbeddingModelConfig):
+        super().__init__(config)
+        if config.model_path is None:
+            raise ValueError("The onnx provider needs `model_path`, a local directory of the exported model")
+        self.model_path = Path(config.model_path)
+        self.load_model_from_provider()
+
+    def _onnx_file(self) -> Path:
+        if self.config.onnx_file is not None:
+            return self.model_path / self.config.onnx_file
+        for pattern in self._QUANTIZED_ONNX_FILES if self.config.quantized else self._ONNX_FILES:
+            matches = sorted(self.model_path.glob(pattern))
+            if matches:
+                return matches[0]
+        raise FileNotFoundError(
+            f"No {'quantized ' if self.config.quantized else ''}ONNX model in {self.model_path}, "
+            f"looked for {', '.join(self._QUANTIZED_ONNX_FILES if self.config.quantized else self._ONNX_FILES)}"
+        )
+
+    def _load_pooling(self):
+        pooling = {"pooling_mode_mean_tokens": True}
+        pooling_config = self.model_path / "1_Pooling" / "config.json"
+        if pooling_config.exists():
+            pooling = json.loads(pooling_config.read_text())
+        self.pooling = "cls" if pooling.get("pooling_mode_cls_token") else "max" if pooling.get("pooling_mode_max_tokens") else "mean"
+        modules = self.model_path / "modules.json"
+        self.normalize = modules.exists() and any(
+            module["type"].endswith("Normalize") for module in json.loads(modules.read_text())
+        )
+
+    def load_model_from_provider(self):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ModuleNotFoundError(
+                "To use the onnx provider, please install onnxruntime and tokenizers by using 'pip install querygpt[onnx]'"
+            )
+        onnx_file = self._onnx_file()
+        logger.info(f"Loading ONNX embedding model {onnx_file}")
+        self.session = onnxruntime.InferenceSession(str(onnx_file), providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(str(self.model_path / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.config.max_length)
+        self.tokenizer.enable_padding(
+            pad_id=self.tokenizer.padding["pad_id"] if self.tokenizer.padding else 0,
+            pad_token=self.tokenizer.padding["pad_token"] if self.tokenizer.padding else "[PAD]",
+        )
+        self._load_pooling()
+        self.embedding_dimensions = self.config.dimensions
+
+    def _pool(self, token_embeddings: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+        if self.pooling == "cls":
+            return token_embeddings[:, 0]
+        mask = attention_mask[:, :, None].astype(token_embeddings.dtype)
+        if self.pooling == "max":
+            return np.where(mask > 0, token_embeddings, -np.inf).max(axis=1)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def _encode(self, text: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(text)
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        token_embeddings = self.session.run(None, {k: v for k, v in inputs.items() if k in self.input_names})[0]
+        embeddings = self._pool(token_embeddings, inputs["attention_mask"])
+        if self.normalize:
+            embeddings = embeddings / np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings.astype(np.float32)
+
+    def embed(self, text: List[str]):
+        if isinstance(text, str):
+            return self.embed([text])[0]
+        if not text:
+            return np.empty((0, self.config.dimensions), dtype=np.float32)
+        # sorting by length keeps padding within a batch small
+        order = sorted(range(len(text)), key=lambda i: len(text[i]))
+        embeddings = np.empty((len(text), self.config.dimensions), dtype=np.float32)
+        for start in range(0, len(order), self.config.batch_size):
+            batch = order[start : start + self.config.batch_size]
+            embeddings[batch] = self._encode([text[i] for i in batch])
+        return embeddings
+
     def get_embedding_dimensions(self):
         return self.embedding_dimensions
+
+
+EMBEDDER_REGISTRY = {
+    "sf": Embedder,
+    "onnx": OnnxEmbedder,
+}
+
+
+def get_embedder(config: EmbeddingModelConfig) -> EmbedderBase:
+    assert (
+        config.provider in EMBEDDER_REGISTRY
+    ), f"Invalid embedding provider: {config.provider}, available providers: {EMBEDDER_REGISTRY.keys()}"
+    return EMBEDDER_REGISTRY[config.provider](config)
@@ -1,53 +1,101 @@
-from typing import List
-from qdrant_client import QdrantClient
+from typing import Iterable, List, Tuple
 from querygpt.config.config import IndexConfig
-from querygpt.core.embeders import Embedder
-from qdrant_client.http.models import Distance, VectorParams, PointStruct
-from typing import List
+from querygpt.core.embeders import EmbedderBase, get_embedder
+from querygpt.core.logging import get_logger
+from pathlib import Path
+import os
+import threading
+import time
+import shutil
 import uuid
-import chromadb
-from querygpt.core.embeders import Embedder
-from querygpt.config.config import IndexConfig
+import numpy as np
+
+logger = get_logger(__name__)
+
+# namespace of the point ids, changing it re-creates every point
+_POINT_ID_NAMESPACE = uuid.UUID("6f1d3c52-2a8e-4d0b-9a57-6c2f1e0b7d41")
+_UPSERT_BATCH_SIZE = 1000
+
+
+def point_id(source: str, table_id: int, column_id: int) -> str:
+    """Deterministic id of the vector of a documented column, so re-indexing overwrites it in place."""
+    return str(uuid.uuid5(_POINT_ID_NAMESPACE, f"{source}:{table_id}:{column_id}"))
+
+
+def point_ids(payloads: List[dict]) -> List[str]:
+    # points of the table level collection have no column_id
+    return [point_id(p.get("source"), p["table_id"], p.get("column_id")) for p in payloads]
 
 
 class ChromaIndex:
-    def __init__(self, config: IndexConfig):
+    def __init__(self, config: IndexConfig, embedder: EmbedderBase | None = None):
+        import chromadb
+
         self.config = config
         self.client = chromadb.PersistentClient(config.url)
         self.collection = self.client.get_or_create_collection(
             name=config.name,
             metadata={"hnsw:space": "cosine"})
-        self.embedder = Embedder(config.embedding_model)
+        if config.quantization is not None:
+            logger.warning(f"Chroma does not support quantized vectors, ignoring quantization={config.quantization}")
+        self.embedder = embedder or get_embedder(config.embedding_model)
  
     def upsert(self,
                embeddings: List[List[float]],
                payloads:   List[dict]):
-        ids = [str(uuid.uuid4()) for _ in embeddings]  
-        self.collection.upsert(
-            ids=ids,
-            embeddings=embeddings,
-            metadatas=payloads)
+        ids = point_ids(payloads)
+        for start in range(0, len(ids), _UPSERT_BATCH_SIZE):
+            end = start + _UPSERT_BATCH_SIZE
+            self.collection.upsert(
+                ids=ids[start:end],
+                embeddings=[list(map(float, e)) for e in embeddings[start:end]],
+                metadatas=payloads[start:end])
+
+    def upsert_many(self, shards: Iterable[Tuple[List[List[float]], List[dict]]]):
+        """Upsert `(embeddings, payloads)` shards as they are produced."""
+        for embeddings, payloads in shards:
+            self.upsert(embeddings, payloads)
+
+    def points(self) -> dict:
+        """Return the payload of every point, by point id."""
+        res = self.collection.get(include=["metadatas"])
+        return dict(zip(res["ids"], res["metadatas"]))
+
+    def delete(self, ids: List[str]):
+        for start in range(0, len(ids), _UPSERT_BATCH_SIZE):
+            self.collection.delete(ids=ids[start:start + _UPSERT_BATCH_SIZE])
  
     def retrieve(self, query: str, top_k: int = 10):
-        if not isinstance(query, list):
-            query = [query]
-        vector = self.embedder.embed(query)[0]
+        if isinstance(query, list):
+            query = query[0]
+        return self.retrieve_many([query], top_k=top_k)[0]
+
+    def retrieve_many(self, queries: List[str], top_k: int = 10, table_ids: List[int] | None = None) -> List[List[dict]]:
+        """Retrieve the `top_k` most similar points of each query, among `table_ids` if given, in one embedding batch and one collection query."""
+        if not queries or table_ids == []:
+            return [[] for _ in queries]
+        vectors = self.embedder.embed_queries(queries)
         res = self.collection.query(
-            query_embeddings=[vector],
-            n_results=top_k)
-        distances = res["distances"][0]
-        metadatas = res["metadatas"][0]
-        results = [
-            {"score": 1 - d, "metadata": m}
-            for d, m in zip(distances, metadatas)
+            query_embeddings=[vector.tolist() for vector in vectors],
+            n_results=top_k,
+            where=None if table_ids is None else {"table_id": {"$in": [int(table_id) for table_id in table_ids]}})
+        return [
+            [{"score": 1 - d, "metadata": m} for d, m in zip(distances, metadatas)]
+            for distances, metadatas in zip(res["distances"], res["metadatas"])
         ]
-        return results
 
 class Index:
-    def __init__(self, config: IndexConfig):
+    def __init__(self, config: IndexConfig, embedder: EmbedderBase | None = None):
+        try:
+            from qdrant_client import QdrantClient
+        except ImportError as e:
+            raise ModuleNotFoundError(
+                "To use Qdrant, please install qdrant-client by using 'pip install querygpt[qdrant]'"
+            )
         self.config = config
         self.index = config.name
         self.client = QdrantClient(url=config.url)
+        self.embedder = embedder
         self.__post_init__()
 
     def __post_init__(self):
@@ -55,34 +103,88 @@ class Index:
             self.client.get_collection(self.index)
         except Exception as e:
             self.create()
-        self.embedder = Embedder(self.config.embedding_model)
+        self.embedder = self.embedder or get_embedder(self.config.embedding_model)
 
     def create(self, index: str = None):
+        from qdrant_client.http import models
+
         index = index or self.index
+        quantization_config = None
+        if self.config.quantization == "int8":
+            quantization_config = models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, always_ram=True)
+            )
+        elif self.config.quantization == "binary":
+            quantization_config = models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True)
+            )
         self.client.create_collection(
             collection_name=index,
-            vectors_config=VectorParams(
+            vectors_config=models.VectorParams(
                 size=self.config.embedding_model.dimensions,
-                distance=Distance.COSINE # should be configurable :( 
-            )
+                distance=models.Distance.COSINE, # should be configurable :( 
+                # the full precision vectors are only read to rescore candidates
+                on_disk=quantization_config is not None,
+            ),
+            quantization_config=quantization_config,
         )
     def upsert(self, embeddings: List[List[float]], payloads: List[dict],):
-        self.client.upsert(
-            collection_name=self.index,
-            points=[PointStruct(id=id, vector=embedding, payload=payload) for id, embedding, payload in zip(range(len(embeddings)), embeddings, payloads)]
+        from qdrant_client.http.models import PointStruct
+
+        ids = point_ids(payloads)
+        for start in range(0, len(ids), _UPSERT_BATCH_SIZE):
+            end = start + _UPSERT_BATCH_SIZE
+            self.client.upsert(
+                collection_name=self.index,
+                points=[
+                    PointStruct(id=id, vector=list(map(float, embedding)), payload=payload)
+                    for id, embedding, payload in zip(ids[start:end], embeddings[start:end], payloads[start:end])
+                ]
+            )
+    def upsert_many(self, shards: Iterable[Tuple[List[List[float]], List[dict]]]):
+        """Upsert `(embeddings, payloads)` shards as they are produced."""
+        for embeddings, payloads in shards:
+            self.upsert(embeddings, payloads)
+    def points(self) -> dict:
+        """Return the payload of every point, by point id."""
+        points, offset = {}, None
+        while True:
+            records, offset = self.client.scroll(
+                collection_name=self.index,
+                limit=_UPSERT_BATCH_SIZE,
+                offset=offset,
+                with_payload=True,
+                with_vectors=False,
+            )
+            points.update({str(record.id): record.payload for record in records})
+            if offset is None:
+                return points
+    def delete(self, ids: List[str]):
+        from qdrant_client.http.models import PointIdsList
+
+        for start in range(0, len(ids), _UPSERT_BATCH_SIZE):
+            self.client.delete(
+                collection_name=self.index,
+                points_selector=PointIdsList(points=ids[start:start + _UPSERT_BATCH_SIZE]),
+            )
+    def _search_params(self):
+        if self.config.quantization is None:
+            return None
+        from qdrant_client.http import models
+
+        return models.SearchParams(
+            quantization=models.QuantizationSearchParams(rescore=True, oversampling=self.config.rescore_factor)
         )
     def retrieve(self, query: str, index: str = None,top_k: int = 10):
         index = index or self.index
-        if not isinstance(query, list):
-            query = [query]
-        query_vector = self.embedder.embed(query)[0].tolist() if hasattr(self.embedder.embed(query)[0], 'tolist') else self.embedder.embed(query)[0]
-    
-        if isinstance(query_vector[0], list):
-            query_vector = query_vector[0]
+        if isinstance(query, list):
+            query = query[0]
+        query_vector = self.embedder.embed_query(query).tolist()
         hits = self.client.search(
             collection_name=index,
             query_vector=query_vector,
-            limit=top_k
+            limit=top_k,
+            search_params=self._search_params(),
         )
         results = []
         for hit in hits:
@@ -93,7 +195,305 @@ class Index:
             results.append(metadata)
         return results
 
-def get_index(config: IndexConfig):
-    if config.local:
-        return ChromaIndex(config)
-    return Index(config)
\ No newline at end of file
+    def retrieve_many(self, queries: List[str], index: str = None, top_k: int = 10, table_ids: List[int] | None = None) -> List[List[dict]]:
+        """Retrieve the `top_k` most similar points of each query, among `table_ids` if given, in one embedding batch and one `search_batch` call."""
+        from qdrant_client.http import models
+
+        if not queries or table_ids == []:
+            return [[] for _ in queries]
+        index = index or self.index
+        vectors = self.embedder.embed_queries(queries)
+        query_filter = None
+        if table_ids is not None:
+            query_filter = models.Filter(
+                must=[models.FieldCondition(key="table_id", match=models.MatchAny(any=[int(table_id) for table_id in table_ids]))]
+            )
+        batches = self.client.search_batch(
+            collection_name=index,
+            requests=[
+                models.SearchRequest(
+                    vector=vector.tolist(),
+                    limit=top_k,
+                    with_payload=True,
+                    params=self._search_params(),
+                    filter=query_filter,
+                )
+                for vector in vectors
+            ],
+        )
+        return [[{"score": hit.score, "metadata": hit.payload} for hit in hits] for hits in batches]
+
+class FlatIndex:
+    """In-process exact index over memory-mapped numpy arrays, for catalogs up to a few hundred thousand columns.
+
+    Normalized embeddings (`config.dtype`) and the point ids, sources, content hashes, table ids and
+    column ids live in `.npy` files under `<url>/<name>/<version>/`, the `CURRENT` file names the
+    live version. Files are opened with `mmap_mode="r"`, so loading takes milliseconds and worker
+    processes share the pages through the OS page cache. Writes build a new version and swap
+    `CURRENT`, readers pick it up on their next query.
+
+    With `config.quantization` the scan runs over int8 codes (one scale per dimension) or sign bits
+    compared by hamming distance, only the `top_k * rescore_factor` best candidates are rescored
+    against the full precision vectors, which stay on disk until then.
+    """
+
+    _ARRAYS = ("vectors", "ids", "sources", "hashes", "table_ids", "column_ids")
+    _QUANTIZED_ARRAYS = {"int8": ("codes", "scales"), "binary": ("codes",)}
+    # rows scored at once when vectors need a cast to float32, bounds the temporary copy
+    _SEARCH_CHUNK_ROWS = 65536
+
+    def __init__(self, config: IndexConfig, embedder: EmbedderBase | None = None):
+        self.config = config
+        self.path = Path(config.url) / config.name
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._version = None
+        self._arrays = None
+        self._load()
+        self.embedder = embedder or get_embedder(config.embedding_model)
+
+    @property
+    def _array_names(self) -> tuple:
+        return self._ARRAYS + self._QUANTIZED_ARRAYS.get(self.config.quantization, ())
+
+    def _current_version(self) -> str | None:
+        try:
+            return (self.path / "CURRENT").read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        version = self._current_version()
+        if version is None:
+            dimensions = self.config.embedding_model.dimensions
+            arrays = {
+                "vectors": np.empty((0, dimensions), dtype=self.config.dtype),
+                "ids": np.empty(0, dtype="U36"),
+                "sources": np.empty(0, dtype="U1"),
+                "hashes": np.empty(0, dtype="U64"),
+                "table_ids": np.empty(0, dtype=np.int64),
+                "column_ids": np.empty(0, dtype=np.int64),
+            }
+            arrays.update(self._quantize(arrays["vectors"]))
+        else:
+            start = time.perf_counter()
+            arrays = {
+                name: np.load(self.path / version / f"{name}.npy", mmap_mode="r")
+                for name in self._array_names
+                if (self.path / version / f"{name}.npy").exists()
+            }
+            if any(name not in arrays for name in self._array_names):
+                # written before quantization was enabled, the next write persists the codes
+                logger.warning(f"Flat index {self.config.name} has no {self.config.quantization} codes, quantizing in memory")
+                arrays.update(self._quantize(arrays["vectors"]))
+            logger.debug(
+                f"Loaded flat index {self.config.name} ({len(arrays['ids'])} vectors) in {(time.perf_counter() - start) * 1000:.1f}ms"
+            )
+        self._arrays, self._version = arrays, version
+
+    def _current(self) -> dict:
+        # another process may have written a new version since we loaded
+        if self._current_version() != self._version:
+            with self._lock:
+                if self._current_version() != self._version:
+                    self._load()
+        return self._arrays
+
+    def _save(self, arrays: dict):
+        arrays = {**arrays, **self._quantize(arrays["vectors"])}
+        version = f"v{time.time_ns()}"
+        os.makedirs(self.path / version)
+        for name in self._array_names:
+            np.save(self.path / version / f"{name}.npy", np.ascontiguousarray(arrays[name]))
+        tmp = self.path / f"CURRENT.{version}"
+        tmp.write_text(version)
+        os.replace(tmp, self.path / "CURRENT")
+        with self._lock:
+            self._load()
+        # every older version is superseded, including ones left by other processes or interrupted writes.
+        # processes still mapping the old files keep reading them until they reload
+        for path in self.path.glob("v*"):
+            if path.is_dir() and path.name[1:].isdigit() and int(path.name[1:]) < int(version[1:]):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _chunks(self, vectors: np.ndarray):
+        for start in range(0, len(vectors), self._SEARCH_CHUNK_ROWS):
+            yield start, np.asarray(vectors[start : start + self._SEARCH_CHUNK_ROWS], dtype=np.float32)
+
+    def _quantize(self, vectors: np.ndarray) -> dict:
+        if self.config.quantization == "int8":
+            # symmetric, one scale per dimension so that no dimension saturates
+            scales = np.zeros(vectors.shape[1], dtype=np.float32)
+            for _, chunk in self._chunks(vectors):
+                scales = np.maximum(scales, np.abs(chunk).max(axis=0))
+            scales = np.where(scales == 0, 1, scales) / 127
+            codes = np.empty(vectors.shape, dtype=np.int8)
+            for start, chunk in self._chunks(vectors):
+                codes[start : start + len(chunk)] = np.clip(np.rint(chunk / scales), -127, 127)
+            return {"codes": codes, "scales": scales.astype(np.float32)}
+        if self.config.quantization == "binary":
+            codes = np.empty((len(vectors), (vectors.shape[1] + 7) // 8), dtype=np.uint8)
+            for start, chunk in self._chunks(vectors):
+                codes[start : start + len(chunk)] = np.packbits(chunk > 0, axis=1)
+            return {"codes": codes}
+        return {}
+
+    def _normalize(self, vectors) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+
+    def upsert(self, embeddings: List[List[float]], payloads: List[dict]):
+        self.upsert_many([(embeddings, payloads)])
+
+    def upsert_many(self, shards: Iterable[Tuple[List[List[float]], List[dict]]]):
+        """Upsert `(embeddings, payloads)` shards as they are produced, then write and publish a single version.
+
+        Every write rewrites the whole index, upserting shard by shard would rewrite it once per shard.
+        """
+        vectors, payloads = [], []
+        for shard_embeddings, shard_payloads in shards:
+            # normalized and cast as they arrive, only the index dtype is held until the write
+            vectors.append(self._normalize(shard_embeddings).astype(self.config.dtype))
+            payloads.extend(shard_payloads)
+        if not payloads:
+            return
+        ids = np.array(point_ids(payloads), dtype="U36")
+        # the last payload of an id wins, as with the other backends
+        _, last = np.unique(ids[::-1], return_index=True)
+        new = np.sort(len(ids) - 1 - last)
+        current = self._current()
+        keep = ~np.isin(current["ids"], ids)
+        vectors = np.concatenate(vectors)[new]
+        self._save(
+            {
+                "vectors": np.concatenate([current["vectors"][keep].astype(self.config.dtype), vectors]),
+                "ids": np.concatenate([current["ids"][keep], ids[new]]),
+                "sources": np.concatenate(
+                    [current["sources"][keep], np.array([payloads[i].get("source") or "" for i in new])]
+                ),
+                "hashes": np.concatenate(
+                    [current["hashes"][keep], np.array([payloads[i].get("content_hash", "") for i in new], dtype="U64")]
+                ),
+                "table_ids": np.concatenate(
+                    [current["table_ids"][keep], np.array([payloads[i]["table_id"] for i in new], dtype=np.int64)]
+                ),
+                "column_ids": np.concatenate(
+                    [current["column_ids"][keep], np.array([payloads[i].get("column_id", -1) for i in new], dtype=np.int64)]
+                ),
+            }
+        )
+
+    def _payload(self, arrays: dict, i: int) -> dict:
+        payload = {
+            "source": str(arrays["sources"][i]) or None,
+            "table_id": int(arrays["table_ids"][i]),
+            "column_id": int(arrays["column_ids"][i]),
+            "content_hash": str(arrays["hashes"][i]),
+        }
+        if payload["column_id"] < 0:
+            del payload["column_id"]
+        return payload
+
+    def points(self) -> dict:
+        """Return the payload of every point, by point id."""
+        arrays = self._current()
+        return {str(id): self._payload(arrays, i) for i, id in enumerate(arrays["ids"])}
+
+    def delete(self, ids: List[str]):
+        current = self._current()
+        keep = ~np.isin(current["ids"], np.array(ids, dtype="U36"))
+        self._save({name: current[name][keep] for name in self._ARRAYS})
+
+    def _scores(self, vectors: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        if vectors.dtype == np.float32:
+            return queries @ vectors.T
+        scores = np.empty((len(queries), len(vectors)), dtype=np.float32)
+        for start, chunk in self._chunks(vectors):
+            scores[:, start : start + len(chunk)] = queries @ chunk.T
+        return scores
+
+    def _quantized_scores(self, arrays: dict, queries: np.ndarray) -> np.ndarray:
+        codes = arrays["codes"]
+        if self.config.quantization == "int8":
+            # folding the scales into the queries keeps the scan a single product
+            return self._scores(codes, queries * arrays["scales"])
+        query_codes = np.packbits(queries > 0, axis=1)
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start in range(0, len(codes), self._SEARCH_CHUNK_ROWS):
+            chunk = codes[start : start + self._SEARCH_CHUNK_ROWS]
+            for q, query_code in enumerate(query_codes):
+                # fewer differing bits is a better match
+                scores[q, start : start + len(chunk)] = -np.bitwise_count(chunk ^ query_code).sum(axis=1, dtype=np.int32)
+        return scores
+
+    @staticmethod
+    def _top(scores: np.ndarray, k: int) -> np.ndarray:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+    def search(self, query_vectors, top_k: int = 10, table_ids: List[int] | None = None) -> List[List[tuple]]:
+        """Return the `(row, score)` of the `top_k` rows most similar to each of `query_vectors`, among `table_ids` if given."""
+        return self._search(self._current(), query_vectors, top_k, table_ids)
+
+    def _search(self, arrays: dict, query_vectors, top_k: int, table_ids: List[int] | None = None) -> List[List[tuple]]:
+        allowed = None if table_ids is None else np.isin(arrays["table_ids"], np.asarray(table_ids, dtype=np.int64))
+        n = len(arrays["ids"]) if allowed is None else int(allowed.sum())
+        if not n or not len(query_vectors):
+            return [[] for _ in query_vectors]
+        queries = self._normalize(query_vectors)
+        k = min(top_k, n)
+        if self.config.quantization is None:
+            scores = self._scores(arrays["vectors"], queries)
+            if allowed is not None:
+                scores[:, ~allowed] = -np.inf
+            top = self._top(scores, k)
+            return [[(int(i), float(row[i])) for i in candidates] for row, candidates in zip(scores, top)]
+        scores = self._quantized_scores(arrays, queries)
+        if allowed is not None:
+            scores[:, ~allowed] = -np.inf
+        candidates = self._top(scores, min(k * self.config.rescore_factor, n))
+        results = []
+        for query, rows in zip(queries, candidates):
+            rows = np.sort(rows)  # sequential reads of the memory-mapped vectors
+            scores = np.asarray(arrays["vectors"][rows], dtype=np.float32) @ query
+            best = self._top(scores[None, :], k)[0]
+            results.append([(int(rows[i]), float(scores[i])) for i in best])
+        return results
+
+    def retrieve_many(self, queries: List[str], top_k: int = 10, table_ids: List[int] | None = None) -> List[List[dict]]:
+        """Retrieve the `top_k` most similar points of each query, among `table_ids` if given, with one matrix product for all of them."""
+        if not queries:
+            return []
+        arrays = self._current()
+        hits = self._search(arrays, self.embedder.embed_queries(queries), top_k, table_ids)
+        return [
+            [{"score": score, "metadata": self._payload(arrays, row)} for row, score in query_hits]
+            for query_hits in hits
+        ]
+
+    def retrieve(self, query: str, top_k: int = 10):
+        if isinstance(query, list):
+            query = query[0]
+        return self.retrieve_many([query], top_k=top_k)[0]
+
+
+INDEX_REGISTRY = {
+    "chroma": ChromaIndex,
+    "qdrant": Index,
+    "flat": FlatIndex,
+}
+
+
+def get_index(config: IndexConfig, embedder: EmbedderBase | None = None):
+    # without an explicit backend, `local` picks chroma over qdrant as before
+    backend = config.backend or ("chroma" if config.local else "qdrant")
+    assert (
+        backend in INDEX_REGISTRY
+    ), f"Invalid index backend: {backend}, available backends: {INDEX_REGISTRY.keys()}"
+    return INDEX_REGISTRY[backend](config, embedder=embedder)
+
+
+def get_table_index(config: IndexConfig, embedder: EmbedderBase | None = None):
+    """The table level collection (`<name>_tables`) of `config`, searched first by two-stage retrieval."""
+    return get_index(config.model_copy(update={"name": f"{config.name}_tables"}), embedder=embedder)
@@ -0,0 +1,91 @@
+import asyncio
+import atexit
+import threading
+from querygpt.config.config import ChatCompletionConfig
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# (base_url, provider) -> OpenAI client, and (base_url, provider, event loop) -> AsyncOpenAI client
+_clients = {}
+_async_clients = {}
+_lock = threading.Lock()
+
+
+def _http_options(config: ChatCompletionConfig) -> dict:
+    import httpx
+
+    return {
+        "trust_env": False,
+        "limits": httpx.Limits(
+            max_connections=config.client.max_connections,
+            max_keepalive_connections=config.client.max_keepalive_connections,
+            keepalive_expiry=config.client.keepalive_expiry,
+        ),
+        "timeout": httpx.Timeout(config.client.timeout, connect=config.client.connect_timeout),
+    }
+
+
+def get_client(config: ChatCompletionConfig):
+    """Return the process wide OpenAI client of `config.base_url`.
+
+    The client and its keep-alive connection pool are created on first use and shared by every
+    thread, both are thread safe. The pool settings of the first config seen for an endpoint win.
+    """
+    key = (config.base_url, config.provider)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                import httpx
+                from openai import OpenAI
+
+                logger.info(f"Creating LLM client for {config.base_url} ({config.provider})")
+                client = OpenAI(
+                    base_url=config.base_url, api_key="", http_client=httpx.Client(**_http_options(config))
+                )
+                if not _clients:
+                    atexit.register(close_clients)
+                _clients[key] = client
+    return client
+
+
+def get_async_client(config: ChatCompletionConfig):
+    """Async twin of `get_client`, one client per endpoint and event loop, as httpx async connections belong to a loop."""
+    key = (config.base_url, config.provider, asyncio.get_running_loop())
+    client = _async_clients.get(key)
+    if client is None:
+        with _lock:
+            client = _async_clients.get(key)
+            if client is None:
+                import httpx
+                from openai import AsyncOpenAI
+
+                logger.info(f"Creating async LLM client for {config.base_url} ({config.provider})")
+                client = AsyncOpenAI(
+                    base_url=config.base_url, api_key="", http_client=httpx.AsyncClient(**_http_options(config))
+                )
+                _async_clients[key] = client
+    return client
+
+
+def close_clients():
+    """Close the sync clients and their connections."""
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+    atexit.unregister(close_clients)
+
+
+async def aclose_clients():
+    """Close the clients of the running event loop, and the sync ones."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        keys = [key for key in _async_clients if key[2] is loop]
+        clients = [_async_clients.pop(key) for key in keys]
+    for client in clients:
+        await client.close()
+    close_clients()
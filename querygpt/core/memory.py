@@ -1,11 +1,46 @@
+import asyncio
+import hashlib
+import inspect
+import json
+import threading
+from datetime import datetime, timedelta
 from functools import wraps
-from typing import Callable
+from typing import Callable, List, Optional
+from pydantic import BaseModel
+from querygpt.config.config import LLMCacheConfig
 from querygpt.core._database import InternalDatabase
-from datetime import datetime
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class _CachedMessage(BaseModel):
+    role: str = "assistant"
+    content: str | None = None
+
+
+class _CachedChoice(BaseModel):
+    index: int = 0
+    message: _CachedMessage
+
+
+class CachedChatCompletion(BaseModel):
+    """A chat completion served from the cache, shaped like the provider responses callers read (`choices[0].message.content`)."""
+
+    model: str | None = None
+    choices: List[_CachedChoice]
+    cached: bool = True
 
 
 class Memory:
-    """
+    """Cache the responses of a chat completion function in the internal database.
+
+    Responses are keyed by the sha256 of the model, temperature, messages and response format
+    schema, expire after `config.ttl_seconds` and the least recently used ones are evicted once
+    they exceed `config.max_bytes`. Pass `use_cache=False` to the decorated function to always
+    call the model (the fresh response still replaces the cached one). Without an `internal_db`
+    or `config`, both are read from the project configuration on the first call.
+
     Usage:
         @Memory(internal_db=InternalDatabase())
         def chat_completion(messages=messages): ...
@@ -14,27 +49,165 @@ class Memory:
     def __init__(
         self,
         internal_db: InternalDatabase = None,
+        config: LLMCacheConfig = None,
     ):
         self.internal_db = internal_db
+        self.config = config
+        self._lock = threading.Lock()
+        self._initialized = internal_db is not None and config is not None
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "bypassed": 0}
+
+    def _init(self):
+        if self._initialized:
+            return
+        with self._lock:
+            if self._initialized:
+                return
+            try:
+                from querygpt.config.config import init_config
+
+                config = init_config()
+                self.config = self.config or config.llm_cache
+                if self.internal_db is None and self.config.enabled:
+                    self.internal_db = InternalDatabase(config.internal_db)
+            except Exception as e:
+                logger.warning(f"LLM response cache disabled, could not load the configuration: {e}")
+                self.config = LLMCacheConfig(enabled=False)
+            self._initialized = True
+
+    @property
+    def enabled(self) -> bool:
+        self._init()
+        return self.config.enabled and self.internal_db is not None
+
+    @staticmethod
+    def key(messages, config, response_format: BaseModel = None) -> str:
+        schema = response_format.model_json_schema() if response_format is not None else None
+        payload = {
+            "model": config.model,
+            "temperature": config.temperature,
+            "messages": messages,
+            "response_format": schema,
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def get(self, key: str) -> Optional[CachedChatCompletion]:
+        now = datetime.now()
+        with self.internal_db.connect() as conn:
+            entry = conn.execute(
+                "SELECT model, response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if entry is None or now - entry[2] > timedelta(seconds=self.config.ttl_seconds):
+                self._count("misses")
+                return None
+            conn.execute("UPDATE llm_cache SET last_accessed = ? WHERE key = ?", (now, key))
+        self._count("hits")
+        logger.debug(f"LLM cache hit for {entry[0]} ({key[:12]})")
+        return CachedChatCompletion(model=entry[0], choices=[_CachedChoice(message=_CachedMessage(content=entry[1]))])
+
+    def put(self, key: str, response):
+        content = response.choices[0].message.content
+        if content is None:
+            return
+        now = datetime.now()
+        with self.internal_db.connect() as conn:
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO llm_cache (key, model, response, size_bytes, created_at, last_accessed)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (key, getattr(response, "model", None), content, len(content.encode()), now, now),
+            )
+        self._count("writes")
+        self.evict()
+
+    def evict(self):
+        """Remove expired responses, then least recently used ones until the cache fits `max_bytes`."""
+        with self.internal_db.connect() as conn:
+            expired_before = datetime.now() - timedelta(seconds=self.config.ttl_seconds)
+            evicted = conn.execute(
+                """
+                DELETE FROM llm_cache WHERE created_at < ? OR key IN (
+                    SELECT key FROM (
+                        SELECT key, sum(size_bytes) OVER (ORDER BY last_accessed DESC) AS cumulative_bytes
+                        FROM llm_cache
+                    ) WHERE cumulative_bytes > ?
+                ) RETURNING key
+                """,
+                (expired_before, self.config.max_bytes),
+            ).fetchall()
+        self._count("evictions", len(evicted))
+
+    def invalidate(self) -> int:
+        """Drop every cached response."""
+        with self.internal_db.connect() as conn:
+            removed = conn.execute("DELETE FROM llm_cache RETURNING key").fetchall()
+        logger.info(f"Invalidated {len(removed)} cached LLM responses")
+        return len(removed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _lookup(self, bound) -> tuple:
+        # -> (key, cached response), the key is None when the response must not be cached
+        use_cache = bound.arguments.pop("use_cache", True)
+        if not self.enabled:
+            return None, None
+        try:
+            key = self.key(bound.arguments["messages"], bound.arguments["config"], bound.arguments.get("response_format"))
+            if not use_cache:
+                self._count("bypassed")
+                return key, None
+            return key, self.get(key)
+        except Exception as e:
+            logger.warning(f"LLM cache lookup failed: {e}")
+            return None, None
+
+    def _store(self, key: str, response):
+        try:
+            self.put(key, response)
+        except Exception as e:
+            logger.warning(f"Could not cache LLM response: {e}")
 
     def __call__(self, func: Callable) -> Callable:
+        signature = inspect.signature(func)
+
+        def _bind(args, kwargs):
+            use_cache = kwargs.pop("use_cache", True)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            bound.arguments["use_cache"] = use_cache
+            return bound
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                bound = _bind(args, kwargs)
+                key, cached = await asyncio.to_thread(self._lookup, bound)
+                if cached is not None:
+                    return cached
+                response = await func(*bound.args, **bound.kwargs)
+                if key is not None:
+                    await asyncio.to_thread(self._store, key, response)
+                return response
+
+            return async_wrapper
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            try:
-                response = func(*args, **kwargs)
-                # print(
-                #     {
-                #         "response": response,
-                #         "inputs": [{"name": str(i), "value": arg} for i, arg in enumerate(args)]
-                #         + [
-                #             {"name": str(k), "value": v} for k, v in kwargs.items()
-                #         ],
-                #         "error": "",
-                #         "timestamp": datetime.now().isoformat(),
-                #     }
-                # )
-                return response
-            except Exception as e:
-                raise e
+            bound = _bind(args, kwargs)
+            key, cached = self._lookup(bound)
+            if cached is not None:
+                return cached
+            response = func(*bound.args, **bound.kwargs)
+            if key is not None:
+                self._store(key, response)
+            return response
 
-        return wrapper
\ No newline at end of file
+        return wrapper
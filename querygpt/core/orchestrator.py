@@ -1,4 +1,3 @@
-import time
 from querygpt.core.agent import Agent
 from querygpt.core.logging import get_logger
 
@@ -48,10 +47,7 @@ class Orchestrator:
                    
                    self.history.append({"query": query, "trace_id": trace_id, "agent": agent ,"final_answer": final_answer})
                    logger.debug("Added agent execution to history")
-                   
-                   if i < len(self.agents) - 1:  # Don't sleep after the last agent
-                        logger.debug("Sleeping for 4 seconds to avoid rate limiting")
-                        time.sleep(4) # to avoid rate limiting; free tier
+                   # no pause between agents, their LLM calls wait for the quota of the model (see `rate_limit`)
          else:
               raise ValueError("Parallel execution is not supported yet")
          
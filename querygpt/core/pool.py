@@ -0,0 +1,231 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class PoolTimeoutError(TimeoutError):
+    pass
+
+
+class _PooledConnection:
+    def __init__(self, conn: Any):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    """Thread-safe pool of DB-API connections for a single source.
+
+    Args:
+        factory (Callable): opens a new connection.
+        min_size (int): connections opened eagerly and kept even when idle.
+        max_size (int): upper bound of open connections (idle + checked out).
+        idle_timeout (float): seconds after which an idle connection above `min_size` is closed.
+        acquire_timeout (float): seconds to wait for a free connection before raising `PoolTimeoutError`.
+        health_check (Callable): called on checkout, must raise if the connection is unusable.
+        reset (Callable): called on checkin, e.g. to rollback an open transaction.
+        close (Callable): closes a connection, defaults to `conn.close()`.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        min_size: int = 0,
+        max_size: int = 5,
+        idle_timeout: float = 300,
+        acquire_timeout: float = 30,
+        health_check: Optional[Callable[[Any], None]] = None,
+        reset: Optional[Callable[[Any], None]] = None,
+        close: Optional[Callable[[Any], None]] = None,
+        name: str = "pool",
+    ):
+        if max_size < 1:
+            raise ValueError(f"max_size must be at least 1, got {max_size}")
+        if min_size > max_size:
+            raise ValueError(
+                f"min_size ({min_size}) cannot be greater than max_size ({max_size})"
+            )
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.health_check = health_check
+        self.reset = reset
+        self._close = close or (lambda conn: conn.close())
+        self.name = name
+
+        self._idle: List[_PooledConnection] = []
+        self._in_use: Dict[int, _PooledConnection] = {}
+        self._size = 0  # idle + checked out
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._stats = {
+            "created": 0,
+            "closed": 0,
+            "checkouts": 0,
+            "reused": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "timeouts": 0,
+            "failed_health_checks": 0,
+        }
+        for _ in range(min_size):
+            with self._cond:
+                self._size += 1
+            self._release_to_idle(self._open())
+
+    def _open(self) -> _PooledConnection:
+        # the caller must have reserved a slot by incrementing `_size`
+        try:
+            conn = self.factory()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._stats["created"] += 1
+        logger.debug(f"[{self.name}] opened new connection")
+        return _PooledConnection(conn)
+
+    def _discard(self, pooled: _PooledConnection):
+        try:
+            self._close(pooled.conn)
+        except Exception as e:
+            logger.debug(f"[{self.name}] error while closing connection: {e}")
+        with self._cond:
+            self._size -= 1
+            self._stats["closed"] += 1
+            self._cond.notify()
+
+    def _release_to_idle(self, pooled: _PooledConnection):
+        pooled.last_used = time.monotonic()
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    def _evict_expired(self) -> List[_PooledConnection]:
+        # must be called with the lock held; returns connections to close outside the lock
+        if not self.idle_timeout:
+            return []
+        now = time.monotonic()
+        expired = []
+        keep = []
+        # most recently used connections are at the end of the list
+        for pooled in self._idle:
+            if (
+                now - pooled.last_used > self.idle_timeout
+                and self._size - len(expired) > self.min_size
+            ):
+                expired.append(pooled)
+            else:
+                keep.append(pooled)
+        self._idle = keep
+        return expired
+
+    def acquire(self) -> Any:
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout
+        waited = False
+        while True:
+            pooled, open_new = None, False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError(f"Connection pool {self.name} is closed")
+                expired = self._evict_expired()
+                if self._idle:
+                    pooled = self._idle.pop()
+                elif self._size - len(expired) < self.max_size:
+                    self._size += 1
+                    open_new = True
+                elif not expired:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeoutError(
+                            f"Timed out after {self.acquire_timeout}s waiting for a connection from {self.name} (max_size={self.max_size})"
+                        )
+                    if not waited:
+                        self._stats["waits"] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+                    continue
+            for old in expired:
+                self._discard(old)
+            if open_new:
+                pooled = self._open()
+            elif pooled is None:
+                continue  # eviction freed capacity, try again
+            elif self.health_check is not None:
+                try:
+                    self.health_check(pooled.conn)
+                except Exception as e:
+                    logger.warning(
+                        f"[{self.name}] discarding connection that failed health check: {e}"
+                    )
+                    with self._cond:
+                        self._stats["failed_health_checks"] += 1
+                    self._discard(pooled)
+                    continue
+            with self._cond:
+                self._stats["checkouts"] += 1
+                if not open_new:
+                    self._stats["reused"] += 1
+                if waited:
+                    self._stats["wait_seconds"] += time.monotonic() - start
+                self._in_use[id(pooled.conn)] = pooled
+            return pooled.conn
+
+    def release(self, conn: Any, discard: bool = False):
+        with self._cond:
+            pooled = self._in_use.pop(id(conn), None)
+        if pooled is None:
+            raise ValueError(f"Connection was not checked out from {self.name}")
+        if not discard and self.reset is not None:
+            try:
+                self.reset(conn)
+            except Exception as e:
+                logger.warning(f"[{self.name}] discarding connection that failed reset: {e}")
+                discard = True
+        with self._cond:
+            closed = self._closed
+        if discard or closed:
+            self._discard(pooled)
+        else:
+            self._release_to_idle(pooled)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            # the connection may be left mid-transaction, `reset` (or discard) it on release
+            self.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            in_use = len(self._in_use)
+            return {
+                "name": self.name,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": in_use,
+                **self._stats,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._discard(pooled)
+        logger.debug(f"[{self.name}] pool closed")
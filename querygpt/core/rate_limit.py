@@ -0,0 +1,267 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+from querygpt.config.config import ChatCompletionConfig, RateLimitConfig
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class MinuteWindow:
+    """Thread safe limit of `per_minute` units (requests or tokens) within any sliding minute, as providers count them.
+
+    `reserve` books the units right away, at the earliest time the minute before it has room for
+    them, and returns how long the caller must wait until then, so callers are served in order and
+    async callers can wait without blocking a thread.
+    """
+
+    def __init__(self, per_minute: float, booked: List[float] = ()):
+        self.capacity = float(per_minute)
+        # (time, units) booked within the last minute, in time order
+        self._booked = deque((booked_at, 1.0) for booked_at in booked)
+        self._lock = threading.Lock()
+
+    def set_rate(self, per_minute: float):
+        with self._lock:
+            self.capacity = float(per_minute)
+
+    def reserve(self, amount: float = 1) -> float:
+        """Book `amount` units, returns the seconds to wait before using them."""
+        now = time.monotonic()
+        # a request larger than the limit only waits for an empty minute
+        amount = min(amount, self.capacity)
+        with self._lock:
+            while self._booked and self._booked[0][0] <= now - 60:
+                self._booked.popleft()
+            at = max(now, self._booked[-1][0]) if self._booked else now
+            used = sum(units for booked_at, units in self._booked if booked_at > at - 60)
+            for booked_at, units in self._booked:
+                if used + amount <= self.capacity:
+                    break
+                if booked_at > at - 60:
+                    # wait for this booking to leave the minute
+                    at = booked_at + 60
+                    used -= units
+            self._booked.append((at, amount))
+            return at - now
+
+    def consume(self, amount: float):
+        """Book (or give back, when negative) `amount` units now, without waiting."""
+        with self._lock:
+            now = time.monotonic()
+            # reservations of waiting callers may lie in the future, keep the bookings in time order
+            position = len(self._booked)
+            while position and self._booked[position - 1][0] > now:
+                position -= 1
+            self._booked.insert(position, (now, amount))
+
+
+def _content(message) -> str:
+    content = message.get("content") if isinstance(message, dict) else getattr(message, "content", None)
+    return str(content or "")
+
+
+def estimate_tokens(messages: List) -> int:
+    """Rough prompt size, about 4 characters per token."""
+    return sum(len(_content(message)) for message in messages) // 4 + 4 * len(messages)
+
+
+def _usage_tokens(response) -> Optional[int]:
+    # openai and litellm responses
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return getattr(usage, "total_tokens", None)
+    # smolagents chat messages
+    usage = getattr(response, "token_usage", None)
+    if usage is not None:
+        return usage.input_tokens + usage.output_tokens
+    return None
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Whether `error` is a 429 of the provider, as raised by openai or litellm."""
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the provider asked to wait before retrying, from the `retry-after(-ms)` headers of `error`."""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    for header, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return float(value) / scale
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+class RateLimiter:
+    """Share the request and token quota of one model between every caller of the process.
+
+    Each call books one request and its estimated prompt tokens in per minute windows before it
+    is made, the estimate is then corrected with the tokens the provider reports it used. The limits
+    adapt to the provider (AIMD): a 429 multiplies the allowed rate by `config.decrease_factor`
+    and every successful call adds back `config.increase_step` of the configured limits. Without a
+    configured `requests_per_minute`, the calls of the last minute before the first 429 become
+    the limit. A `retry-after` (or, without one, an exponential backoff with jitter) pauses every
+    caller of the model, the rate limited call is then retried up to `config.max_retries` times.
+    """
+
+    def __init__(self, config: RateLimitConfig, name: str = None):
+        self.config = config
+        self.name = name
+        self._lock = threading.Lock()
+        self._requests_per_minute = config.requests_per_minute
+        self._requests = MinuteWindow(config.requests_per_minute) if config.requests_per_minute else None
+        self._tokens = MinuteWindow(config.tokens_per_minute) if config.tokens_per_minute else None
+        self._scale = 1.0
+        self._paused_until = 0.0
+        # start times of the calls of the last minute, to learn a limit that was not configured
+        self._recent = deque()
+        self._stats = {"requests": 0, "rate_limited": 0, "retries": 0, "waited_seconds": 0.0}
+
+    def _count(self, key: str, n: float = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _reserve(self, tokens: int) -> float:
+        """Book one request and `tokens`, returns the seconds to wait before calling."""
+        now = time.monotonic()
+        with self._lock:
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - 60:
+                self._recent.popleft()
+            wait = max(0.0, self._paused_until - now)
+        if self._requests is not None:
+            wait = max(wait, self._requests.reserve(1))
+        if self._tokens is not None and tokens:
+            wait = max(wait, self._tokens.reserve(tokens))
+        self._count("requests")
+        if wait:
+            self._count("waited_seconds", wait)
+        return wait
+
+    def _set_scale(self, scale: float):
+        # called with the lock held
+        self._scale = min(1.0, max(self.config.min_scale, scale))
+        if self._requests is not None:
+            self._requests.set_rate(self._requests_per_minute * self._scale)
+        if self._tokens is not None:
+            self._tokens.set_rate(self.config.tokens_per_minute * self._scale)
+
+    def _on_success(self, estimated: int, response):
+        # responses served from the LLM cache used no tokens
+        used = 0 if getattr(response, "cached", False) else _usage_tokens(response)
+        if self._tokens is not None and used is not None:
+            self._tokens.consume(used - estimated)
+        if self._scale < 1.0:
+            with self._lock:
+                self._set_scale(self._scale + self.config.increase_step)
+
+    def _refund(self, tokens: int):
+        # a refused call used none of the tokens it booked
+        if self._tokens is not None and tokens:
+            self._tokens.consume(-min(tokens, self._tokens.capacity))
+
+    def _on_rate_limited(self, attempt: int, error: Exception) -> float:
+        """Slow the model down after a 429, returns the seconds to wait before retrying."""
+        delay = retry_after(error)
+        if delay is None:
+            delay = min(self.config.max_backoff_seconds, self.config.backoff_seconds * 2**attempt)
+            delay *= random.uniform(0.5, 1)
+        now = time.monotonic()
+        with self._lock:
+            if self._requests is None:
+                # the provider accepted the other calls of the last minute and refused this one
+                accepted = list(self._recent)[:-1]
+                self._requests_per_minute = max(1, len(accepted))
+                self._requests = MinuteWindow(self._requests_per_minute, booked=accepted)
+                logger.info(f"Learned a limit of {self._requests_per_minute} requests per minute for {self.name}")
+            elif now >= self._paused_until:
+                # concurrent calls refused while already paused do not slow the model down again
+                self._set_scale(self._scale * self.config.decrease_factor)
+            self._paused_until = max(self._paused_until, now + delay)
+            self._stats["rate_limited"] += 1
+        logger.warning(
+            f"{self.name} rate limited, retrying in {delay:.1f}s ({attempt + 1}/{self.config.max_retries}), "
+            f"rate now {self._scale:.0%} of its limit"
+        )
+        return delay
+
+    def call(self, fn: Callable, *args, tokens: int = 0, **kwargs):
+        """Call `fn(*args, **kwargs)` once the quota allows it, `tokens` being its estimated prompt tokens."""
+        for attempt in range(self.config.max_retries + 1):
+            wait = self._reserve(tokens)
+            if wait:
+                time.sleep(wait)
+            try:
+                response = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                self._refund(tokens)
+                if attempt == self.config.max_retries:
+                    raise
+                self._count("retries")
+                time.sleep(self._on_rate_limited(attempt, e))
+                continue
+            self._on_success(tokens, response)
+            return response
+
+    async def acall(self, fn: Callable, *args, tokens: int = 0, **kwargs):
+        """Async twin of `call`, `fn` being a coroutine function."""
+        for attempt in range(self.config.max_retries + 1):
+            wait = self._reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                response = await fn(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e):
+                    raise
+                self._refund(tokens)
+                if attempt == self.config.max_retries:
+                    raise
+                self._count("retries")
+                await asyncio.sleep(self._on_rate_limited(attempt, e))
+                continue
+            self._on_success(tokens, response)
+            return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "scale": self._scale,
+                "requests_per_minute": self._requests.capacity if self._requests is not None else None,
+                "tokens_per_minute": self._tokens.capacity if self._tokens is not None else None,
+            }
+
+
+# model -> RateLimiter
+_limiters = {}
+_lock = threading.Lock()
+
+
+def get_limiter(config: ChatCompletionConfig) -> RateLimiter:
+    """Return the process wide rate limiter of `config.model`, the limits of the first config seen for a model win."""
+    limiter = _limiters.get(config.model)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(config.model)
+            if limiter is None:
+                limiter = RateLimiter(config.rate_limit, name=config.model)
+                _limiters[config.model] = limiter
+    return limiter
+
+
+def limiter_stats() -> dict:
+    """Stats of the rate limiter of every model used so far."""
+    with _lock:
+        limiters = dict(_limiters)
+    return {model: limiter.stats() for model, limiter in limiters.items()}
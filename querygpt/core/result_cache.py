@@ -0,0 +1,199 @@
+import hashlib
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+import pandas as pd
+from querygpt.config.config import ResultCacheConfig
+from querygpt.core._database import InternalDatabase
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+_SQL_TOKENS = re.compile(
+    r"""
+    (?P<string>'(?:[^']|'')*')          # string literal, kept as is
+    | (?P<identifier>"(?:[^"]|"")*")    # quoted identifier, kept as is
+    | (?P<line_comment>--[^\n]*)
+    | (?P<block_comment>/\*.*?\*/)
+    | (?P<space>\s+)
+    | (?P<other>[^'"\s\-/]+|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_PUNCTUATION = "(),;=<>"
+# words outside of a qualified name (`t.date`), identifiers keep their case, they are case sensitive on e.g. ClickHouse
+_WORDS = re.compile(r"(?<![.\w])[A-Za-z_]\w*")
+_SQL_KEYWORDS = frozenset(
+    """
+    all and any array as asc between by case cast desc distinct else end except exists false
+    final first from full group having ilike in inner intersect interval is join last left like
+    limit natural not null nulls offset on or order outer over partition prewhere right select
+    semi anti set settings then true union using when where window with
+    """.split()
+)
+
+
+def _fold_keyword(match: re.Match) -> str:
+    word = match.group()
+    return word.lower() if word.lower() in _SQL_KEYWORDS else word
+
+
+def normalize_sql(sql: str) -> str:
+    """Normalize `sql` so that trivially re-formatted queries map to the same cache key.
+
+    Comments are dropped, whitespace is collapsed and SQL keywords are lower cased. Identifiers,
+    string literals and quoted identifiers keep their case.
+    """
+    parts = []
+    for match in _SQL_TOKENS.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("space", "line_comment", "block_comment"):
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        elif kind in ("string", "identifier"):
+            parts.append(match.group())
+        else:
+            parts.append(_WORDS.sub(_fold_keyword, match.group()))
+    # spaces around punctuation carry no meaning: "count ( a , b ) = 1" == "count(a,b)=1"
+    tokens = []
+    for i, part in enumerate(parts):
+        if part == " " and (
+            i == len(parts) - 1
+            or parts[i - 1][-1] in _PUNCTUATION
+            or parts[i + 1][0] in _PUNCTUATION
+        ):
+            continue
+        tokens.append(part)
+    return "".join(tokens).strip().rstrip(";").strip()
+
+
+class ResultCache:
+    """Cache of SQL results, stored as Parquet files under `config.path` and indexed in the internal database.
+
+    Entries are keyed by the source name and the normalized SQL, expire after `config.ttl_seconds`
+    and the least recently used ones are evicted once the files exceed `config.max_bytes`.
+    """
+
+    def __init__(self, internal_db: InternalDatabase, config: ResultCacheConfig):
+        self.internal_db = internal_db
+        self.config = config
+        self.path = Path(config.path)
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def key(self, sql: str, source: str) -> str:
+        return hashlib.sha256(f"{source}\n{normalize_sql(sql)}".encode()).hexdigest()
+
+    def get(self, sql: str, source: str) -> Optional[pd.DataFrame]:
+        key = self.key(sql, source)
+        now = datetime.now()
+        with self.internal_db.connect() as conn:
+            entry = conn.execute(
+                "SELECT path, truncated, created_at FROM result_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if entry is None or now - entry[2] > timedelta(seconds=self.config.ttl_seconds):
+                self._count("misses")
+                return None
+            try:
+                result = conn.execute("SELECT * FROM read_parquet(?)", (entry[0],)).df()
+            except Exception as e:
+                logger.warning(f"Dropping unreadable result cache entry {key}: {e}")
+                conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+                self._count("misses")
+                return None
+            conn.execute("UPDATE result_cache SET last_accessed = ? WHERE key = ?", (now, key))
+        result.attrs["truncated"] = bool(entry[1])
+        self._count("hits")
+        logger.debug(f"Result cache hit for {source}: {sql[:100]}...")
+        return result
+
+    def put(self, sql: str, source: str, result: pd.DataFrame):
+        key = self.key(sql, source)
+        path = self.path / f"{key}.parquet"
+        now = datetime.now()
+        try:
+            with self.internal_db.connect() as conn:
+                view = f"_result_{key[:16]}"
+                conn.register(view, result)
+                try:
+                    escaped = str(path).replace("'", "''")
+                    conn.execute(f"COPY (SELECT * FROM {view}) TO '{escaped}' (FORMAT parquet)")
+                finally:
+                    conn.unregister(view)
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO result_cache
+                    (key, source, normalized_sql, path, row_count, size_bytes, truncated, created_at, last_accessed)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    (
+                        key,
+                        source,
+                        normalize_sql(sql),
+                        str(path),
+                        len(result),
+                        path.stat().st_size,
+                        bool(result.attrs.get("truncated", False)),
+                        now,
+                        now,
+                    ),
+                )
+            self._count("writes")
+        except Exception as e:
+            # results with types parquet cannot hold are simply not cached
+            logger.warning(f"Could not cache result for {source}: {e}")
+            return
+        self.evict()
+
+    def _delete(self, conn, rows):
+        for key, path in rows:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+
+    def evict(self):
+        """Remove expired entries, then least recently used ones until the cache fits `max_bytes`."""
+        with self._lock, self.internal_db.connect() as conn:
+            expired_before = datetime.now() - timedelta(seconds=self.config.ttl_seconds)
+            expired = conn.execute(
+                "SELECT key, path FROM result_cache WHERE created_at < ?", (expired_before,)
+            ).fetchall()
+            over_budget = conn.execute(
+                """
+                SELECT key, path FROM (
+                    SELECT key, path, sum(size_bytes) OVER (ORDER BY last_accessed DESC) AS cumulative_bytes
+                    FROM result_cache WHERE created_at >= ?
+                ) WHERE cumulative_bytes > ?
+                """,
+                (expired_before, self.config.max_bytes),
+            ).fetchall()
+            self._delete(conn, expired + over_budget)
+            self._stats["evictions"] += len(expired) + len(over_budget)
+
+    def invalidate(self, source: str = None):
+        """Drop every cached result of `source`, or the whole cache if no source is given."""
+        with self._lock, self.internal_db.connect() as conn:
+            if source is None:
+                rows = conn.execute("SELECT key, path FROM result_cache").fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT key, path FROM result_cache WHERE source = ?", (source,)
+                ).fetchall()
+            self._delete(conn, rows)
+        logger.info(f"Invalidated {len(rows)} cached results for source {source or '*'}")
+        return len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
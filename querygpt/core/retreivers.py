@@ -1,20 +1,74 @@
+from typing import List
 from querygpt.core.index import Index
 from querygpt.core._database import InternalDatabase, DatabaseBase
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# table level fields, repeated on every column row of the single stage context
+_TABLE_FIELDS = ["table_bussines_summary", "table_possible_usages"]
 
 
 def get_context(
-    query, index: Index, internal_db: InternalDatabase, source: DatabaseBase
+    query, index: Index, internal_db: InternalDatabase, source: DatabaseBase, table_index: Index | None = None, top_tables: int = 5
 ):
     """
     Basic retrival to obtain most similar obtain generated documenation, and their source schema ( datatypes and so on.).
+    With `table_index`, retrieval is two-stage, see `get_context_many`.
     """
+    if table_index is not None:
+        return get_context_many(
+            [query], index=index, internal_db=internal_db, source=source, table_index=table_index, top_tables=top_tables
+        )
     similars = index.retrieve(query)
-    table_ids = [hit["metadata"]["table_id"] for hit in similars]
-    column_ids = [hit["metadata"]["column_id"] for hit in similars]
+    return _context_from_hits(similars, internal_db=internal_db, source=source)
+
+
+def get_context_many(
+    queries: List[str], index: Index, internal_db: InternalDatabase, source: DatabaseBase, table_index: Index | None = None, top_tables: int = 5
+):
+    """
+    Batch `get_context`: retrieves for all `queries` at once, then looks up the union of the retrieved columns, each once, in the internal and source databases.
+
+    With `table_index` (two-stage), the `top_tables` most similar tables of each query are found first and only their
+    columns are searched, the table summaries are then given once per table instead of on every column.
+    """
+    table_ids = None
+    if table_index is not None:
+        tables = table_index.retrieve_many(queries, top_k=top_tables)
+        table_ids = list(dict.fromkeys(hit["metadata"]["table_id"] for hits in tables for hit in hits))
+        if not table_ids:
+            logger.warning("The table index is empty, falling back to single stage retrieval")
+            table_ids = None
+    similars = index.retrieve_many(queries, table_ids=table_ids)
+    return _context_from_hits(
+        [hit for hits in similars for hit in hits],
+        internal_db=internal_db,
+        source=source,
+        compact=table_ids is not None,
+    )
+
+
+def _context_from_hits(similars: List[dict], internal_db: InternalDatabase, source: DatabaseBase, compact: bool = False):
+    # the same column retrieved by several queries is kept once, at its first position
+    hits = list(
+        dict.fromkeys((hit["metadata"]["table_id"], hit["metadata"]["column_id"]) for hit in similars)
+    )
+    table_ids = [table_id for table_id, _ in hits]
+    column_ids = [column_id for _, column_id in hits]
+    if not column_ids:
+        return []
     docs = internal_db.get_documenation(table_ids=table_ids, column_ids=column_ids)
     table_names = docs.table_name.unique().tolist()
     column_names = docs.column_name.unique().tolist()
     schemas = source.get_table_schema(table_name=table_names)
     schemas = schemas[schemas.column_name.isin(column_names)]
-    context = docs.merge(schemas, on=["table_name", "column_name"])
-    return context.to_dict(orient="records")
+    context = docs.merge(schemas, on=["table_name", "column_name"]).to_dict(orient="records")
+    if compact:
+        seen = set()
+        for record in context:
+            if record["table_id"] in seen:
+                for field in _TABLE_FIELDS:
+                    record.pop(field, None)
+            seen.add(record["table_id"])
+    return context
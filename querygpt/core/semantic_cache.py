@@ -0,0 +1,232 @@
+import hashlib
+import re
+import threading
+from datetime import datetime
+from typing import List, Optional
+import numpy as np
+import pandas as pd
+from querygpt.config.config import SemanticCacheConfig
+from querygpt.core._database import DatabaseBase, InternalDatabase
+from querygpt.core.embeders import EmbedderBase
+from querygpt.core.logging import get_logger
+from querygpt.core.result_cache import ResultCache
+from querygpt.core.sql_generator import validate_and_run_sql
+from querygpt.core.trace import Trace
+
+logger = get_logger(__name__)
+
+
+# numbers and quoted values of a question, an apostrophe within a word does not open a quote
+_LITERALS = re.compile(r"""(?<!\w)'[^']*'(?!\w)|(?<!\w)"[^"]*"(?!\w)|“[^”]*”|\d+(?:[.,]\d+)*""")
+
+
+def question_literals(question: str) -> tuple:
+    """The numbers and quoted values of `question`, e.g. its year or the customer it asks about."""
+    return tuple(sorted(literal.strip("'\"“”").lower() for literal in _LITERALS.findall(question)))
+
+
+def schema_fingerprint(database: DatabaseBase) -> str:
+    """sha256 of the tables, columns and data types of `database`, as held by its schema catalog."""
+    return database.catalog.fingerprint()
+
+
+class SemanticCache:
+    """Map questions to the SQL that answered them, so that a rephrased question skips the agent.
+
+    Entries are (question embedding, validated SQL, explanation) of completed traces, stored in the
+    internal database and searched in memory. A question whose embedding is at least
+    `config.similarity_threshold` similar to a cached one, and that has the same numbers and quoted
+    values (see `question_literals`), re-runs the cached SQL. Entries written
+    against another schema fingerprint of the source (see `schema_fingerprint`) are stale and
+    dropped, and so are entries whose SQL no longer runs.
+    """
+
+    def __init__(
+        self,
+        internal_db: InternalDatabase,
+        embedder: EmbedderBase,
+        database: DatabaseBase,
+        config: SemanticCacheConfig,
+        result_cache: ResultCache | None = None,
+    ):
+        self.internal_db = internal_db
+        self.embedder = embedder
+        self.database = database
+        self.config = config
+        self.result_cache = result_cache
+        self._lock = threading.Lock()
+        # (ids, normalized embeddings, entries), loaded on first use
+        self._entries = None
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "mismatched": 0, "stale": 0, "failed": 0, "stored": 0}
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _normalize(self, embedding) -> np.ndarray:
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / max(float(np.linalg.norm(embedding)), 1e-12)
+
+    def _load(self):
+        if self._entries is not None:
+            return self._entries
+        with self._lock:
+            if self._entries is None:
+                with self.internal_db.connect() as conn:
+                    rows = conn.execute(
+                        "SELECT id, question, embedding, sql, explanation, schema_fingerprint FROM semantic_cache WHERE source = ?",
+                        (self.database.name,),
+                    ).df().to_dict(orient="records")
+                embeddings = np.stack(
+                    [np.frombuffer(row.pop("embedding"), dtype=np.float32) for row in rows]
+                ) if rows else np.empty((0, self.embedder.config.dimensions), dtype=np.float32)
+                for row in rows:
+                    row["literals"] = question_literals(row["question"])
+                self._entries = ([row["id"] for row in rows], embeddings, rows)
+                logger.info(f"Loaded {len(rows)} semantic cache entries of {self.database.name}")
+        return self._entries
+
+    def lookup(self, question: str) -> Optional[dict]:
+        """Return the cached entry most similar to `question` with its `similarity`, if above the threshold and not stale."""
+        self._count("lookups")
+        ids, embeddings, entries = self._load()
+        if not ids:
+            self._count("misses")
+            return None
+        scores = embeddings @ self._normalize(self.embedder.embed_query(question))
+        literals = question_literals(question)
+        best = None
+        for candidate in np.argsort(-scores):
+            if scores[candidate] < self.config.similarity_threshold:
+                break
+            # "sales in 2023" and "sales in 2024" embed alike but need another SQL
+            if entries[candidate]["literals"] == literals:
+                best = int(candidate)
+                break
+            self._count("mismatched")
+        if best is None:
+            self._count("misses")
+            return None
+        entry = {**entries[best], "similarity": float(scores[best])}
+        if entry["schema_fingerprint"] != schema_fingerprint(self.database):
+            logger.info(f"Semantic cache entry {entry['id']} was cached against another schema, dropping it")
+            self._count("stale")
+            self.delete([entry["id"]])
+            return None
+        return entry
+
+    def answer(self, question: str) -> Optional[dict]:
+        """Answer `question` by re-running the SQL of a similar cached question, None when there is none."""
+        entry = self.lookup(question)
+        if entry is None:
+            return None
+        result, error = validate_and_run_sql(entry["sql"], self.database, cache=self.result_cache)
+        if error:
+            logger.warning(f"Cached SQL of semantic cache entry {entry['id']} failed, dropping it: {error}")
+            self._count("failed")
+            self.delete([entry["id"]])
+            return None
+        self._count("hits")
+        with self.internal_db.connect() as conn:
+            conn.execute(
+                "UPDATE semantic_cache SET hits = hits + 1, last_hit_at = ? WHERE id = ?", (datetime.now(), entry["id"])
+            )
+        logger.info(f"Semantic cache hit ({entry['similarity']:.3f}): {question[:100]} -> {entry['question'][:100]}")
+        return {**entry, "result": result}
+
+    def store(self, question: str, sql: str, explanation: str | None = None, trace_id: str | None = None):
+        """Cache the validated `sql` that answered `question`, replacing the entry of the same question."""
+        self.store_many([{"question": question, "sql": sql, "explanation": explanation, "trace_id": trace_id}])
+
+    def store_many(self, entries: List[dict]):
+        entries = [entry for entry in entries if entry.get("sql")]
+        if not entries:
+            return
+        embeddings = np.asarray(self.embedder.embed([entry["question"] for entry in entries]), dtype=np.float32)
+        fingerprint = schema_fingerprint(self.database)
+        now = datetime.now()
+        staged = pd.DataFrame(
+            {
+                "id": [
+                    hashlib.sha256(f"{self.database.name}\n{' '.join(entry['question'].split())}".encode()).hexdigest()
+                    for entry in entries
+                ],
+                "question": [entry["question"] for entry in entries],
+                "embedding": [self._normalize(embedding).tobytes() for embedding in embeddings],
+                "sql": [entry["sql"] for entry in entries],
+                "explanation": [entry.get("explanation") for entry in entries],
+                "trace_id": [entry.get("trace_id") for entry in entries],
+            },
+            dtype=object,
+        ).drop_duplicates("id", keep="last")
+        with self.internal_db.connect() as conn:
+            conn.register("staged_semantic_cache", staged)
+            try:
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO semantic_cache
+                    (id, source, question, embedding, sql, explanation, trace_id, schema_fingerprint, created_at, hits)
+                    SELECT id, ?, question, embedding::BLOB, sql, explanation, trace_id, ?, ?, 0 FROM staged_semantic_cache
+                    """,
+                    (self.database.name, fingerprint, now),
+                )
+            finally:
+                conn.unregister("staged_semantic_cache")
+            self._evict(conn)
+        self._count("stored", len(staged))
+        self._entries = None
+
+    def _evict(self, conn):
+        # least recently hit (or created) entries of the source beyond `max_entries`
+        conn.execute(
+            """
+            DELETE FROM semantic_cache WHERE id IN (
+                SELECT id FROM semantic_cache
+                WHERE source = ?
+                ORDER BY coalesce(last_hit_at, created_at) DESC
+                OFFSET ?
+            )
+            """,
+            (self.database.name, self.config.max_entries),
+        )
+
+    def store_trace(self, trace: Trace):
+        """Cache the SQL of a completed trace, if it produced one."""
+        if trace.final_answer is not None and trace.sql:
+            self.store(trace.task, trace.sql, trace.sql_explanation, trace_id=trace.id)
+
+    def backfill(self) -> int:
+        """Cache the SQL of the completed traces in the internal database that are not cached yet."""
+        with self.internal_db.connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT task AS question, sql, sql_explanation AS explanation, id AS trace_id FROM trace
+                WHERE sql IS NOT NULL AND final_answer IS NOT NULL
+                AND id NOT IN (SELECT trace_id FROM semantic_cache WHERE trace_id IS NOT NULL)
+                ORDER BY start_time
+                """
+            ).df().to_dict(orient="records")
+        self.store_many(rows)
+        return len(rows)
+
+    def delete(self, ids: List[str]):
+        with self.internal_db.connect() as conn:
+            conn.execute("DELETE FROM semantic_cache WHERE id IN (SELECT UNNEST(?))", (list(ids),))
+        self._entries = None
+
+    def invalidate(self) -> int:
+        """Drop every cached question of the source."""
+        with self.internal_db.connect() as conn:
+            removed = conn.execute(
+                "DELETE FROM semantic_cache WHERE source = ? RETURNING id", (self.database.name,)
+            ).fetchall()
+        self._entries = None
+        logger.info(f"Invalidated {len(removed)} semantic cache entries of {self.database.name}")
+        return len(removed)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else None
+        stats["entries"] = len(self._entries[0]) if self._entries is not None else None
+        return stats
@@ -16,6 +16,8 @@ CREATE TABLE IF NOT EXISTS table_metadata (
     possible_usages VARCHAR,
     PRIMARY KEY (id)
 );
+-- added after the first release, rows documented before have no source
+ALTER TABLE table_metadata ADD COLUMN IF NOT EXISTS source VARCHAR;
 
 CREATE TABLE IF NOT EXISTS column_metadata (
     id INTEGER DEFAULT nextval('column_id_sequence'),
@@ -57,6 +59,10 @@ CREATE TABLE IF NOT EXISTS trace (
     system_prompt TEXT
 );
 
+-- the validated SQL of the trace and its explanation, feed the semantic cache
+ALTER TABLE trace ADD COLUMN IF NOT EXISTS sql TEXT;
+ALTER TABLE trace ADD COLUMN IF NOT EXISTS sql_explanation TEXT;
+
 CREATE TABLE IF NOT EXISTS tracestep (
     id VARCHAR PRIMARY KEY,
     trace_id VARCHAR,
@@ -81,6 +87,56 @@ CREATE TABLE IF NOT EXISTS tracestep (
     FOREIGN KEY (trace_id) REFERENCES trace(id)
 );
 
+CREATE TABLE IF NOT EXISTS result_cache (
+    key VARCHAR PRIMARY KEY,  -- sha256 of source name and normalized sql
+    source VARCHAR NOT NULL,
+    normalized_sql TEXT,
+    path VARCHAR NOT NULL,    -- parquet file holding the result
+    row_count INTEGER,
+    size_bytes BIGINT,
+    truncated BOOLEAN,
+    created_at TIMESTAMP NOT NULL,
+    last_accessed TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    model VARCHAR NOT NULL,
+    text_hash VARCHAR NOT NULL,  -- sha256 of the embedded text
+    dtype VARCHAR NOT NULL,      -- numpy dtype of the embedding bytes
+    embedding BLOB NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (model, text_hash)
+);
+
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key VARCHAR PRIMARY KEY,  -- sha256 of model, temperature, messages and response format schema
+    model VARCHAR,
+    response TEXT NOT NULL,   -- content of the first choice
+    size_bytes BIGINT NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    last_accessed TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS semantic_cache (
+    id VARCHAR PRIMARY KEY,      -- sha256 of source and whitespace normalized question
+    source VARCHAR NOT NULL,
+    question TEXT NOT NULL,
+    embedding BLOB NOT NULL,     -- normalized float32 question embedding
+    sql TEXT NOT NULL,
+    explanation TEXT,
+    trace_id VARCHAR,
+    schema_fingerprint VARCHAR NOT NULL,  -- sha256 of the source schema the sql was validated against
+    created_at TIMESTAMP NOT NULL,
+    last_hit_at TIMESTAMP,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+
+-- sha256 of this script, InternalDatabase skips the script when the latest version matches
+CREATE TABLE IF NOT EXISTS schema_version (
+    version VARCHAR NOT NULL,
+    applied_at TIMESTAMP NOT NULL
+);
+
 -- Indexes
 CREATE INDEX IF NOT EXISTS idx_tracestep_trace_id ON tracestep(trace_id);
 CREATE INDEX IF NOT EXISTS idx_tracestep_step_number ON tracestep(trace_id, step_number);
@@ -5,6 +5,8 @@ from pydantic import BaseModel
 from querygpt.config.config import ChatCompletionConfig
 import json
 from querygpt.core._database import DatabaseBase
+from querygpt.core.result_cache import ResultCache
+from querygpt.core.cost_guard import QueryCostExceededError, guard_query
 
 class SQLModel(BaseModel):
     sql: str
@@ -62,13 +64,40 @@ def generate_sql_from_context(query: str, context: List[dict], database : str, c
         return json.loads(response.choices[0].message.content)
 
 
-def validate_and_run_sql(sql : str, database: DatabaseBase):
-      """Evalutate and run sql query"""
+def _mark_limited(result, limit: int | None):
+      # a query the cost guard wrapped in a LIMIT may have lost rows
+      if limit is not None and len(result) >= limit:
+           result.attrs["truncated"] = True
+      return result
+
+
+def validate_and_run_sql(sql : str, database: DatabaseBase, cache: ResultCache | None = None):
+      """Evalutate and run sql query, serving it from `cache` when the same (normalized) sql already ran on this source.
+
+      When the source has a cost guard, the query is EXPLAINed first and either rejected, returning a dict
+      error the agent can act on, or run with a LIMIT, and always with the guard's statement timeout.
+      """
+      if cache is not None:
+           cached = cache.get(sql, database.name)
+           if cached is not None:
+                return cached, None
       try:
-           result = database.execute_query(query=sql)
-           return result, None
+           query, timeout_seconds, limit = guard_query(sql, database)
+           result = database.execute_query(
+                query=query,
+                max_rows=database.config.max_result_rows,
+                max_bytes=database.config.max_result_bytes,
+                timeout_seconds=timeout_seconds,
+           )
+      except QueryCostExceededError as e:
+            return None, e.to_dict()
       except Exception as e:
             return None, str(e)
+      result = _mark_limited(result, limit)
+      if cache is not None:
+           cache.put(sql, database.name, result)
+      return result, None
+
 
 # def validate_and_run_sql(self, sql: str):
 #         """Extract SQL tables and columns from SQL query and check if they are in the source."""
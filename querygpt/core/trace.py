@@ -67,6 +67,9 @@ class Trace(BaseModel):
     duration_seconds: Optional[float] = None
     final_answer: Optional[str] = None
     total_steps: Optional[int] = None
+    # the last SQL that ran successfully, and the explanation of the generated SQL
+    sql: Optional[str] = None
+    sql_explanation: Optional[str] = None
     steps: List[TraceStep] = Field(default_factory=list)
     
     def add_step(self, step: TraceStep) -> TraceStep:
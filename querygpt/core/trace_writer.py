@@ -0,0 +1,107 @@
+import atexit
+import queue
+import threading
+import time
+from typing import List
+from querygpt.config.config import TraceWriterConfig
+from querygpt.core._database import InternalDatabase
+from querygpt.core.trace import Trace
+from querygpt.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+_STOP = object()
+
+
+class TraceWriter:
+    """Write agent traces to the internal database from a background thread.
+
+    `submit` only puts the trace on a bounded queue, a worker drains it in batches of up to
+    `config.batch_size` traces, each written with `InternalDatabase.save_traces`. When the queue
+    is full new traces are dropped rather than slowing down the caller. Pending traces are
+    flushed on `close`, which also runs at interpreter exit.
+    """
+
+    def __init__(self, internal_db: InternalDatabase, config: TraceWriterConfig):
+        self.internal_db = internal_db
+        self.config = config
+        self._queue = queue.Queue(maxsize=config.max_queue_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {"submitted": 0, "written": 0, "dropped": 0, "failed": 0, "batches": 0}
+        self._thread = threading.Thread(target=self._run, name="querygpt-trace-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, trace: Trace) -> bool:
+        """Queue `trace` for writing, returns False if it was dropped."""
+        if self._closed:
+            logger.warning(f"Trace writer is closed, dropping trace {trace.id}")
+            self._count("dropped")
+            return False
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            logger.warning(f"Trace queue is full ({self.config.max_queue_size}), dropping trace {trace.id}")
+            self._count("dropped")
+            return False
+        self._count("submitted")
+        return True
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _next_batch(self) -> List:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.config.flush_interval_seconds
+        while batch[-1] is not _STOP and len(batch) < self.config.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, traces: List[Trace]):
+        try:
+            self.internal_db.save_traces(traces)
+            self._count("written", len(traces))
+            self._count("batches")
+            logger.debug(f"Wrote {len(traces)} traces")
+        except Exception as e:
+            logger.error(f"Failed to write {len(traces)} traces: {e}")
+            self._count("failed", len(traces))
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            traces = [trace for trace in batch if trace is not _STOP]
+            if traces:
+                self._write(traces)
+            for _ in batch:
+                self._queue.task_done()
+            if len(traces) < len(batch):
+                return
+
+    def flush(self):
+        """Block until every trace submitted so far has been written (or failed)."""
+        self._queue.join()
+
+    def close(self, timeout: float = 10):
+        """Stop accepting traces, write the pending ones and stop the worker."""
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        # the stop marker must not be dropped, wait for room in the queue
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"Trace writer did not finish within {timeout}s, {self._queue.qsize()} traces left unwritten")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "queued": self._queue.qsize()}
@@ -4,6 +4,7 @@ from querygpt.core import chat_completion_from_config
 from querygpt.config.config import ChatCompletionConfig
 from querygpt.core._database import DatabaseBase
 from querygpt.core.index import Index
+from querygpt.core.result_cache import ResultCache
 import json
 import pandas as pd
 
@@ -47,11 +48,13 @@ class GeneratorWorkflow:
         interal_database: DatabaseBase,
         index: Index,
         config: ChatCompletionConfig,
+        result_cache: ResultCache | None = None,
     ):
         self.internal_db = interal_database
         self.source_db = source_database
         self.index = index
         self.config = config
+        self.result_cache = result_cache
 
     
     def generate_insight_with_retry(self, query: str, retry: int = 3):
@@ -66,7 +69,7 @@ class GeneratorWorkflow:
         )
         raw_sql = generated_sql["sql"]
         for attempt in range(retry):
-            result, error = validate_and_run_sql(raw_sql, self.source_db)
+            result, error = validate_and_run_sql(raw_sql, self.source_db, cache=self.result_cache)
             if not error:
                 insight = generate_insight(query, result, self.config)
                 return {**insight, **generated_sql,
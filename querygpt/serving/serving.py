@@ -6,15 +6,28 @@ from fastapi.middleware.cors import CORSMiddleware
 from querygpt.config.config import init_config
 from querygpt.core.index import get_index
 from querygpt.core import (
+    llm_cache,
     init_database_from_config,
     init_sources_documentation_from_config,
     init_internal_database_from_config,
 )
 from querygpt.core.retreivers import get_context
 from querygpt.core.workflow import GeneratorWorkflow, generate_insight
-from querygpt.core.agent import create_agent
+from querygpt.core.agent import create_agent, trace_writer
 from querygpt import Agent
+from querygpt.tools.tools import (
+    config,
+    source_dbs,
+    index,
+    semantic_cache,
+)
+from querygpt.core.llm_clients import aclose_clients
+from querygpt.core.rate_limit import limiter_stats
 from querygpt.core.logging import get_logger
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import threading
 import json
 
 logger = get_logger(__name__)
@@ -30,8 +43,19 @@ logger = get_logger(__name__)
 
 app = FastAPI()
 logger.info("Initializing FastAPI application")
-agent = Agent()
-logger.info("Agent initialized successfully")
+
+# smolagents agents are synchronous: they run on a bounded pool of threads, each with its own agent
+# (which keeps per run state), while the event loop keeps serving other requests
+agent_executor = ThreadPoolExecutor(max_workers=config.serving.agent_workers, thread_name_prefix="querygpt-agent")
+_agents = threading.local()
+
+
+def _run_agent(query: str, use_cache: bool):
+    agent = getattr(_agents, "agent", None)
+    if agent is None:
+        logger.info(f"Initializing agent for {threading.current_thread().name}")
+        agent = _agents.agent = Agent()
+    return agent.run(query, use_enhanced_task=True, use_semantic_cache=use_cache)
 
 
 # Add CORS middleware
@@ -54,10 +78,59 @@ def get_history():
     return {"history"}
 
 
+@app.get("/stats/pools")
+def get_pool_stats():
+    logger.info("Pool stats endpoint called")
+    return {
+        source.name: source_db.pool_stats()
+        for source, source_db in zip(config.sources, source_dbs)
+    }
+
+
+@app.get("/stats/traces")
+def get_trace_stats():
+    logger.info("Trace stats endpoint called")
+    return trace_writer.stats() if trace_writer is not None else None
+
+
+@app.get("/stats/query_embeddings")
+def get_query_embedding_stats():
+    logger.info("Query embedding stats endpoint called")
+    return index.embedder.query_cache_stats()
+
+
+@app.get("/stats/llm_cache")
+def get_llm_cache_stats():
+    logger.info("LLM cache stats endpoint called")
+    return llm_cache.stats()
+
+
+@app.get("/stats/semantic_cache")
+def get_semantic_cache_stats():
+    logger.info("Semantic cache stats endpoint called")
+    return semantic_cache.stats() if semantic_cache is not None else None
+
+
+@app.get("/stats/rate_limits")
+def get_rate_limit_stats():
+    logger.info("Rate limit stats endpoint called")
+    return limiter_stats()
+
+
+@app.on_event("shutdown")
+async def close_databases():
+    agent_executor.shutdown(wait=False, cancel_futures=True)
+    for source_db in source_dbs:
+        await source_db.aclose()
+    if trace_writer is not None:
+        trace_writer.close()
+    await aclose_clients()
+
+
 @app.post(
     "/chat",
 )
-def get_chat(query: str):
+async def get_chat(query: str, use_cache: bool = True):
     logger.info(f"Chat endpoint called with query: {query[:100]}...")
     # agent = create_agent(task="query")
     # final_answer = agent.run(query)
@@ -90,8 +163,9 @@ def get_chat(query: str):
     #         response["sql_result"] = sql_result
     try:
         logger.debug("Starting agent run with trace")
-        trace = agent.run_with_trace(query, use_enhanced_task=True)
-        final_answer = trace.final_answer
+        final_answer, trace_id = await asyncio.get_running_loop().run_in_executor(
+            agent_executor, functools.partial(_run_agent, query, use_cache)
+        )
         final_answer = json.loads(final_answer)
         logger.info("Chat request completed successfully")
         return final_answer
@@ -7,17 +7,22 @@ from smolagents import (
     FinalAnswerTool,
     UserInputTool,
 )
-from querygpt.core.sql_generator import generate_sql_from_context, validate_and_run_sql
-from querygpt.core.retreivers import get_context
+from querygpt.core.sql_generator import (
+    generate_sql_from_context,
+    validate_and_run_sql,
+)
+from querygpt.core.retreivers import get_context, get_context_many
 from typing import List, Any, Dict
 from querygpt.config.config import init_config
-from querygpt.core.index import get_index
+from querygpt.core.index import get_index, get_table_index
 from querygpt.core import (
     init_database_from_config,
     init_internal_database_from_config,
     chat_completion_from_config,
 )
 from querygpt.core.logging import get_logger
+from querygpt.core.result_cache import ResultCache
+from querygpt.core.semantic_cache import SemanticCache
 import json
 
 logger = get_logger(__name__)
@@ -29,6 +34,15 @@ source_dbs = [init_database_from_config(source.database) for source in config.so
 source_db = source_dbs[0]  # TMP: as we only support one source for now.
 internal_db = init_internal_database_from_config(config.internal_db)
 index = get_index(config.index)
+table_index = get_table_index(config.index, embedder=index.embedder) if config.index.two_stage else None
+result_cache = (
+    ResultCache(internal_db, config.result_cache) if config.result_cache.enabled else None
+)
+semantic_cache = (
+    SemanticCache(internal_db, index.embedder, source_db, config.semantic_cache, result_cache)
+    if config.semantic_cache.enabled
+    else None
+)
 
 
 class TableListerTool(Tool):
@@ -178,16 +192,19 @@ class TableSampleTool(Tool):
         logger.debug(f"Getting sample data for table: {table_schema}.{table_name}")
         try:
             samples = source_db.get_table_sample_data(table_schema, table_name)
-            # quick-fix: to handle timestamp be json serilazble :(
-            for col in samples.select_dtypes(include=["datetime"]).columns:
-                samples[col] = samples[col].dt.strftime("%Y-%m-%dT%H:%M:%S")
-            result = json.dumps(samples.to_dict(orient="records"))
-            logger.debug(f"Retrieved {len(samples)} sample rows for table {table_schema}.{table_name}")
-            return result
+            return self._respond(samples, table_schema, table_name)
         except Exception as e:
             logger.error(f"Error getting sample data for {table_schema}.{table_name}: {e}")
             return json.dumps({"error": str(e)})
 
+    def _respond(self, samples, table_schema: str, table_name: str):
+        # quick-fix: to handle timestamp be json serilazble :(
+        for col in samples.select_dtypes(include=["datetime"]).columns:
+            samples[col] = samples[col].dt.strftime("%Y-%m-%dT%H:%M:%S")
+        result = json.dumps(samples.to_dict(orient="records"))
+        logger.debug(f"Retrieved {len(samples)} sample rows for table {table_schema}.{table_name}")
+        return result
+
 
 class InisghtGeneratorTool(Tool):
     name = "generate_insghits_from_sql_result"
@@ -279,16 +296,34 @@ class SqlExecutorTool(Tool):
 
     def forward(self, sql: str):
         logger.debug(f"Executing SQL: {sql[:100]}...")
-        result, error = validate_and_run_sql(sql=sql, database=source_db)
+        result, error = validate_and_run_sql(sql=sql, database=source_db, cache=result_cache)
+        if not error:
+            self._final_sql = sql
+        return self._respond(result, error)
+
+    def _respond(self, result, error):
         if not error:
+            truncated = result.attrs.get("truncated", False)
             for col in result.select_dtypes(include=["datetime"]).columns:
                 result[col] = result[col].dt.strftime("%Y-%m-%dT%H:%M:%S")
             result = result.to_dict(orient="records")
             self._final = result
             logger.debug(f"SQL executed successfully, returned {len(result)} rows")
+            if truncated:
+                logger.warning(f"SQL result truncated to {len(result)} rows")
+                return json.dumps(
+                    {
+                        "result": result,
+                        "truncated": True,
+                        "message": f"the result was cut to its first {len(result)} rows, aggregate or add a LIMIT to get a complete result",
+                    }
+                )
             return json.dumps(result)
         else:
             logger.error(f"SQL execution failed: {error}")
+            if isinstance(error, dict):
+                # structured errors, e.g. from the cost guard, already carry an `error` key
+                return json.dumps(error)
             return json.dumps({"error": error})
 
 
@@ -307,7 +342,37 @@ class ContextRetrieverTool(Tool):
     def forward(self, query: str):
         return json.dumps(
             get_context(
-                query=query, index=index, internal_db=internal_db, source=source_db
+                query=query,
+                index=index,
+                internal_db=internal_db,
+                source=source_db,
+                table_index=table_index,
+                top_tables=config.index.top_tables,
+            )
+        )
+
+
+class BatchContextRetrieverTool(Tool):
+    name = "batch_context_retiver"
+    description = """same as context_retiver, for several natural language (sub-)questions at once: the similarity search runs for all of them in one batch, and
+    the tables and columns retrieved by more than one question are returned once, with their documentation and schema. prefer it over calling context_retiver in a loop."""
+    inputs = {
+        "queries": {
+            "type": "array",
+            "description": "natural questions to fetch most similar tables and columns with",
+        }
+    }
+    output_type = "string"
+
+    def forward(self, queries: List[str]):
+        return json.dumps(
+            get_context_many(
+                queries=queries,
+                index=index,
+                internal_db=internal_db,
+                source=source_db,
+                table_index=table_index,
+                top_tables=config.index.top_tables,
             )
         )
 